@@ -0,0 +1,180 @@
+# BSD 3-Clause License
+#
+# Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the psutil authors nor the names of its contributors
+#    may be used to endorse or promote products derived from this software without
+#    specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Benchmark the CPU Adam engines of FP16Adam on the params of a chunk.
+
+The engines are:
+    cpu_adam: the C++ extension (cpu_adam.cpp), updating param by param.
+    foreach: `torch._foreach_*` ops over the params of the chunk
+        (`use_foreach_adam`).
+    torch: a sequence of elementwise ops per param, the GPU fallback.
+
+The params are slices of a fp32 chunk with fp16 grads, e.g.
+
+    python adam_benchmark.py --chunk_size 16777216 --param_numel 65536
+"""
+
+import argparse
+import math
+import time
+
+import torch
+
+from patrickstar.ops.fp16_cpu_adam import foreach_adam_update
+from patrickstar.ops.op_builder.cpu_adam import CPUAdamBuilder
+
+
+def add_args(parser):
+    group = parser.add_argument_group(title="adam benchmark")
+    group.add_argument(
+        "--chunk_size",
+        type=int,
+        default=16 * 1024 * 1024,
+        help="Number of elements in a chunk.",
+    )
+    group.add_argument(
+        "--param_numel",
+        type=int,
+        default=1024 * 1024,
+        help="Number of elements of every param in the chunk.",
+    )
+    group.add_argument("--warmup", type=int, default=2, help="Warmup iterations.")
+    group.add_argument("--iters", type=int, default=10, help="Measured iterations.")
+    return parser
+
+
+LR = 1e-3
+BETA1 = 0.9
+BETA2 = 0.999
+EPS = 1e-8
+WEIGHT_DECAY = 0.01
+
+
+def _slices(chunk, param_numel):
+    return [
+        chunk.narrow(0, start, min(param_numel, chunk.numel() - start))
+        for start in range(0, chunk.numel(), param_numel)
+    ]
+
+
+def _cpu_adam(cpu_adam_op, step, datas, grads, exp_avgs, exp_avg_sqs):
+    for data, grad, exp_avg, exp_avg_sq in zip(datas, grads, exp_avgs, exp_avg_sqs):
+        cpu_adam_op.adam_update(
+            0,
+            step,
+            LR,
+            BETA1,
+            BETA2,
+            EPS,
+            WEIGHT_DECAY,
+            True,
+            data,
+            grad,
+            exp_avg,
+            exp_avg_sq,
+            -1,
+        )
+
+
+def _foreach(step, datas, grads, exp_avgs, exp_avg_sqs):
+    foreach_adam_update(
+        datas,
+        grads,
+        exp_avgs,
+        exp_avg_sqs,
+        LR,
+        BETA1,
+        BETA2,
+        EPS,
+        WEIGHT_DECAY,
+        1 - BETA1 ** step,
+        1 - BETA2 ** step,
+    )
+
+
+def _torch(step, datas, grads, exp_avgs, exp_avg_sqs):
+    bias_correction1 = 1 - BETA1 ** step
+    bias_correction2 = 1 - BETA2 ** step
+    for data, grad, exp_avg, exp_avg_sq in zip(datas, grads, exp_avgs, exp_avg_sqs):
+        grad = grad.float().add_(data, alpha=WEIGHT_DECAY)
+        exp_avg.mul_(BETA1).add_(grad, alpha=1 - BETA1)
+        exp_avg_sq.mul_(BETA2).addcmul_(grad, grad, value=1 - BETA2)
+        denom = (exp_avg_sq.sqrt() / math.sqrt(bias_correction2)).add_(EPS)
+        data.addcdiv_(exp_avg, denom, value=-LR / bias_correction1)
+
+
+def main(args):
+    torch.manual_seed(0)
+    chunks = [torch.randn(args.chunk_size) for _ in range(3)]
+    grad_chunk = torch.randn(args.chunk_size).half()
+
+    engines = {
+        "foreach": _foreach,
+        "torch": _torch,
+    }
+    try:
+        try:
+            from patrickstar.ops.adam import cpu_adam_op
+        except ImportError:
+            start = time.time()
+            cpu_adam_op = CPUAdamBuilder().load()
+            print(f"cpu_adam JIT load takes {time.time() - start:.3f} s")
+        cpu_adam_op.create_adam(0, LR, BETA1, BETA2, EPS, WEIGHT_DECAY, False, False)
+        engines["cpu_adam"] = lambda *inputs: _cpu_adam(cpu_adam_op, *inputs)
+    except Exception as e:
+        print(f"Skip cpu_adam, the extension is not available: {e}")
+
+    print(
+        f"chunk size {args.chunk_size}, param numel {args.param_numel}, "
+        f"{torch.get_num_threads()} threads"
+    )
+    print(f"{'engine':>16}{'latency (ms)':>16}{'elem/s (G)':>16}")
+    for name, func in engines.items():
+        datas, exp_avgs, exp_avg_sqs = [
+            _slices(chunk.clone(), args.param_numel) for chunk in chunks
+        ]
+        exp_avg_sqs = [t.abs_() for t in exp_avg_sqs]
+        grads = _slices(grad_chunk, args.param_numel)
+        for step in range(1, args.warmup + 1):
+            func(step, datas, grads, exp_avgs, exp_avg_sqs)
+        start = time.time()
+        for step in range(args.warmup + 1, args.warmup + args.iters + 1):
+            func(step, datas, grads, exp_avgs, exp_avg_sqs)
+        latency = (time.time() - start) / args.iters
+        print(
+            f"{name:>16}{latency * 1e3:>16.3f}"
+            f"{args.chunk_size / latency / 1e9:>16.3f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PatrickStar Adam Benchmark")
+    parser = add_args(parser)
+    args = parser.parse_args()
+    main(args)
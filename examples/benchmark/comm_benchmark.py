@@ -0,0 +1,162 @@
+# BSD 3-Clause License
+#
+# Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the psutil authors nor the names of its contributors
+#    may be used to endorse or promote products derived from this software without
+#    specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Benchmark the collective patterns used by PatrickStar client.
+
+The patterns are:
+    allgather: fetch remote chunks of a comm group (default mode).
+    bcast: fetch remote chunks one by one (memory saving comm).
+    reduce_scatter: average grads of a comm group (default mode).
+    reduce: average grads one by one (memory saving comm).
+
+Processes are launched with torch.multiprocessing, so that the benchmark can
+run with gloo on CPU-only machines, e.g.
+
+    python comm_benchmark.py --nproc 4 --backend gloo --chunk_size 1048576
+"""
+
+import argparse
+import os
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+
+def add_args(parser):
+    group = parser.add_argument_group(title="comm benchmark")
+    group.add_argument("--nproc", type=int, default=2, help="Number of processes.")
+    group.add_argument(
+        "--backend",
+        type=str,
+        default="gloo",
+        choices=["gloo", "nccl"],
+        help="Backend of torch.distributed.",
+    )
+    group.add_argument(
+        "--chunk_size",
+        type=int,
+        default=1024 * 1024,
+        help="Chunk size in fp16 elements.",
+    )
+    group.add_argument("--warmup", type=int, default=2, help="Warmup iterations.")
+    group.add_argument("--iters", type=int, default=10, help="Measured iterations.")
+    group.add_argument(
+        "--master_port", type=str, default="29510", help="Port of the master process."
+    )
+    return parser
+
+
+def _sync(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+
+
+def _allgather(payload_list, rank, world_size):
+    dist.all_gather(payload_list, payload_list[rank])
+
+
+def _bcast(payload_list, rank, world_size):
+    for src_rank, payload in enumerate(payload_list):
+        dist.broadcast(payload, src=src_rank)
+
+
+def _reduce_scatter(payload_list, rank, world_size):
+    dist.reduce_scatter(payload_list[rank], payload_list)
+
+
+def _reduce(payload_list, rank, world_size):
+    for target_rank, payload in enumerate(payload_list):
+        dist.reduce(payload, target_rank)
+
+
+PATTERNS = {
+    "allgather": _allgather,
+    "bcast": _bcast,
+    "reduce_scatter": _reduce_scatter,
+    "reduce": _reduce,
+}
+
+
+def _worker(rank, args):
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = args.master_port
+    dist.init_process_group(args.backend, rank=rank, world_size=args.nproc)
+    if args.backend == "nccl":
+        torch.cuda.set_device(rank)
+        device = torch.device(f"cuda:{rank}")
+    else:
+        device = torch.device("cpu")
+    world_size = args.nproc
+
+    # A comm group of world_size fp16 chunks.
+    payload_list = [
+        torch.ones(args.chunk_size, dtype=torch.half, device=device)
+        for _ in range(world_size)
+    ]
+    chunk_bytes = args.chunk_size * 2
+
+    results = []
+    for name, func in PATTERNS.items():
+        if name == "reduce_scatter" and args.backend == "gloo":
+            # gloo does not support reduce scatter.
+            continue
+        for _ in range(args.warmup):
+            func(payload_list, rank, world_size)
+        _sync(device)
+        dist.barrier()
+        start = time.time()
+        for _ in range(args.iters):
+            func(payload_list, rank, world_size)
+        _sync(device)
+        latency = (time.time() - start) / args.iters
+        # The data of the whole comm group moved per iteration.
+        comm_bytes = chunk_bytes * world_size
+        results.append((name, comm_bytes, latency))
+
+    if rank == 0:
+        print(
+            f"backend {args.backend}, world size {world_size}, "
+            f"chunk size {args.chunk_size} elements"
+        )
+        print(f"{'pattern':>16}{'bytes':>16}{'latency (ms)':>16}{'algbw (GB/s)':>16}")
+        for name, comm_bytes, latency in results:
+            print(
+                f"{name:>16}{comm_bytes:>16}{latency * 1e3:>16.3f}"
+                f"{comm_bytes / latency / 1e9:>16.3f}"
+            )
+    dist.destroy_process_group()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PatrickStar Comm Benchmark")
+    parser = add_args(parser)
+    args = parser.parse_args()
+    mp.spawn(_worker, args=(args,), nprocs=args.nproc)
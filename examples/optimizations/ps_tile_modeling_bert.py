@@ -65,7 +65,7 @@ from transformers.models.bert.modeling_bert import BertEmbeddings, BertPooler
 from transformers.activations import ACT2FN
 
 
-from .tiling import TiledLinear
+from patrickstar.ops import TiledLinear
 from . import global_opt_flags as global_opt_flags
 
 
@@ -488,7 +488,7 @@ class BertEncoder(nn.Module):
 
             if self.gradient_checkpointing and self.training:
                 if global_opt_flags.USE_ACT_OFFLOAD:
-                    from optimizations.checkpoint import checkpoint as ckp
+                    from patrickstar.core import checkpoint as ckp
                 else:
                     from torch.utils.checkpoint import checkpoint as ckp
                 if use_cache:
@@ -52,6 +52,13 @@ def _add_patrick_star_args(parser):
         help="Using CPU to perform Embedding and do not assign "
         "embedding params to chunks",
     )
+    group.add_argument(
+        "--sparse_embedding_grad",
+        dest="sparse_embedding_grad",
+        action="store_true",
+        help="Use row-sparse gradient for the CPU Embedding. "
+        "Only valid with --use_cpu_embedding.",
+    )
     group.add_argument(
         "--release_after_init",
         action="store_true",
@@ -93,6 +100,20 @@ def _add_patrick_star_args(parser):
         action="store_true",
         help="Use communication saving memory.",
     )
+    group.add_argument(
+        "--msc_max_inflight",
+        type=int,
+        default=1,
+        help="Number of chunks in flight for the pipelined memory saving "
+        "communication. 1 means no pipelining.",
+    )
+    group.add_argument(
+        "--replication_factor",
+        type=int,
+        default=1,
+        help="Number of replicas of the model states. The chunks are sharded "
+        "among world_size / replication_factor processes. 1 means fully sharded.",
+    )
     group.add_argument(
         "--with_mem_cache",
         action="store_true",
@@ -103,6 +124,12 @@ def _add_patrick_star_args(parser):
         action="store_true",
         help="Use asynchronize move.",
     )
+    group.add_argument(
+        "--with_cpu_affinity",
+        action="store_true",
+        help="Bind each local rank to the cores and memory of the NUMA node "
+        "of its GPU.",
+    )
     group.add_argument(
         "--slog_file",
         type=str,
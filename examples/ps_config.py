@@ -57,6 +57,7 @@ def get_patrickstar_config(
         "release_after_init": args.release_after_init,
         "use_fake_dist": args.use_fake_dist,
         "use_cpu_embedding": args.use_cpu_embedding,
+        "sparse_embedding_grad": args.sparse_embedding_grad,
         "client": {
             "mem_tracer": {
                 "use_async_mem_monitor": args.with_async_mem_monitor,
@@ -69,8 +70,12 @@ def get_patrickstar_config(
             },
             "opts": {
                 "with_mem_saving_comm": args.with_mem_saving_comm,
+                "msc_max_inflight": args.msc_max_inflight,
+                "replication_factor": args.replication_factor,
                 "with_mem_cache": args.with_mem_cache,
                 "with_async_move": args.with_async_move,
+                "with_cpu_affinity": args.with_cpu_affinity,
+                "with_activation_offload": args.with_activation_offload,
             },
         },
     }
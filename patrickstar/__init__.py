@@ -29,8 +29,12 @@
 
 from .core import PatrickStarClient
 from .core.memtracer import RuntimeMemTracer
-from .ops import FP16Adam
-from .runtime import initialize_engine
+from .ops import FP16Adam, FP16Lamb, FP16Adafactor
+from .runtime import (
+    initialize_engine,
+    initialize_inference_engine,
+    BatchInferenceRunner,
+)
 from .utils import global_timer
 from .utils import see_memory_usage
 from .utils.model_size_calculator import get_ps_model_size, estimate_bert_mac
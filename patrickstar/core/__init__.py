@@ -27,11 +27,13 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+from .access_plan import ModuleAccessPlan, ParamAccessPlan
+from .activation import ActivationStore, checkpoint
 from .chunk_data import Chunk
 from .chunk_list import ChunkList
 from .chunk_tensor_index import ChunkTensorIndex
 from .client import PatrickStarClient
 from .const import AccessType, ChunkState, TensorState, TrainingStage, ChunkType
-from .hook import setup_patrickstar_hooks
+from .hook import setup_patrickstar_hooks, setup_patrickstar_inference_hooks
 from .parameter import PSParameter, register_param, is_param_registered, ParamType
-from .preprocess import PSPreProcessCtx, torch_scope
+from .preprocess import PSPreProcessCtx, torch_scope, frozen_scope
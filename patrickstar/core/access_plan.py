@@ -0,0 +1,108 @@
+# BSD 3-Clause License
+#
+# Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the psutil authors nor the names of its contributors
+#    may be used to endorse or promote products derived from this software without
+#    specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from typing import List
+
+import torch
+
+from .const import AccessType, ParamType
+
+
+class ParamAccessPlan(object):
+    r"""The resolved chunk info of a tensor of a chunk based param.
+
+    It is everything `access_dist` and `release_dist` look up in
+    `ChunkTensorIndex` for the tensor, which never changes after the
+    chunk-tensor-mapping is finished.
+    """
+
+    __slots__ = (
+        "param",
+        "access_type",
+        "tensor_id",
+        "chunk_id",
+        "chunk_id_list",
+        "local_chunk_id",
+        "comm_group_id",
+        "start_offset",
+        "numel",
+    )
+
+    def __init__(
+        self,
+        param: torch.nn.Parameter,
+        access_type: AccessType,
+        tensor_id: int,
+        chunk_id: int,
+        chunk_id_list: List[int],
+        local_chunk_id: int,
+        comm_group_id: int,
+        start_offset: int,
+        numel: int,
+    ):
+        self.param = param
+        self.access_type = access_type
+        self.tensor_id = tensor_id
+        self.chunk_id = chunk_id
+        self.chunk_id_list = chunk_id_list
+        self.local_chunk_id = local_chunk_id
+        self.comm_group_id = comm_group_id
+        self.start_offset = start_offset
+        self.numel = numel
+
+    def __str__(self):
+        return (
+            f"name: {self.param.ps_attr.name}, chunk_id: {self.chunk_id}, "
+            f"comm_group_id: {self.comm_group_id}, "
+            f"local_chunk_id: {self.local_chunk_id}, "
+            f"start_offset: {self.start_offset}, numel: {self.numel}"
+        )
+
+
+class ModuleAccessPlan(object):
+    r"""The access plan of the chunk based params directly owned by a module.
+
+    Compiled once when the hooks are registered in `client.init`, so that
+    the module hooks run over the resolved param list instead of calling
+    `named_parameters`, filtering the torch based params and searching
+    `ChunkTensorIndex` for every param at every step.
+    """
+
+    def __init__(self, module: torch.nn.Module, client):
+        self.param_plans = []
+        for param in module.parameters(recurse=False):
+            if param.ps_attr.param_type == ParamType.TORCH_BASED:
+                continue
+            self.param_plans.append(client.compile_access_plan(param, AccessType.DATA))
+
+    def __len__(self):
+        return len(self.param_plans)
+
+    def __iter__(self):
+        return iter(self.param_plans)
@@ -0,0 +1,318 @@
+# BSD 3-Clause License
+#
+# Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the psutil authors nor the names of its contributors
+#    may be used to endorse or promote products derived from this software without
+#    specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import torch
+from torch.utils.checkpoint import (
+    check_backward_validity,
+    get_device_states,
+    set_device_states,
+)
+
+from .const import ChunkType, TensorState
+
+
+def is_activation_to_checkpoint(item):
+    r"""Only the floating point tensors are stored in the activation chunks."""
+    return torch.is_tensor(item) and item.is_floating_point()
+
+
+class ActivationStore(object):
+    r"""Storing the checkpointed activations in chunks of type ACTIVATION.
+
+    The activations saved in the forward pass are packed in order into
+    chunks of the default chunk size, one pool of chunks per dtype. The
+    chunks live in the chunk list of the client, so their memory is
+    accounted by `RuntimeMemTracer`, they can be moved away by the chunk
+    eviction policy when the device runs out of room, and they are moved
+    back to the compute device before the recomputation. The chunk of
+    the activations to be recomputed next is prefetched.
+
+    A chunk is in HOLD state while it stores activations that the backward
+    pass has not consumed yet, and it is released when all of them are
+    consumed. The chunks are reused across iterations.
+    """
+
+    # The store used by `checkpoint`, set when the training engine
+    # initializes the client.
+    current = None
+
+    def __init__(self, client):
+        self.client = client
+        self.offload = client.opt_config["with_activation_offload"]
+        # dtype -> ids of the activation chunks in the order of filling.
+        self._chunk_pools = {}
+        # chunk_id -> position in its pool.
+        self._chunk_pos = {}
+        # dtype -> (position of the chunk being filled, offset in it).
+        self._cursors = {}
+        # chunk_id -> number of activations not consumed by backward yet.
+        self._live = {}
+
+    def _storage_device(self):
+        if self.offload:
+            return torch.device("cpu:0")
+        return self.client.device
+
+    def _fill_chunk(self, dtype, numel):
+        r"""Find the chunk and the offset to store `numel` elements of `dtype`."""
+        chunk_list = self.client.chunk_list
+        chunk_size = self.client.default_chunk_size
+        pool = self._chunk_pools.setdefault(dtype, [])
+        pos, offset = self._cursors.get(dtype, (0, 0))
+        if offset + numel > chunk_size:
+            pos += 1
+            offset = 0
+        if pos == len(pool):
+            chunk_id = chunk_list.generate_chunk_id()
+            chunk_list.new_chunk(
+                chunk_id, chunk_size, dtype, chunk_type=ChunkType.ACTIVATION
+            )
+            self._chunk_pos[chunk_id] = pos
+            pool.append(chunk_id)
+        self._cursors[dtype] = (pos, offset + numel)
+        return pool[pos], offset
+
+    def save(self, tensor):
+        r"""Copy `tensor` into the activation chunks.
+
+        Args:
+            tensor: :class:`torch.Tensor`. A floating point tensor.
+        Returns:
+            The handle for `load` and `release`.
+        """
+        numel = tensor.numel()
+        if numel > self.client.default_chunk_size:
+            # Too large to fit in a chunk, keep a copy outside the chunks.
+            return (None, 0, numel, tensor.shape, tensor.to(self._storage_device()))
+
+        chunk_list = self.client.chunk_list
+        chunk_id, offset = self._fill_chunk(tensor.dtype, numel)
+        chunk = chunk_list[chunk_id]
+        if chunk.payload is None:
+            device = self._storage_device()
+            self.client.chunk_eviction_strategy.trace_access(chunk_id, device)
+            chunk_list.access_chunk(chunk_id, device)
+        chunk.payload.narrow(0, offset, numel).copy_(tensor.reshape(-1))
+
+        live = self._live.get(chunk_id, 0) + 1
+        self._live[chunk_id] = live
+        chunk.reset_state(TensorState.HOLD, live)
+        return (chunk_id, offset, numel, tensor.shape, None)
+
+    def load(self, handle):
+        r"""Bring the activation of `handle` to the compute device.
+
+        The chunk is kept on the compute device until `release`.
+        """
+        chunk_id, offset, numel, shape, tensor = handle
+        device = self.client.device
+        if chunk_id is None:
+            return tensor.to(device)
+
+        chunk_list = self.client.chunk_list
+        chunk = chunk_list[chunk_id]
+        self.client.chunk_eviction_strategy.trace_access(chunk_id, device)
+        chunk_list.access_chunk(chunk_id, device)
+        chunk.update_state(TensorState.HOLD, TensorState.COMPUTE)
+        self._prefetch(chunk_id)
+        return chunk.payload.narrow(0, offset, numel).view(shape)
+
+    def _prefetch(self, chunk_id):
+        r"""Move the chunk recomputed next, i.e. the one filled before
+        `chunk_id`, to the compute device if there is room.
+        """
+        pos = self._chunk_pos[chunk_id]
+        if pos == 0:
+            return
+        chunk_list = self.client.chunk_list
+        pool = self._chunk_pools[chunk_list[chunk_id].data_type]
+        next_chunk_id = pool[pos - 1]
+        next_chunk = chunk_list[next_chunk_id]
+        device = self.client.device
+        if next_chunk.payload is None or next_chunk.get_device().type == device.type:
+            return
+        payload_space = next_chunk.get_payload_space()
+        if self.client.mem_tracer.remaining_chunk_mem(device.type) >= payload_space:
+            self.client.chunk_eviction_strategy.trace_access(next_chunk_id, device)
+            chunk_list.chunk_move(next_chunk_id, device)
+
+    def release(self, handle):
+        r"""Mark the activation of `handle` as consumed by backward.
+
+        The payload of the chunk is released after all the activations
+        in it are consumed.
+        """
+        chunk_id = handle[0]
+        if chunk_id is None:
+            return
+        chunk = self.client.chunk_list[chunk_id]
+        chunk.update_state(TensorState.COMPUTE, TensorState.FREE)
+        live = self._live[chunk_id] - 1
+        if live == 0:
+            del self._live[chunk_id]
+            chunk.release_payload()
+            chunk.reset_state(TensorState.FREE, 0)
+        else:
+            self._live[chunk_id] = live
+
+    def reset(self):
+        r"""Release the activations left by the last iteration.
+
+        Called before forward, e.g. the activations saved in an evaluation
+        forward without backward are dropped here.
+        """
+        chunk_list = self.client.chunk_list
+        for chunk_id in self._live:
+            chunk = chunk_list[chunk_id]
+            if chunk.payload is not None:
+                chunk.release_payload()
+            chunk.reset_state(TensorState.FREE, 0)
+        self._live = {}
+        self._cursors = {}
+
+
+class CheckpointFunction(torch.autograd.Function):
+    r"""Activation checkpointing with the inputs stored in `ActivationStore`.
+
+    The same as `torch.utils.checkpoint.CheckpointFunction`, except that
+    the floating point inputs are saved to the activation chunks instead
+    of the autograd context.
+    """
+
+    @staticmethod
+    def forward(ctx, run_function, preserve_rng_state, *args):
+        check_backward_validity(args)
+        ctx.run_function = run_function
+        ctx.preserve_rng_state = preserve_rng_state
+        if preserve_rng_state:
+            ctx.fwd_cpu_state = torch.get_rng_state()
+            ctx.had_cuda_in_fwd = False
+            if torch.cuda._initialized:
+                ctx.had_cuda_in_fwd = True
+                ctx.fwd_gpu_devices, ctx.fwd_gpu_states = get_device_states(*args)
+
+        with torch.no_grad():
+            outputs = run_function(*args)
+
+        store = ActivationStore.current
+        ctx.store = store
+        ctx.handles = []
+        ctx.other_args = []
+        ctx.requires_grad = []
+        for arg in args:
+            if is_activation_to_checkpoint(arg):
+                ctx.handles.append(store.save(arg))
+                ctx.other_args.append(None)
+                ctx.requires_grad.append(arg.requires_grad)
+            else:
+                ctx.handles.append(None)
+                ctx.other_args.append(arg)
+                ctx.requires_grad.append(False)
+        return outputs
+
+    @staticmethod
+    def backward(ctx, *args):
+        if not torch.autograd._is_checkpoint_valid():
+            raise RuntimeError(
+                "Checkpointing is not compatible with .grad() or when an `inputs` "
+                "parameter is passed to .backward(). Please use .backward() and "
+                "do not pass its `inputs` argument."
+            )
+        store = ctx.store
+        inputs = []
+        for handle, arg, requires_grad in zip(
+            ctx.handles, ctx.other_args, ctx.requires_grad
+        ):
+            if handle is None:
+                inputs.append(arg)
+            else:
+                tensor = store.load(handle).detach()
+                tensor.requires_grad = requires_grad
+                inputs.append(tensor)
+
+        rng_devices = []
+        if ctx.preserve_rng_state and ctx.had_cuda_in_fwd:
+            rng_devices = ctx.fwd_gpu_devices
+        with torch.random.fork_rng(devices=rng_devices, enabled=ctx.preserve_rng_state):
+            if ctx.preserve_rng_state:
+                torch.set_rng_state(ctx.fwd_cpu_state)
+                if ctx.had_cuda_in_fwd:
+                    set_device_states(ctx.fwd_gpu_devices, ctx.fwd_gpu_states)
+            with torch.enable_grad():
+                outputs = ctx.run_function(*inputs)
+
+        if isinstance(outputs, torch.Tensor):
+            outputs = (outputs,)
+
+        # Run backward() with only the tensors that require grad.
+        outputs_with_grad = []
+        args_with_grad = []
+        for i in range(len(outputs)):
+            if torch.is_tensor(outputs[i]) and outputs[i].requires_grad:
+                outputs_with_grad.append(outputs[i])
+                args_with_grad.append(args[i])
+        if len(outputs_with_grad) == 0:
+            raise RuntimeError(
+                "none of output has requires_grad=True,"
+                " this checkpoint() is not necessary"
+            )
+        torch.autograd.backward(outputs_with_grad, args_with_grad)
+        grads = tuple(
+            inp.grad if isinstance(inp, torch.Tensor) else None for inp in inputs
+        )
+
+        for handle in ctx.handles:
+            if handle is not None:
+                store.release(handle)
+        return (None, None) + grads
+
+
+def checkpoint(function, *args, preserve_rng_state=True):
+    r"""Checkpoint a part of the model with the inputs stored in chunks.
+
+    Works as `torch.utils.checkpoint.checkpoint`. The floating point inputs
+    of `function` are stored in the activation chunks of the PatrickStar
+    client, which are offloaded to CPU if `with_activation_offload` is set
+    in the client config. If no training engine is initialized, fall back
+    to `torch.utils.checkpoint.checkpoint`.
+
+    Args:
+        function: the part of the model to run in forward and recompute
+            in backward.
+        args: the inputs of `function`.
+        preserve_rng_state: bool. Stash and restore the RNG state for the
+            recomputation.
+    Returns:
+        Output of running `function` on `args`.
+    """
+    if ActivationStore.current is None:
+        return torch.utils.checkpoint.checkpoint(
+            function, *args, preserve_rng_state=preserve_rng_state
+        )
+    return CheckpointFunction.apply(function, preserve_rng_state, *args)
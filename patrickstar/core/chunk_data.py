@@ -39,6 +39,12 @@ from .const import TensorState, ChunkState
 from patrickstar.core.memory_cache import MemoryCache
 from typing import Optional
 
+_FREE = TensorState.FREE.value
+_COMPUTE = TensorState.COMPUTE.value
+_HOLD = TensorState.HOLD.value
+_HOLD_AFTER_FWD = TensorState.HOLD_AFTER_FWD.value
+_HOLD_AFTER_BWD = TensorState.HOLD_AFTER_BWD.value
+
 
 class Chunk(object):
     def __init__(
@@ -50,7 +56,6 @@ class Chunk(object):
         memory_cache: Optional[MemoryCache],
         with_async_move: bool,
         local_rank: int = 0,
-        is_dummy: bool = False,
     ):
         r"""
         Chunk is the minimal unit of the data transfer.
@@ -65,27 +70,24 @@ class Chunk(object):
             data_type: :class:`torch.dtype`.
             chunk_id: int.
             local_rank: int.
-            is_dummy: bool.
         """
         self.chunk_id = chunk_id
         # payload numel does not equal to capacity. payload can be None.
         self.capacity = capacity
         self.data_type = data_type
         self.local_rank = local_rank
-        self._is_dummy = is_dummy
         self.memory_tracer = memory_tracer
-        # the number of tensors of the chunk in each state
-        self._state_dict = {
-            TensorState.COMPUTE: 0,
-            TensorState.HOLD: 0,
-            TensorState.HOLD_AFTER_FWD: 0,
-            TensorState.HOLD_AFTER_BWD: 0,
-            TensorState.FREE: 0,
-        }
+        # the number of tensors of the chunk in each state,
+        # indexed by `TensorState.value`.
+        self._state_counter = [0] * len(TensorState)
         # the number of tensors that are not used in the forward calculation
         self.unused = 0
 
-        self.payload = None
+        self._payload = None
+        # tensor_id -> (start_offset, view) of the tensors on the payload.
+        # The views are reused by every access while the payload is resident
+        # and dropped together with the payload.
+        self._tensor_views = {}
         self._time_profile = True
         self._pin_flag = False
         self.with_mem_cache = memory_cache is not None
@@ -95,9 +97,44 @@ class Chunk(object):
         self.with_async_move = with_async_move
         if self.with_async_move:
             self.compute_finish_event = torch.cuda.Event()
+        # The event of the copy issued by `prefetch` and the source of the
+        # copy, which is kept alive until the copy is waited.
+        self._prefetch_event = None
+        self._prefetch_src = None
+
+    @property
+    def payload(self):
+        if self._prefetch_event is not None:
+            self.wait_prefetch()
+        return self._payload
+
+    @payload.setter
+    def payload(self, new_payload):
+        # In-place ops (e.g. `payload /= world_size`) reassign the same tensor.
+        if new_payload is not self._payload:
+            self._tensor_views.clear()
+        self._payload = new_payload
+
+    def tensor_view(self, tensor_id, start_offset, numel, shape):
+        r"""The view of a tensor on the payload.
+
+        The view is cached, so accessing a tensor on a resident payload
+        does not create new tensors.
 
-    def is_dummy(self):
-        return self._is_dummy
+        Args:
+            tensor_id: int.
+            start_offset: int. The start offset of the tensor in the chunk.
+            numel: int.
+            shape: :class:`torch.Size`. The shape of the view.
+        Returns:
+            :class:`torch.Tensor`.
+        """
+        cached = self._tensor_views.get(tensor_id)
+        if cached is not None and cached[0] == start_offset:
+            return cached[1]
+        view = self.payload.narrow(0, start_offset, numel).view(shape)
+        self._tensor_views[tensor_id] = (start_offset, view)
+        return view
 
     def get_chunk_space(self):
         r"""Size of the chunk (Bytes)."""
@@ -105,10 +142,10 @@ class Chunk(object):
 
     def get_payload_space(self):
         r"""Size of the payload (Bytes)."""
-        if self.payload is None:
+        if self._payload is None:
             return 0
         else:
-            return getsizeof(self.payload.dtype) * self.payload.numel()
+            return getsizeof(self._payload.dtype) * self._payload.numel()
 
     def pin(self):
         self._pin_flag = True
@@ -136,7 +173,10 @@ class Chunk(object):
         if self.with_mem_cache:
             try:
                 self.payload = self.memory_cache.pop_or_allocate(
-                    device, payload_numel, self.data_type, device.type == "cpu"
+                    device,
+                    payload_numel,
+                    self.data_type,
+                    device.type == "cpu" and torch.cuda.is_available(),
                 )
             except RuntimeError:
                 if self._time_profile:
@@ -150,7 +190,8 @@ class Chunk(object):
                     payload_numel,
                     dtype=self.data_type,
                     device=device,
-                    pin_memory=(device.type == "cpu"),
+                    # Pinned memory is not available without GPU.
+                    pin_memory=(device.type == "cpu" and torch.cuda.is_available()),
                 )
                 self.memory_tracer.add(
                     device.type,
@@ -187,7 +228,6 @@ class Chunk(object):
                 self.get_payload_space(),
                 self.payload.is_pinned(),
             )
-            del self.payload
             self.payload = None
         if profiler.started():
             profiler.chunk_life_cycle[self.chunk_id]["life_cycle"].append(
@@ -201,16 +241,45 @@ class Chunk(object):
             old_state: :class:`TensorState`.
             new_state: :class:`TensorState`.
         """
-        self._state_dict[old_state] -= 1
-        self._state_dict[new_state] += 1
+        self._state_counter[old_state.value] -= 1
+        self._state_counter[new_state.value] += 1
         if (
             self.with_async_move
             and old_state == TensorState.COMPUTE
-            and self._state_dict[TensorState.COMPUTE] == 0
+            and self._state_counter[_COMPUTE] == 0
         ):
             cuda_ctx = CUDAContext()
             self.compute_finish_event.record(cuda_ctx.compute_stream)
 
+    def reset_state(self, new_state, num_tensors):
+        r"""Set the state counter as if all `num_tensors` tensors of the chunk
+        are in `new_state`.
+
+        Args:
+            new_state: :class:`TensorState`.
+            num_tensors: int.
+        """
+        counter = self._state_counter
+        finish_compute = (
+            self.with_async_move
+            and counter[_COMPUTE] > 0
+            and new_state != TensorState.COMPUTE
+        )
+        for i in range(len(counter)):
+            counter[i] = 0
+        counter[new_state.value] = num_tensors
+        if finish_compute:
+            cuda_ctx = CUDAContext()
+            self.compute_finish_event.record(cuda_ctx.compute_stream)
+
+    def tensor_state_num(self, state):
+        r"""The number of tensors in `state`.
+
+        Notice that the number of `FREE` tensors is only accurate after
+        `reset_state`, as the tensors are not counted when inserted.
+        """
+        return self._state_counter[state.value]
+
     def get_state(self):
         """
         When payload is None, the state is `RELEASED`,
@@ -219,17 +288,18 @@ class Chunk(object):
         Returns:
             :class:`ChunkState`.
         """
-        if self.payload is None:
+        if self._payload is None:
             return ChunkState.RELEASED
 
         # Distributed training need to fix the chunk on the compute device.
-        if self._state_dict[TensorState.COMPUTE] > 0:
+        counter = self._state_counter
+        if counter[_COMPUTE] > 0:
             return ChunkState.COMPUTE
-        elif self._state_dict[TensorState.HOLD] > 0:
+        elif counter[_HOLD] > 0:
             return ChunkState.HOLD
-        elif self._state_dict[TensorState.HOLD_AFTER_FWD] > 0:
+        elif counter[_HOLD_AFTER_FWD] > 0:
             return ChunkState.HOLD_AFTER_FWD
-        elif self._state_dict[TensorState.HOLD_AFTER_BWD] > 0:
+        elif counter[_HOLD_AFTER_BWD] > 0:
             return ChunkState.HOLD_AFTER_BWD
         else:
             return ChunkState.FREE
@@ -237,18 +307,21 @@ class Chunk(object):
     def all_tensor_state(self, state):
         r"""If all tensors are in the state or `FREE`.
 
+        The tensors unused in the last forward calculation are ignored.
+
         Args:
             state: :class:`TensorState`.
         Return:
             bool.
         """
-        for k, v in self._state_dict.items():
-            if k != TensorState.FREE and k != state:
-                if v != 0:
-                    # Ignore the unused tensors.
-                    if k == TensorState.HOLD and v == self.unused:
-                        continue
-                    return False
+        target = state.value
+        for value, num in enumerate(self._state_counter):
+            if num == 0 or value == _FREE or value == target:
+                continue
+            # Ignore the unused tensors.
+            if value == _HOLD and num == self.unused:
+                continue
+            return False
         return True
 
     def set_unused(self):
@@ -256,9 +329,10 @@ class Chunk(object):
         After forward calculation, the tensors in `HOLD` state are the ones
         that are not used. Remember them for the release.
         NOTE() This function can only be called at the end of forward calculation.
+        The count is reset when the chunk is used in the next forward.
         """
         # TODO(zilinzhu) Find a better way to represent the unused tensors
-        self.unused = self._state_dict[TensorState.HOLD]
+        self.unused = self._state_counter[_HOLD]
 
     def move(self, target_device: torch.device):
         r"""
@@ -303,7 +377,10 @@ class Chunk(object):
             # TODO(jiaruifang) asyc copy.
             if target_device.type == "cpu":
                 pinned_payload_cpu = self.memory_cache.pop_or_allocate(
-                    target_device, payload_numel, self.payload.dtype, True
+                    target_device,
+                    payload_numel,
+                    self.payload.dtype,
+                    torch.cuda.is_available(),
                 )
                 pinned_payload_cpu.reshape(self.payload.shape)
                 pinned_payload_cpu.copy_(self.payload)
@@ -324,7 +401,7 @@ class Chunk(object):
                     self.payload.shape,
                     dtype=self.payload.dtype,
                     device="cpu:0",
-                    pin_memory=True,
+                    pin_memory=torch.cuda.is_available(),
                 )
                 pinned_payload_cpu.copy_(self.payload)
                 self.payload = pinned_payload_cpu
@@ -365,9 +442,78 @@ class Chunk(object):
                 (time.time(), "move", target_device)
             )
 
+    def prefetch(self, target_device: torch.device):
+        r"""
+        Copy the pinned CPU payload to `target_device` without blocking.
+
+        The copy is issued on the copy stream, so that it overlaps with the
+        computation on the compute stream. The first use of the payload
+        waits for the copy, see `wait_prefetch`.
+        NOTE() Please check if the `target_device` has enough room before.
+
+        Args:
+            target_device: :class:`torch.device`.
+        """
+        src_payload = self._payload
+        assert src_payload is not None and src_payload.is_pinned()
+        assert target_device.type == "cuda"
+        src_device = src_payload.device
+        cuda_ctx = CUDAContext()
+
+        if self.with_mem_cache:
+            cuda_tmp_payload = self.memory_cache.pop_or_allocate(
+                target_device, src_payload.numel(), src_payload.dtype, False
+            )
+        else:
+            cuda_tmp_payload = torch.empty(
+                src_payload.shape, dtype=src_payload.dtype, device=target_device
+            )
+        # The payload may still be written by the queued computation.
+        cuda_ctx.copy_stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(cuda_ctx.copy_stream):
+            cuda_tmp_payload.copy_(src_payload, non_blocking=True)
+        # The payload is allocated on the compute stream and written by the
+        # copy stream.
+        cuda_tmp_payload.record_stream(cuda_ctx.copy_stream)
+        prefetch_event = torch.cuda.Event()
+        prefetch_event.record(cuda_ctx.copy_stream)
+
+        self.payload = cuda_tmp_payload
+        self._prefetch_event = prefetch_event
+        self._prefetch_src = src_payload
+
+        if not self.with_mem_cache:
+            self.memory_tracer.delete(src_device.type, self.get_payload_space(), True)
+            self.memory_tracer.add(target_device.type, self.get_payload_space(), False)
+        if self._time_profile:
+            global_timer.data_move_cnter.update(
+                "chunk_cpu_gpu_move", self.get_payload_space()
+            )
+        if profiler.started():
+            profiler.chunk_life_cycle[self.chunk_id]["life_cycle"].append(
+                (time.time(), "move", target_device)
+            )
+
+    def wait_prefetch(self):
+        r"""
+        Make the current stream wait for the copy issued by `prefetch`.
+        It is called before the payload is used.
+        """
+        if self._prefetch_event is None:
+            return
+        prefetch_event = self._prefetch_event
+        self._prefetch_event = None
+        torch.cuda.current_stream().wait_event(prefetch_event)
+        if self.with_mem_cache:
+            # The cached CPU memory may be written by the host right after
+            # it is pushed back, so the copy must have finished.
+            prefetch_event.synchronize()
+            self.memory_cache.push(self._prefetch_src)
+        self._prefetch_src = None
+
     def get_device(self):
         r"""Get device of the payload of chunk, return None if not allocated."""
-        if self.payload is not None:
-            return self.payload.device
+        if self._payload is not None:
+            return self._payload.device
         else:
             return None
@@ -34,7 +34,7 @@ import torch
 from patrickstar.core.const import ChunkType
 from patrickstar.core.memtracer import RuntimeMemTracer
 from patrickstar.profiler import profiler
-from patrickstar.utils import logger, get_rank, get_world_size, log_dist
+from patrickstar.utils import logger, get_rank, get_shard_world_size, log_dist
 import logging
 import patrickstar.utils.global_timer as global_timer
 from .chunk_data import Chunk
@@ -61,10 +61,13 @@ class ChunkList(object):
         chunk_eviction_policy: ChunkEvictionPolicyBase,
         with_mem_cache: bool = False,
         with_async_move: bool = False,
+        device: torch.device = None,
     ):
         """
         Args:
             local_rank: int.
+            device: :class:`torch.device`. The compute device,
+                default to the GPU of `local_rank`.
         """
         self.id_to_chunk_map: dict[int, Chunk] = {}
         self.chunk_type_to_id_list_map: dict[ChunkType, int] = {}
@@ -74,7 +77,9 @@ class ChunkList(object):
         self._time_profile = True
         self.moments_cnt_of_iteration = None
         self.local_rank = local_rank
-        self.device = torch.device(f"cuda:{local_rank}")
+        if device is None:
+            device = torch.device(f"cuda:{local_rank}")
+        self.device = device
         self.chunk_eviction_policy = chunk_eviction_policy
         self.memory_tracer = memory_tracer
         self.with_mem_cache = with_mem_cache
@@ -83,6 +88,9 @@ class ChunkList(object):
         else:
             self.memory_cache = None
         self.with_async_move = with_async_move
+        # Ids of the chunks whose tensor states changed since the last
+        # `clear_dirty_chunk_ids`.
+        self.dirty_chunk_ids = set()
 
     def chunk_ids_generator(self, chunk_type: ChunkType):
         r"""Return the chunk_id of all chunks with type `chunk_type`
@@ -346,7 +354,6 @@ class ChunkList(object):
         chunk_id: int,
         chunk_size: int,
         data_type: torch.dtype,
-        is_dummy: bool = False,
         chunk_type: ChunkType = ChunkType.UNDEF,
     ):
         r"""Create a chunk without initializing its memory.
@@ -355,7 +362,6 @@ class ChunkList(object):
             chunk_id: int.
             chunk_size: int.
             data_type: :class:`torch.dtype`.
-            is_dummy: bool.
             chunk_type: :class:ChunkType.
         Returns:
             :class:`CommInfo`
@@ -372,9 +378,9 @@ class ChunkList(object):
             memory_cache=self.memory_cache if self.with_mem_cache else None,
             with_async_move=self.with_async_move,
             local_rank=self.local_rank,
-            is_dummy=is_dummy,
         )
-        world_size = get_world_size()
+        # With hybrid sharding, the chunks are sharded in the shard group.
+        world_size = get_shard_world_size()
         global_rank = get_rank()
         self.chunk_type_to_id_list_map[chunk_type].append(chunk_id)
         if profiler.started():
@@ -427,3 +433,12 @@ class ChunkList(object):
     def update_state(self, chunk_id, old_state, new_state):
         r"""Update the state of chunk of id `chunk_id`."""
         self.id_to_chunk_map[chunk_id].update_state(old_state, new_state)
+        self.dirty_chunk_ids.add(chunk_id)
+
+    def reset_state(self, chunk_id, new_state, num_tensors):
+        r"""Set all the `num_tensors` tensors of chunk `chunk_id` to `new_state`."""
+        self.id_to_chunk_map[chunk_id].reset_state(new_state, num_tensors)
+        self.dirty_chunk_ids.add(chunk_id)
+
+    def clear_dirty_chunk_ids(self):
+        self.dirty_chunk_ids.clear()
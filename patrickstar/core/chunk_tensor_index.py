@@ -32,7 +32,7 @@ from patrickstar.core.comm import CommInfo
 
 import torch
 
-from patrickstar.utils import logger, get_rank
+from patrickstar.utils import logger, get_shard_rank
 from .const import AccessType, ChunkType
 from .parameter import is_param_registered
 from .tensor_stub import TensorInfo
@@ -120,7 +120,7 @@ class ChunkTensorIndex(object):
         Returns:
             bool.
         """
-        rank = get_rank()
+        rank = get_shard_rank()
         comm_info = self.chunk_id_to_comm_info_map[chunk_id]
         return rank == comm_info.offset
 
@@ -171,9 +171,6 @@ class ChunkTensorIndex(object):
 
         Register the chunk_id of the chunk it belongs and its start_offset in the chunk.
         Support insert tensor between other tensors with binary search.
-
-        TODO(zilinzhu) This method is only called by `append_dummy_chunk`.
-        Remove it in the future?
         """
         if chunk_id not in self.chunk_id_to_tensor_id_list_map:
             self.chunk_id_to_tensor_id_list_map[chunk_id] = list()
@@ -27,16 +27,32 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import math
+from collections import deque
 from typing import List
 import torch
 
 import patrickstar.utils.global_timer as global_timer
-from patrickstar.utils import logger, get_world_size, get_rank, log_dist
+from patrickstar.utils import (
+    logger,
+    get_world_size,
+    get_rank,
+    get_replication_factor,
+    get_shard_rank,
+    get_shard_world_size,
+    set_replication_factor,
+    log_dist,
+    bind_cpu_affinity,
+    format_cpulist,
+    plan_cpu_affinity,
+)
+from .access_plan import ModuleAccessPlan, ParamAccessPlan
+from .activation import ActivationStore
 from .chunk_list import ChunkList, ChunkType
 from .chunk_tensor_index import ChunkTensorIndex
 from .const import AccessType, ChunkState, TensorState, TrainingStage
-from .hook import setup_patrickstar_hooks
-from .parameter import register_param, is_param_registered, ParamType
+from .hook import setup_patrickstar_hooks, setup_patrickstar_inference_hooks
+from .parameter import is_param_registered, ParamType
 from .eviction_policy import LatestAccessChunkEvictionPolicy
 from patrickstar.core.memtracer import RuntimeMemTracer
 
@@ -44,9 +60,33 @@ from patrickstar.core.memtracer import RuntimeMemTracer
 class PatrickStarClient(object):
     r"""The client for managing chunks."""
 
-    def __init__(self, rank: int, default_chunk_size: int, config=None):
+    def __init__(
+        self, rank: int, default_chunk_size: int, config=None, half_dtype=torch.half
+    ):
         self.local_rank = rank
-        self.device = torch.device(f"cuda:{rank}")
+        # The dtype of the param chunks used for computing, torch.half or
+        # torch.bfloat16. The loss scaler is not needed for bf16.
+        if half_dtype not in [torch.half, torch.bfloat16]:
+            raise ValueError(
+                f"Invalid half_dtype {half_dtype}, "
+                "allowed values are [torch.half, torch.bfloat16]"
+            )
+        self.half_dtype = half_dtype
+        compute_device = "cuda"
+        if config is not None:
+            compute_device = config.get("compute_device", "cuda")
+        if compute_device == "cpu":
+            # The device abstracted mode. The chunks visited for computing are
+            # placed on CPU and the collectives are done by gloo, so that the
+            # distributed code paths can be tested and benchmarked without GPU.
+            self.device = torch.device("cpu:0")
+        elif compute_device == "cuda":
+            self.device = torch.device(f"cuda:{rank}")
+        else:
+            raise ValueError(
+                f"Invalid compute_device {compute_device}, "
+                "allowed values are ['cuda', 'cpu']"
+            )
 
         self.module = None
 
@@ -63,6 +103,33 @@ class PatrickStarClient(object):
             "with_mem_saving_comm": False,
             "with_mem_cache": False,
             "with_async_move": False,
+            # Number of broadcasts (reduces) allowed in flight
+            # with memory saving communication.
+            "msc_max_inflight": 1,
+            # Upper bound of the memory used by the in flight chunks in bytes.
+            # 0 means no limit.
+            "msc_inflight_mem_budget": 0,
+            # Hybrid sharding. The param chunks are sharded over
+            # world_size // replication_factor processes and replicated
+            # across the shard groups.
+            "replication_factor": 1,
+            # Store the checkpointed activations on CPU.
+            "with_activation_offload": False,
+            # Bind each local rank to the physical cores of the NUMA node of
+            # its GPU, split among the local ranks on the node, size the
+            # OpenMP threads to them and allocate the CPU memory on the node.
+            "with_cpu_affinity": False,
+            # Write the updated params back to the fp16 chunks on GPU through
+            # a pinned fp16 buffer on CPU, halving the CPU-GPU traffic.
+            "with_half_write_back": False,
+            # How hybrid Adam chooses the chunks to update on GPU,
+            # "visit_order" or "cost_model".
+            "hybrid_adam_placement": "visit_order",
+            # The CPU-GPU bandwidth in bytes per second for the cost model.
+            "pcie_bandwidth": 12e9,
+            # The elements per second updated by CPU Adam for the cost model.
+            # Measured during training if not positive.
+            "cpu_adam_throughput": 0,
         }
         if config is not None:
             tracer_config = config.get("mem_tracer", None)
@@ -70,14 +137,49 @@ class PatrickStarClient(object):
                 if k not in tracer_config:
                     tracer_config[k] = v
             opt_config = config.get("opts", None)
+            for k, v in default_opt_config.items():
+                if k not in opt_config:
+                    opt_config[k] = v
         else:
             tracer_config = default_tracer_config
             opt_config = default_opt_config
 
+        # The number of chunks in flight of the pipelined memory saving comm.
+        # It has to be the same on all processes, so it is decided from config only.
+        self.msc_max_inflight = max(1, opt_config["msc_max_inflight"])
+        if opt_config["msc_inflight_mem_budget"] > 0:
+            self.msc_max_inflight = max(
+                1,
+                min(
+                    self.msc_max_inflight,
+                    opt_config["msc_inflight_mem_budget"] // (default_chunk_size * 2),
+                ),
+            )
+
+        # Bind before any chunk is allocated or any CPU Adam thread created.
+        self.cpu_layout = None
+        if opt_config["with_cpu_affinity"]:
+            self.cpu_layout = plan_cpu_affinity(self.local_rank)
+            bind_cpu_affinity(self.cpu_layout)
+            log_dist(
+                f"CPU layout of local rank {self.local_rank}: NUMA node "
+                f"{self.cpu_layout['numa_node']} "
+                f"({'of' if self.cpu_layout['gpu_numa_known'] else 'assumed for'} "
+                f"cuda:{self.local_rank}), CPUs "
+                f"{format_cpulist(self.cpu_layout['cpus'])}, "
+                f"{self.cpu_layout['num_threads']} threads, memory "
+                f"{'on the node' if self.cpu_layout['numa_memory'] else 'first touch'}",
+                ranks=[-1],
+            )
+
         self.mem_tracer = RuntimeMemTracer(
-            self.local_rank, tracer_config, opt_config["with_mem_saving_comm"]
+            self.local_rank,
+            tracer_config,
+            opt_config["with_mem_saving_comm"],
+            msc_max_inflight=self.msc_max_inflight,
         )
         self.opt_config = opt_config
+        set_replication_factor(self.opt_config["replication_factor"])
 
         self.chunk_eviction_strategy = LatestAccessChunkEvictionPolicy(
             self.mem_tracer.metronome
@@ -91,7 +193,10 @@ class PatrickStarClient(object):
             self.chunk_eviction_strategy,
             self.opt_config["with_mem_cache"],
             self.opt_config["with_async_move"],
+            device=self.device,
         )
+        # The checkpointed activations, stored in chunks of the chunk list.
+        self.activation_store = ActivationStore(self)
         if self.opt_config["with_mem_cache"]:
             logger.debug("[CONFIG] USING MEM CACHE")
         self._time_profile = True
@@ -100,8 +205,8 @@ class PatrickStarClient(object):
             self.cpu_comm_group = torch.distributed.new_group(backend="gloo")
         else:
             self.cpu_comm_group = None
+        self._init_hybrid_shard_groups()
 
-        self.dummy_param_list = []
         # The list of torch params that will register allreduce hook
         self.torch_param_allreduce_list = []
         self.param_fp16_to_param_fp32_map = {}
@@ -109,9 +214,89 @@ class PatrickStarClient(object):
 
         # for post backward hook
         self.grad_accs = []
+        # (dtype, device) -> empty tensor the released params point to.
+        self._empty_tensor_cache = {}
+        # chunk_id -> the PSTensors of the tensors in the chunk.
+        self._chunk_ps_tensors = {}
+        # Local param fp16 chunks in the order of first access in FWD,
+        # recorded during warmup and used for prefetching.
+        self._fwd_chunk_order = []
+        self._fwd_chunk_pos = {}
+        # training stage -> {local chunk_id -> the local chunk_id of the tile
+        # computed next}, declared by the tiled modules.
+        self._declared_next_chunk = {TrainingStage.FWD: {}, TrainingStage.BWD: {}}
+        # Skip the inference hooks when the caller accesses and releases
+        # the params of the modules itself.
+        self.hooks_paused = False
+        # Whether the current backward is a non-last micro-batch of
+        # gradient accumulation, set by the engine.
+        self.accumulate_grads = False
+        # param fp16 chunk_id -> CPU buffer of the grads accumulated over the
+        # previous micro-batches, which are reduced in the last micro-batch.
+        self._grad_acc_buffers = {}
+        # The chunk_ids whose buffer holds grads of this accumulation.
+        self._accumulated_chunk_ids = set()
+        # param fp16 chunk_id -> param fp32 chunk_id, built at the first use.
+        self._param_fp32_chunk_ids = None
 
         # A set to record chunks that are being visited.
         self.visiting_chunk = {}
+        # Pipelined memory saving comm.
+        # chunk_id -> (work, src_rank) of the bcasts issued ahead of time.
+        self.msc_prefetched_chunk = {}
+        # (chunk_id, target_rank, work) of the reduces in flight.
+        self.msc_pending_reduce = deque()
+        # chunk_id -> position in the param fp16 chunk list.
+        self._param_fp16_chunk_pos = None
+
+    def _init_hybrid_shard_groups(self):
+        r"""Create the comm groups for hybrid sharding.
+
+        shard_comm_group: the processes the chunks are sharded over,
+            param chunks are collected and grads are reduce scattered in it.
+        replica_comm_group: the processes holding the same shard,
+            grads of local chunks are allreduced in it.
+        When replication_factor is 1, the shard group is the whole world and
+        there is no replica group.
+        """
+        self.shard_comm_group = None
+        self.replica_comm_group = None
+        replication_factor = get_replication_factor()
+        if replication_factor == 1:
+            return
+        # new_group has to be called by all processes in the same order.
+        world_size = get_world_size()
+        shard_world_size = get_shard_world_size()
+        rank = get_rank()
+        for i in range(replication_factor):
+            ranks = list(range(i * shard_world_size, (i + 1) * shard_world_size))
+            group = torch.distributed.new_group(ranks=ranks)
+            if rank in ranks:
+                self.shard_comm_group = group
+        for i in range(shard_world_size):
+            ranks = list(range(i, world_size, shard_world_size))
+            group = torch.distributed.new_group(ranks=ranks)
+            if rank in ranks:
+                self.replica_comm_group = group
+        log_dist(
+            f"Hybrid sharding, shard over {shard_world_size} processes, "
+            f"{replication_factor} replicas"
+        )
+
+    def _global_rank(self, shard_rank):
+        r"""The global rank of `shard_rank` in the shard group of this process."""
+        return get_rank() - get_shard_rank() + shard_rank
+
+    def _allreduce_across_replicas(self, chunk_id):
+        r"""Sum the reduced grads of a local chunk over the replicas."""
+        if self.replica_comm_group is None:
+            return
+        torch.distributed.all_reduce(
+            self.chunk_list[chunk_id].payload,
+            op=torch.distributed.ReduceOp.SUM,
+            group=self.replica_comm_group,
+            async_op=False,
+        )
 
     def visiting_finish(self, chunk_id):
         r"""
@@ -132,8 +317,103 @@ class PatrickStarClient(object):
         return chunk_id in self.visiting_chunk
 
     def reset_visited_chunk(self):
+        self.wait_msc_pending_comm()
         self.visiting_chunk = {}
 
+    def _msc_src_rank(self, chunk_id):
+        r"""The rank owning chunk_id in its comm group."""
+        chunk_id_list = self.chunk_tensor_index.chunk_ids_of_comm_group(chunk_id)
+        return chunk_id_list.index(chunk_id)
+
+    def _msc_prefetch(self, chunk_id, compute_device, training_stage):
+        r"""Issue async bcasts for the chunks to be visited after chunk_id.
+
+        Used for the pipelined memory saving comm. The param fp16 chunks are
+        visited in ascending order during FWD and descending order during BWD.
+        At most `msc_max_inflight - 1` chunks are prefetched, so that together
+        with the chunk being visited there are `msc_max_inflight` chunks in flight.
+        """
+        if self.msc_max_inflight <= 1:
+            return
+        if self._param_fp16_chunk_pos is None:
+            self._param_fp16_chunk_pos = {
+                cid: pos
+                for pos, cid in enumerate(
+                    self.chunk_ids_generator(ChunkType.PARAM_FP16)
+                )
+            }
+        if chunk_id not in self._param_fp16_chunk_pos:
+            return
+        chunk_ids = self.chunk_list.chunk_type_to_id_list_map[ChunkType.PARAM_FP16]
+        step = 1 if training_stage == TrainingStage.FWD else -1
+        rank = get_shard_rank()
+        pos = self._param_fp16_chunk_pos[chunk_id]
+        for _ in range(self.msc_max_inflight - 1):
+            pos += step
+            if pos < 0 or pos >= len(chunk_ids):
+                break
+            if len(self.msc_prefetched_chunk) >= self.msc_max_inflight - 1:
+                break
+            next_chunk_id = chunk_ids[pos]
+            if self.is_visiting(next_chunk_id):
+                continue
+            self.visiting_start(next_chunk_id)
+            src_rank = self._msc_src_rank(next_chunk_id)
+            if src_rank == rank:
+                self.chunk_eviction_strategy.trace_access(next_chunk_id, compute_device)
+                self.chunk_list.access_chunk(next_chunk_id, compute_device)
+            else:
+                self.chunk_list.try_best_allocate_payload(
+                    self.chunk_list[next_chunk_id], compute_device
+                )
+            # Pin the chunk so that it will not be moved during the bcast.
+            self.chunk_list[next_chunk_id].pin()
+            work = torch.distributed.broadcast(
+                self.chunk_list[next_chunk_id].payload,
+                src=self._global_rank(src_rank),
+                group=self.shard_comm_group,
+                async_op=True,
+            )
+            self.set_all_tensors_state_in_chunk(next_chunk_id, TensorState.HOLD)
+            self.msc_prefetched_chunk[next_chunk_id] = (work, src_rank)
+            if self._time_profile:
+                global_timer.data_move_cnter.update(
+                    "CLIENT_fetch_remote_chunks_broadcast",
+                    self.chunk_list[next_chunk_id].payload.numel() * 2,
+                )
+
+    def _wait_msc_prefetch(self, chunk_id):
+        work, _ = self.msc_prefetched_chunk.pop(chunk_id)
+        work.wait()
+        self.chunk_list[chunk_id].unpin()
+
+    def _wait_msc_reduce(self):
+        r"""Wait for the oldest reduce in flight and finish the release."""
+        chunk_id, target_rank, work = self.msc_pending_reduce.popleft()
+        work.wait()
+        self.chunk_list[chunk_id].unpin()
+        if get_shard_rank() == target_rank:
+            self._allreduce_across_replicas(chunk_id)
+            self.chunk_list[chunk_id].payload /= get_world_size()
+        else:
+            self.chunk_list[chunk_id].release_payload()
+            self.set_all_tensors_state_in_chunk(chunk_id, TensorState.FREE)
+
+    def wait_msc_pending_comm(self):
+        r"""Wait for all the bcasts and reduces in flight.
+
+        Prefetched chunks that have not been visited are released.
+        """
+        while len(self.msc_pending_reduce) > 0:
+            self._wait_msc_reduce()
+        rank = get_shard_rank()
+        for chunk_id in list(self.msc_prefetched_chunk.keys()):
+            src_rank = self.msc_prefetched_chunk[chunk_id][1]
+            self._wait_msc_prefetch(chunk_id)
+            if src_rank != rank:
+                self.chunk_list[chunk_id].release_payload()
+                self.set_all_tensors_state_in_chunk(chunk_id, TensorState.FREE)
+
     # expose APIs from metrome ti client
     def training_stage(self):
         return self.mem_tracer.metronome.training_stage()
@@ -147,15 +427,130 @@ class PatrickStarClient(object):
     def is_warmup(self):
         return self.mem_tracer.is_warmup()
 
-    def init(self, model, optimizer):
-        r"""Initialize and store model and optimizer"""
+    def init(self, model, optimizer, inference=False):
+        r"""Initialize and store model and optimizer.
+
+        Args:
+            model: :class:`torch.nn.Module`.
+            optimizer: the optimizer, None for inference.
+            inference: bool. Register the forward hooks only.
+        """
 
         self.module = model
         self.optimizer = optimizer
         if get_rank() == 0:
             self.display_chunk_info()
-        # Here we register the forward and backward hooks.
-        self.register_model_hook(model)
+        for module in model.modules():
+            if hasattr(module, "ps_tiles"):
+                self.declare_tile_order(module.ps_tiles)
+        if inference:
+            setup_patrickstar_inference_hooks(model, self)
+        else:
+            # Here we register the forward and backward hooks.
+            self.register_model_hook(model)
+            ActivationStore.current = self.activation_store
+
+    def prefetch_next_chunk(self, plan):
+        r"""Prefetch the local chunk visited after the chunks of `plan` in FWD.
+
+        The FWD visiting order of the chunks is recorded during warmup.
+        After warmup, the next chunk is copied to the compute device on the
+        copy stream if there is room for it without evicting other chunks,
+        so the copy overlaps with the computation of the current module.
+
+        Args:
+            plan: :class:`ModuleAccessPlan`.
+        """
+        if len(plan) == 0:
+            return
+        if self.is_warmup():
+            for param_plan in plan:
+                chunk_id = param_plan.local_chunk_id
+                if chunk_id is not None and chunk_id not in self._fwd_chunk_pos:
+                    self._fwd_chunk_pos[chunk_id] = len(self._fwd_chunk_order)
+                    self._fwd_chunk_order.append(chunk_id)
+            return
+        chunk_id = plan.param_plans[-1].local_chunk_id
+        pos = self._fwd_chunk_pos.get(chunk_id)
+        if pos is None or pos + 1 >= len(self._fwd_chunk_order):
+            return
+        self._prefetch_chunk(self._fwd_chunk_order[pos + 1])
+
+    def get_fwd_chunk_pos(self, chunk_id):
+        r"""The position of the local chunk in the FWD visiting order
+        recorded during warmup, None if not visited."""
+        return self._fwd_chunk_pos.get(chunk_id)
+
+    def _prefetch_chunk(self, chunk_id):
+        r"""Move the chunk to the compute device if there is room for it
+        without evicting other chunks.
+
+        The copy from the pinned CPU memory is issued on the copy stream
+        and does not block, the compute stream waits for it when the chunk
+        is accessed in `access_dist`.
+        """
+        chunk = self.chunk_list[chunk_id]
+        device = chunk.get_device()
+        if device is None or device.type == self.device.type:
+            return
+        if (
+            self.mem_tracer.remaining_chunk_mem(self.device.type)
+            < chunk.get_payload_space()
+        ):
+            return
+        if self.device.type == "cuda" and chunk.payload.is_pinned():
+            chunk.prefetch(self.device)
+        else:
+            self.chunk_list.chunk_move(chunk_id, self.device)
+
+    def declare_tile_order(self, tiles):
+        r"""Declare the computing order of the tiles of a tiled module.
+
+        The tiles are computed in order in FWD and in reverse order in BWD,
+        so the chunk of the next tile is known before the warmup, which
+        the trace based prefetching needs.
+
+        Args:
+            tiles: list of :class:`torch.nn.Module`, in the order of FWD.
+        """
+        tile_chunk_ids = []
+        for tile in tiles:
+            plan = ModuleAccessPlan(tile, self)
+            chunk_ids = []
+            for param_plan in plan:
+                chunk_id = param_plan.local_chunk_id
+                if chunk_id is not None and chunk_id not in chunk_ids:
+                    chunk_ids.append(chunk_id)
+            if len(chunk_ids) > 0:
+                tile_chunk_ids.append(chunk_ids)
+
+        fwd_next = self._declared_next_chunk[TrainingStage.FWD]
+        bwd_next = self._declared_next_chunk[TrainingStage.BWD]
+        for i, chunk_ids in enumerate(tile_chunk_ids):
+            for chunk_id in chunk_ids:
+                if i + 1 < len(tile_chunk_ids):
+                    next_chunk_id = tile_chunk_ids[i + 1][0]
+                    if next_chunk_id != chunk_id:
+                        fwd_next[chunk_id] = next_chunk_id
+                if i > 0:
+                    prev_chunk_id = tile_chunk_ids[i - 1][-1]
+                    if prev_chunk_id != chunk_id:
+                        bwd_next[chunk_id] = prev_chunk_id
+
+    def prefetch_declared_chunk(self, plan):
+        r"""Prefetch the chunk of the tile computed after the one of `plan`.
+
+        Args:
+            plan: :class:`ModuleAccessPlan`.
+        """
+        if len(plan) == 0:
+            return
+        next_chunk = self._declared_next_chunk.get(self.training_stage())
+        if not next_chunk:
+            return
+        chunk_id = next_chunk.get(plan.param_plans[0].local_chunk_id)
+        if chunk_id is not None:
+            self._prefetch_chunk(chunk_id)
 
     def trigger_memory_tracing(self):
         self.mem_tracer.trace_memory()
@@ -167,6 +562,8 @@ class PatrickStarClient(object):
         """
         if self.mem_tracer.metronome.is_warmup():
             return
+        if self.device.type != "cuda":
+            return
         gpu_device = torch.device(f"cuda:{self.local_rank}")
         next_mom = self.mem_tracer.metronome.next_moment()
         # cur_mom = self.mem_tracer.metronome.moment()
@@ -189,13 +586,12 @@ class PatrickStarClient(object):
             chunk_size=self.default_chunk_size,
         )
 
-    def append_chunk(self, data_type, chunk_type, is_dummy=False):
+    def append_chunk(self, data_type, chunk_type):
         r"""Append a new chunk to chunk_list and chunk_tensor_index.
 
         Args:
             data_type: :class:`torch.dtype`.
             chunk_type: :class:`ChunkType`.
-            is_dummy: bool.
         Returns:
             chunk_id of the newly created chunk and comm_info.
         """
@@ -204,44 +600,18 @@ class PatrickStarClient(object):
             chunk_id,
             self.default_chunk_size,
             data_type,
-            is_dummy=is_dummy,
             chunk_type=chunk_type,
         )
         self.chunk_tensor_index.add_chunk(chunk_id, comm_info)
         return chunk_id, comm_info
 
-    def append_dummy_chunk(self, data_type: torch.dtype, chunk_type: ChunkType):
-        r"""Append a dummy chunk to the corresponding chunk_list"""
-        chunk_id, comm_info = self.append_chunk(torch.half, chunk_type, is_dummy=True)
-
-        dummy = torch.nn.Parameter(
-            torch.tensor([], dtype=data_type), requires_grad=False
-        )
-        # Add a dummy param to dummy chunk, so that the chunk can be set in HOLD state.
-        register_param(
-            dummy, ParamType.CHUNK_BASED, torch.half, f"dummy_{comm_info.group_id}"
-        )
-        self.dummy_param_list.append(dummy)
-        self.chunk_tensor_index.add_tensor(
-            chunk_id,
-            self.dummy_param_list[-1].ps_attr.data_id(),
-            0,
-            dummy.numel(),
-            self.dummy_param_list[-1],
-            AccessType.DATA,
-        )
-
-        logger.debug(
-            f"Append a dummy chunk to the Chunk List {chunk_type} "
-            f"comm info {comm_info}"
-        )
-
     def delete_param(self, param, access_type):
         """
         TODO(jiaruifang) Remove tensor of the param
         """
         chunk_id = self.chunk_tensor_index.get_chunk_id(param, access_type)
         self.chunk_tensor_index.delete_tensor(chunk_id, param, access_type)
+        self._chunk_ps_tensors.pop(chunk_id, None)
 
     def append_tensor(
         self,
@@ -268,6 +638,7 @@ class PatrickStarClient(object):
             if self.chunk_tensor_index.try_insert_tensor_list(
                 last_chunk_id, param_list, access_type
             ):
+                self._chunk_ps_tensors.pop(last_chunk_id, None)
                 return
         chunk_id, _ = self.append_chunk(data_type, chunk_type)
         if not self.chunk_tensor_index.try_insert_tensor_list(
@@ -304,6 +675,7 @@ class PatrickStarClient(object):
             chunk_id, _ = self.append_chunk(data_type, chunk_type)
         if not self.chunk_tensor_index.try_insert_tensor(chunk_id, param, access_type):
             raise RuntimeError("Failed to insert optimizer param w.r.t its ref_param.")
+        self._chunk_ps_tensors.pop(chunk_id, None)
         self.chunk_tensor_index.register_optimizer_state_chunk_id(
             ref_param, access_type, chunk_type, chunk_id
         )
@@ -311,25 +683,28 @@ class PatrickStarClient(object):
     def param_fp16_chunks_max_mem_usage(self):
         r"""Return the total memory used by param fp16 chunks in bytes.
 
+        The frozen param chunks are included.
+
         In distributed environment, the return value includes remote chunks
         from allgather.
+        The last comm group may have less chunks than processes, so the
+        number of local chunks is rounded up.
         """
-        world_size = get_world_size()
+        world_size = get_shard_world_size()
+        local_chunk_num = math.ceil(
+            self.chunk_tensor_index.chunk_num(ChunkType.PARAM_FP16) / world_size
+        ) + math.ceil(
+            self.chunk_tensor_index.chunk_num(ChunkType.PARAM_FP16_FROZEN) / world_size
+        )
         if self.opt_config["with_mem_saving_comm"]:
             return (
-                self.chunk_tensor_index.chunk_num(ChunkType.PARAM_FP16)
-                * self.default_chunk_size
-                * 2
-                / world_size
+                local_chunk_num * self.default_chunk_size * 2
                 + self.default_chunk_size * 2
             )
         else:
             # non MSC has to cache work_size - 1 buffer.
             return (
-                self.chunk_tensor_index.chunk_num(ChunkType.PARAM_FP16)
-                * self.default_chunk_size
-                * 2
-                / world_size
+                local_chunk_num * self.default_chunk_size * 2
                 + (world_size - 1) * self.default_chunk_size * 2
             )
 
@@ -340,12 +715,28 @@ class PatrickStarClient(object):
         And this method has nothing to do with whether the payload of
         the chunk is allocated or not.
         """
-        for info in self.chunk_tensor_index.generate_tensor_info_in_order(chunk_id):
-            param = info.param
-            access_type = info.access_type
-            old_state = param.ps_attr.get_state(access_type)
-            self.chunk_list.update_state(chunk_id, old_state, new_state)
-            param.ps_attr.set_state(new_state, access_type)
+        ps_tensors = self._chunk_ps_tensors.get(chunk_id)
+        if ps_tensors is None:
+            ps_tensors = [
+                info.param.ps_attr._access_ps_tensor(info.access_type)
+                for info in self.chunk_tensor_index.generate_tensor_info_in_order(
+                    chunk_id
+                )
+            ]
+            self._chunk_ps_tensors[chunk_id] = ps_tensors
+        num_tensors = len(ps_tensors)
+        if (
+            new_state != TensorState.FREE
+            and self.chunk_list[chunk_id].tensor_state_num(new_state) == num_tensors
+        ):
+            return
+        self.chunk_list.reset_state(chunk_id, new_state, num_tensors)
+        # Only the tensors in COMPUTE state point to the chunk payload.
+        release_tensor = new_state != TensorState.COMPUTE
+        for ps_tensor in ps_tensors:
+            ps_tensor.state = new_state
+            if release_tensor:
+                ps_tensor.tensor = None
 
     def register_model_hook(self, model):
         setup_patrickstar_hooks(model, self)
@@ -353,6 +744,138 @@ class PatrickStarClient(object):
     def chunk_ids_generator(self, chunk_type: ChunkType):
         return self.chunk_list.chunk_ids_generator(chunk_type)
 
+    def _empty_tensor(self, dtype, device):
+        r"""The cached empty tensor of `dtype` on `device`.
+
+        Released params all point to it, so that the release does not
+        allocate a new tensor every time.
+        """
+        key = (dtype, device)
+        tensor = self._empty_tensor_cache.get(key)
+        if tensor is None:
+            tensor = torch.tensor([], dtype=dtype, device=device)
+            self._empty_tensor_cache[key] = tensor
+        return tensor
+
+    def _param_fp32_chunk_id(self, param_fp16_chunk_id):
+        r"""The id of the param fp32 chunk of a param fp16 chunk.
+
+        The tensors of the two chunks are at the same offsets.
+        """
+        if self._param_fp32_chunk_ids is None:
+            self._param_fp32_chunk_ids = dict(
+                zip(
+                    self.chunk_ids_generator(ChunkType.PARAM_FP16),
+                    self.chunk_ids_generator(ChunkType.PARAM_FP32),
+                )
+            )
+        return self._param_fp32_chunk_ids[param_fp16_chunk_id]
+
+    def _accumulate_chunk_grads(self, chunk_id):
+        r"""Move the grads in the param fp16 chunk `chunk_id` to its grad
+        accumulation buffer, instead of reducing them.
+
+        Called in the non-last micro-batches of gradient accumulation.
+        The buffer is allocated on CPU at its first use and counted as CPU
+        chunk memory by the memory tracer. The fp16 grads are summed in fp16,
+        the bf16 ones in fp32 as bf16 has too few mantissa bits. The param
+        data of a local chunk is then copied back from the param fp32 chunk
+        for the next forward, the remote chunks are released by the caller.
+        """
+        chunk = self.chunk_list[chunk_id]
+        payload = chunk.payload
+        buff = self._grad_acc_buffers.get(chunk_id)
+        if buff is None:
+            dtype = (
+                torch.float if self.half_dtype == torch.bfloat16 else self.half_dtype
+            )
+            is_pinned = self.device.type == "cuda"
+            buff = torch.empty(
+                chunk.capacity,
+                dtype=dtype,
+                device=torch.device("cpu:0"),
+                pin_memory=is_pinned,
+            )
+            self.mem_tracer.add("cpu", buff.numel() * buff.element_size(), is_pinned)
+            self._grad_acc_buffers[chunk_id] = buff
+        # The copies are ordered in the compute stream, the host never reads
+        # the buffer.
+        if chunk_id not in self._accumulated_chunk_ids:
+            buff.copy_(payload, non_blocking=True)
+            self._accumulated_chunk_ids.add(chunk_id)
+        elif payload.device.type == "cuda":
+            acc = buff.to(payload.device, non_blocking=True)
+            acc.add_(payload)
+            buff.copy_(acc, non_blocking=True)
+        else:
+            buff.add_(payload)
+        if self.chunk_tensor_index.is_local_chunk(chunk_id):
+            param_fp32_chunk = self.chunk_list[self._param_fp32_chunk_id(chunk_id)]
+            # Blocking copy, the CPU optimizer updates the param fp32 chunk
+            # in place.
+            payload.copy_(param_fp32_chunk.payload)
+
+    def _fold_chunk_grads(self, chunk_id):
+        r"""Add the grads accumulated over the previous micro-batches to the
+        grads in the param fp16 chunk `chunk_id`, before they are reduced.
+        """
+        if chunk_id not in self._accumulated_chunk_ids:
+            return
+        self._accumulated_chunk_ids.remove(chunk_id)
+        payload = self.chunk_list[chunk_id].payload
+        acc = self._grad_acc_buffers[chunk_id]
+        if payload.device.type == "cuda":
+            acc = acc.to(payload.device, non_blocking=True)
+        acc.add_(payload)
+        payload.copy_(acc)
+
+    def _local_grads_ready(self, chunk_id):
+        r"""Accumulate or fold the grads of the param fp16 chunk `chunk_id`
+        when there is no reduce, i.e. a single process.
+        """
+        if self.accumulate_grads:
+            self._accumulate_chunk_grads(chunk_id)
+        else:
+            self._fold_chunk_grads(chunk_id)
+
+    def compile_access_plan(self, param, access_type):
+        r"""Resolve the chunk info of the tensor of `param` into a plan.
+
+        Args:
+            param: :class:`torch.nn.Parameter`. A chunk based param.
+            access_type: :class:`AccessType`.
+        Returns:
+            :class:`ParamAccessPlan`.
+        """
+        chunk_id = self.chunk_tensor_index.get_chunk_id(param, access_type)
+        if chunk_id is None:
+            raise RuntimeError(
+                f"Can not compile access plan for {param.ps_attr.name}, "
+                "no chunk is assigned to it."
+            )
+        info = self.chunk_tensor_index.get_tensor_info(
+            param.ps_attr.get_tensor_id(access_type)
+        )
+        if get_world_size() > 1:
+            rank = get_shard_rank()
+            chunk_id_list = self.chunk_tensor_index.chunk_ids_of_comm_group(chunk_id)
+            local_chunk_id = chunk_id_list[rank] if rank < len(chunk_id_list) else None
+        else:
+            chunk_id_list = [chunk_id]
+            local_chunk_id = chunk_id
+        comm_info = self.chunk_tensor_index.chunk_id_to_comm_info_map[chunk_id]
+        return ParamAccessPlan(
+            param,
+            access_type,
+            info.tensor_id,
+            chunk_id,
+            chunk_id_list,
+            local_chunk_id,
+            comm_info.group_id,
+            info.start_offset,
+            info.numel,
+        )
+
     def is_local_param(self, param, access_type):
         r"""Check if param is in local chunk"""
         chunk_id = self.chunk_tensor_index.get_chunk_id(param, access_type)
@@ -374,11 +897,12 @@ class PatrickStarClient(object):
             chunk_id: the id of accessed chunk
             chunk_id_list: list of int. The id of the chunks in a same comm group.
             local_chunk_id: int. The id of the local chunk in the comm group.
+                None if the comm group has no chunk for the current process.
             compute_device: :class:`torch.device`.
             with_mem_saving_comm: using the memory saving communication pattern or not.
             param_name: str.
         """
-        rank = get_rank()
+        rank = get_shard_rank()
         if with_mem_saving_comm:
             # Use memory saving communication pattern.
             # Bcast chunk from the src gpu to the others.
@@ -386,6 +910,19 @@ class PatrickStarClient(object):
             # check the chunk_id is the first to be visited.
             # local chunk as HOLD, remote chunk as RELEASED
             if self.is_visiting(chunk_id):
+                if chunk_id in self.msc_prefetched_chunk:
+                    # The chunk is bcasted ahead of time, wait for it
+                    # and keep the pipeline full.
+                    if self._time_profile:
+                        global_timer.my_timer.start_profile(
+                            "CLIENT_fetch_remote_chunks_broadcast"
+                        )
+                    self._wait_msc_prefetch(chunk_id)
+                    if self._time_profile:
+                        global_timer.my_timer.finish_profile(
+                            "CLIENT_fetch_remote_chunks_broadcast"
+                        )
+                    self._msc_prefetch(chunk_id, compute_device, training_stage)
                 return
 
             self.visiting_start(chunk_id)
@@ -412,7 +949,8 @@ class PatrickStarClient(object):
             # Do Bcast from gpu owns chunk to gpu do not own it.
             torch.distributed.broadcast(
                 self.chunk_list[chunk_id].payload,
-                src=src_rank,
+                src=self._global_rank(src_rank),
+                group=self.shard_comm_group,
                 async_op=False,
             )
             if self._time_profile:
@@ -425,6 +963,7 @@ class PatrickStarClient(object):
                 )
             # set the chunk as HOLD, therefore it can be offloaded to CPU.
             self.set_all_tensors_state_in_chunk(chunk_id, TensorState.HOLD)
+            self._msc_prefetch(chunk_id, compute_device, training_stage)
         else:
             # During FWD, when there are param in the chunk group being visited for
             # the first time, collect the chunk group to local.
@@ -450,9 +989,12 @@ class PatrickStarClient(object):
 
             # Use collective communication to achieve the most efficient communication.
             # However, it is memory consumping. world_size chunks on GPU simutaneously.
-            self.chunk_eviction_strategy.trace_access(local_chunk_id, compute_device)
-            self.chunk_list.access_chunk(local_chunk_id, compute_device)
-            self.chunk_list[local_chunk_id].pin()
+            if local_chunk_id is not None:
+                self.chunk_eviction_strategy.trace_access(
+                    local_chunk_id, compute_device
+                )
+                self.chunk_list.access_chunk(local_chunk_id, compute_device)
+                self.chunk_list[local_chunk_id].pin()
             allgather_payload_buff = []
             comm_data_amount = 0
             for chunk_id in chunk_id_list:
@@ -478,14 +1020,28 @@ class PatrickStarClient(object):
                 )
 
             logger.debug(f"rank {rank} allgather {chunk_id_list}")
-            torch.distributed.all_gather(
-                allgather_payload_buff,
-                self.chunk_list[local_chunk_id].payload,
-                async_op=False,
-            )
+            if len(chunk_id_list) == get_shard_world_size():
+                torch.distributed.all_gather(
+                    allgather_payload_buff,
+                    self.chunk_list[local_chunk_id].payload,
+                    group=self.shard_comm_group,
+                    async_op=False,
+                )
+            else:
+                # The last comm group may have less chunks than processes,
+                # every owner bcasts its chunk, which moves the same amount of
+                # data as allgather.
+                for src_rank, payload in enumerate(allgather_payload_buff):
+                    torch.distributed.broadcast(
+                        payload,
+                        src=self._global_rank(src_rank),
+                        group=self.shard_comm_group,
+                        async_op=False,
+                    )
 
             allgather_payload_buff = []
-            self.chunk_list[local_chunk_id].unpin()
+            if local_chunk_id is not None:
+                self.chunk_list[local_chunk_id].unpin()
 
             if self._time_profile:
                 global_timer.my_timer.finish_profile(
@@ -496,18 +1052,42 @@ class PatrickStarClient(object):
                 )
             global_timer.my_timer.finish_profile("CLIENT_fetch_remote_chunks")
 
-    def _access_tensor_in_chunk(self, param, access_type, compute_device, chunk_id):
+    def _reset_unused(self, chunk_id_list, training_stage):
+        r"""Forget the unused tensors of the chunks when they enter FWD.
+
+        The unused counts are set at the end of FWD and stay valid through
+        BWD, including the recompute of checkpointed modules. In the next
+        FWD the unused tensors are not known yet.
+        """
+        if (
+            training_stage != TrainingStage.FWD
+            or self.training_stage() != TrainingStage.FWD
+        ):
+            return
+        for chunk_id in chunk_id_list:
+            self.chunk_list[chunk_id].unused = 0
+
+    def _access_tensor_in_chunk(
+        self, param, access_type, compute_device, chunk_id, plan=None
+    ):
         self.chunk_eviction_strategy.trace_access(chunk_id, compute_device)
         self.chunk_list.access_chunk(chunk_id, compute_device)
         # 2. Locate the param on the chunk.
-        tensor_id = param.ps_attr.get_tensor_id(access_type)
-        info = self.chunk_tensor_index.get_tensor_info(tensor_id)
-        start_offset = info.start_offset
-        numel = info.numel
-        assert numel == param.ps_attr.numel, f"{numel} vs {param.ps_attr.numel}"
-
-        param.ps_attr.set_tensor(
-            self.chunk_list[chunk_id].payload.narrow(0, start_offset, numel),
+        if plan is None:
+            tensor_id = param.ps_attr.get_tensor_id(access_type)
+            info = self.chunk_tensor_index.get_tensor_info(tensor_id)
+            start_offset = info.start_offset
+            numel = info.numel
+            assert numel == param.ps_attr.numel, f"{numel} vs {param.ps_attr.numel}"
+        else:
+            tensor_id = plan.tensor_id
+            start_offset = plan.start_offset
+            numel = plan.numel
+
+        param.ps_attr.set_view(
+            self.chunk_list[chunk_id].tensor_view(
+                tensor_id, start_offset, numel, param.ps_attr.shape
+            ),
             access_type,
         )
 
@@ -532,6 +1112,7 @@ class PatrickStarClient(object):
         compute_device: torch.device,
         with_mem_saving_comm: bool,
         training_stage: TrainingStage,
+        plan: ParamAccessPlan = None,
     ) -> torch.Tensor:
         r"""Visit tensor of param in distributed environment.
 
@@ -542,6 +1123,8 @@ class PatrickStarClient(object):
             access_type: :class:`AccessType`.
             compute_device: :class:`torch.device`.
             training_stage: :class:`TrainingStage`.
+            plan: :class:`ParamAccessPlan`. The precompiled chunk info of
+                the tensor. If None, it is looked up in `ChunkTensorIndex`.
         Returns:
             The tensor of the params.
         """
@@ -562,18 +1145,28 @@ class PatrickStarClient(object):
 
         # 1. Prepare the memory of the chunks. If the chunk is not one the
         #   compute device, then we need to move or allocate.
-        chunk_id = self.chunk_tensor_index.get_chunk_id(param, access_type)
-
-        rank = get_rank()
+        if plan is None:
+            chunk_id = self.chunk_tensor_index.get_chunk_id(param, access_type)
+        else:
+            chunk_id = plan.chunk_id
 
         if get_world_size() > 1:
-            chunk_id_list = self.chunk_tensor_index.chunk_ids_of_comm_group(chunk_id)
-            local_chunk_id = chunk_id_list[rank]
-
-            logger.debug(
-                f"rank {rank} access_dist access tensor {param.ps_attr.name} "
-                f"local_chunk_id {local_chunk_id} chunk_id_list {chunk_id_list}"
-            )
+            if plan is None:
+                rank = get_shard_rank()
+                chunk_id_list = self.chunk_tensor_index.chunk_ids_of_comm_group(
+                    chunk_id
+                )
+                local_chunk_id = (
+                    chunk_id_list[rank] if rank < len(chunk_id_list) else None
+                )
+                logger.debug(
+                    f"rank {rank} access_dist access tensor {param.ps_attr.name} "
+                    f"local_chunk_id {local_chunk_id} chunk_id_list {chunk_id_list}"
+                )
+            else:
+                chunk_id_list = plan.chunk_id_list
+                local_chunk_id = plan.local_chunk_id
+            self._reset_unused(chunk_id_list, training_stage)
 
             # 1.2 Fetch the remote chunks to local.
             self._fetch_remote_chunks(
@@ -586,12 +1179,18 @@ class PatrickStarClient(object):
                 training_stage,
             )
         else:
+            self._reset_unused([chunk_id], training_stage)
             local_chunk_id = chunk_id
 
         # collect the time a chunk has to be placed on compute-device
         # self.chunk_eviction_strategy.trace_access(local_chunk_id, compute_device)
 
-        ret = self._access_tensor_in_chunk(param, access_type, compute_device, chunk_id)
+        # The compute stream waits for the copy of a prefetched chunk before
+        # its first use.
+        self.chunk_list[chunk_id].wait_prefetch()
+        ret = self._access_tensor_in_chunk(
+            param, access_type, compute_device, chunk_id, plan
+        )
         if self._time_profile:
             global_timer.my_timer.finish_profile("CLIENT_access_dist")
         return ret
@@ -678,6 +1277,7 @@ class PatrickStarClient(object):
         training_stage: TrainingStage,
         do_allreduce: bool,
         with_mem_saving_comm: bool = False,
+        plan: ParamAccessPlan = None,
     ):
         r"""Release the param in distributed environment.
 
@@ -689,6 +1289,8 @@ class PatrickStarClient(object):
             2. If the chunk can be released,
                 if `do_allreduce` is True, do reduce scatter to average the gradients.
                 then released the payload.
+                In the non-last micro-batches of gradient accumulation, the
+                gradients are moved to the accumulation buffers without reduce.
 
         Args:
             param: :class:`torch.nn.Parameter`.
@@ -700,13 +1302,15 @@ class PatrickStarClient(object):
                 in TrainingStage.BWD doesn't equal to True.
             with_mem_saving_comm: book. Use memory saving communication pattern. Save memory but
             underutilze communication bandwidth.
+            plan: :class:`ParamAccessPlan`. The precompiled chunk info of
+                the tensor. If None, it is looked up in `ChunkTensorIndex`.
         """
         if param.ps_attr.param_type == ParamType.TORCH_BASED:
             return
 
         if self._time_profile:
             global_timer.my_timer.start_profile("CLIENT_release_dist")
-        rank = get_rank()
+        rank = get_shard_rank()
 
         assert isinstance(reset_to_state, TensorState)
         assert (
@@ -714,14 +1318,17 @@ class PatrickStarClient(object):
         )
         assert torch.distributed.is_initialized()
 
-        chunk_id = self.chunk_tensor_index.get_chunk_id(param, access_type)
-        chunk_id_list = self.chunk_tensor_index.chunk_ids_of_comm_group(chunk_id)
-
-        local_chunk_id = chunk_id_list[rank]
-
-        logger.debug(
-            f"rank {rank} release tensor {param.ps_attr.name} of chunk_id {chunk_id} to {reset_to_state}"
-        )
+        if plan is None:
+            chunk_id = self.chunk_tensor_index.get_chunk_id(param, access_type)
+            chunk_id_list = self.chunk_tensor_index.chunk_ids_of_comm_group(chunk_id)
+            local_chunk_id = chunk_id_list[rank] if rank < len(chunk_id_list) else None
+            logger.debug(
+                f"rank {rank} release tensor {param.ps_attr.name} of chunk_id {chunk_id} to {reset_to_state}"
+            )
+        else:
+            chunk_id = plan.chunk_id
+            chunk_id_list = plan.chunk_id_list
+            local_chunk_id = plan.local_chunk_id
 
         # Update the state of tensor and chunk.
         self.chunk_list.update_state(
@@ -732,17 +1339,15 @@ class PatrickStarClient(object):
         if access_type == AccessType.DATA:
             # NOTE(jiaruifang) device must be the same as the origin param.
             # Or it will affect hook of param.grad_fn.next_functions[0][0].
-            param.data = torch.tensor(
-                [], dtype=param.ps_attr.data_type, device=param.device
-            )
+            param.data = self._empty_tensor(param.ps_attr.data_type, param.device)
         elif access_type == AccessType.GRAD:
             param.grad = None
 
         # Check if we finished using all tensors in all chunks of the chunk group,
         # then we can release the remote chunks.
         # The condition for releasing chunks are:
-        #     FWD: All non-dummy chunks are of state HOLD_AFTER_FWD;
-        #     BWD: All non-dummy chunks are of state HOLD_AFTER_BWD.
+        #     FWD: All chunks are of state HOLD_AFTER_FWD;
+        #     BWD: All chunks are of state HOLD_AFTER_BWD.
         world_size = get_world_size()
         if world_size > 1:
             if with_mem_saving_comm:
@@ -766,18 +1371,53 @@ class PatrickStarClient(object):
                         if cur_chunk_id == chunk_id:
                             target_rank = cur_rank
                             break
+                    if do_allreduce and self.accumulate_grads:
+                        # Non-last micro-batch of gradient accumulation, the
+                        # reduce is deferred to the last micro-batch.
+                        self.chunk_eviction_strategy.trace_access(chunk_id, self.device)
+                        self.chunk_list.access_chunk(chunk_id, self.device)
+                        self._accumulate_chunk_grads(chunk_id)
+                        do_allreduce = False
+                    if do_allreduce and self.msc_max_inflight > 1:
+                        # Pipelined reduce, the chunk is released after the
+                        # reduce finishes in `_wait_msc_reduce`.
+                        self.chunk_eviction_strategy.trace_access(chunk_id, self.device)
+                        self.chunk_list.access_chunk(chunk_id, self.device)
+                        self.chunk_list[chunk_id].pin()
+                        self._fold_chunk_grads(chunk_id)
+                        work = torch.distributed.reduce(
+                            self.chunk_list[chunk_id].payload,
+                            self._global_rank(target_rank),
+                            op=torch.distributed.ReduceOp.SUM,
+                            group=self.shard_comm_group,
+                            async_op=True,
+                        )
+                        if self._time_profile:
+                            global_timer.data_move_cnter.update(
+                                "CLIENT_release_dist_reduce",
+                                self.chunk_list[chunk_id].payload.numel() * 2,
+                            )
+                        self.msc_pending_reduce.append((chunk_id, target_rank, work))
+                        while len(self.msc_pending_reduce) > self.msc_max_inflight:
+                            self._wait_msc_reduce()
+                        self.visiting_finish(chunk_id)
+                        if self._time_profile:
+                            global_timer.my_timer.finish_profile("CLIENT_release_dist")
+                        return
                     if do_allreduce:
                         # move the chunk_id to GPU
                         self.chunk_eviction_strategy.trace_access(chunk_id, self.device)
                         self.chunk_list.access_chunk(chunk_id, self.device)
+                        self._fold_chunk_grads(chunk_id)
                         if self._time_profile:
                             global_timer.my_timer.start_profile(
                                 "CLIENT_release_dist_reduce"
                             )
                         torch.distributed.reduce(
                             self.chunk_list[chunk_id].payload,
-                            target_rank,
+                            self._global_rank(target_rank),
                             op=torch.distributed.ReduceOp.SUM,
+                            group=self.shard_comm_group,
                             async_op=False,
                         )
                         if self._time_profile:
@@ -790,6 +1430,7 @@ class PatrickStarClient(object):
                             )
                         # release chunk payload, only its belonging gpu owns it.
                         if rank == target_rank:
+                            self._allreduce_across_replicas(chunk_id)
                             self.chunk_list[chunk_id].payload /= world_size
                     if target_rank != rank:
                         self.chunk_list[chunk_id].release_payload()
@@ -799,49 +1440,71 @@ class PatrickStarClient(object):
                 all_chunks_ready = True
                 for i in chunk_id_list:
                     if training_stage == TrainingStage.FWD:
-                        if (
-                            not self.chunk_list[i].all_tensor_state(
-                                TensorState.HOLD_AFTER_FWD
-                            )
-                            and not self.chunk_list[i].is_dummy()
+                        if not self.chunk_list[i].all_tensor_state(
+                            TensorState.HOLD_AFTER_FWD
                         ):
                             all_chunks_ready = False
                     elif training_stage == TrainingStage.BWD:
-                        if (
-                            not self.chunk_list[i].all_tensor_state(
-                                TensorState.HOLD_AFTER_BWD
-                            )
-                            and not self.chunk_list[i].is_dummy()
+                        if not self.chunk_list[i].all_tensor_state(
+                            TensorState.HOLD_AFTER_BWD
                         ):
                             all_chunks_ready = False
 
                 if all_chunks_ready:
+                    if do_allreduce and self.accumulate_grads:
+                        # Non-last micro-batch of gradient accumulation, the
+                        # reduce is deferred to the last micro-batch.
+                        for i in chunk_id_list:
+                            self.chunk_eviction_strategy.trace_access(i, self.device)
+                            self.chunk_list.access_chunk(i, self.device)
+                            self.chunk_list[i].pin()
+                            self._accumulate_chunk_grads(i)
+                        do_allreduce = False
                     if do_allreduce:
                         if self._time_profile:
                             global_timer.my_timer.start_profile(
                                 "CLIENT_release_dist_reduce_scatter"
                             )
-                        assert self.chunk_list[local_chunk_id].payload is not None
                         input_list = []
                         for i in chunk_id_list:
                             self.chunk_eviction_strategy.trace_access(i, self.device)
                             self.chunk_list.access_chunk(i, self.device)
                             self.chunk_list[i].pin()
+                            self._fold_chunk_grads(i)
                             input_list.append(self.chunk_list[i].payload)
-                        torch.distributed.reduce_scatter(
-                            self.chunk_list[local_chunk_id].payload,
-                            input_list,
-                            op=torch.distributed.ReduceOp.SUM,
-                            async_op=False,
-                        )
-
-                        self.chunk_list[local_chunk_id].payload /= world_size
+                        if (
+                            len(chunk_id_list) == get_shard_world_size()
+                            and torch.distributed.get_backend() != "gloo"
+                        ):
+                            assert self.chunk_list[local_chunk_id].payload is not None
+                            torch.distributed.reduce_scatter(
+                                self.chunk_list[local_chunk_id].payload,
+                                input_list,
+                                op=torch.distributed.ReduceOp.SUM,
+                                group=self.shard_comm_group,
+                                async_op=False,
+                            )
+                        else:
+                            # Uneven comm group or gloo backend, which does not
+                            # support reduce scatter. Reduce each chunk to its owner.
+                            for target_rank, payload in enumerate(input_list):
+                                torch.distributed.reduce(
+                                    payload,
+                                    self._global_rank(target_rank),
+                                    op=torch.distributed.ReduceOp.SUM,
+                                    group=self.shard_comm_group,
+                                    async_op=False,
+                                )
+
+                        if local_chunk_id is not None:
+                            # Hierarchical reduce, the grads reduced in the shard
+                            # group are then allreduced across the replicas.
+                            self._allreduce_across_replicas(local_chunk_id)
+                            self.chunk_list[local_chunk_id].payload /= world_size
                         if self._time_profile:
                             global_timer.data_move_cnter.update(
                                 "CLIENT_release_dist_reduce_scatter",
-                                self.chunk_list[local_chunk_id].payload.numel()
-                                * 2
-                                * world_size,
+                                input_list[0].numel() * 2 * len(input_list),
                             )
                             global_timer.my_timer.finish_profile(
                                 "CLIENT_release_dist_reduce_scatter"
@@ -854,6 +1517,12 @@ class PatrickStarClient(object):
                             logger.debug(f"rank {rank} remove payload of chunk_id {i}")
                             self.chunk_list[i].release_payload()
                             self.set_all_tensors_state_in_chunk(i, TensorState.FREE)
+        elif (
+            do_allreduce
+            and training_stage == TrainingStage.BWD
+            and self.chunk_list[chunk_id].all_tensor_state(TensorState.HOLD_AFTER_BWD)
+        ):
+            self._local_grads_ready(chunk_id)
 
         if self._time_profile:
             global_timer.my_timer.finish_profile("CLIENT_release_dist")
@@ -863,6 +1532,7 @@ class PatrickStarClient(object):
         param: torch.nn.Parameter,
         access_type: AccessType,
         reset_to_state: TensorState = TensorState.HOLD,
+        plan: ParamAccessPlan = None,
     ):
         r"""Release the param in standalone environment.
 
@@ -877,18 +1547,23 @@ class PatrickStarClient(object):
             param: :class:`torch.nn.Parameter`.
             access_type: :class:`AccessType`.
             reset_to_state: :class:`TensorState`. The state to reset tensor to.
+            plan: :class:`ParamAccessPlan`. The precompiled chunk info of
+                the tensor. If None, it is looked up in `ChunkTensorIndex`.
         """
         if param.ps_attr.param_type == ParamType.TORCH_BASED:
             return
         if self._time_profile:
             global_timer.my_timer.start_profile("CLIENT_release")
-        rank = self.local_rank
         assert isinstance(reset_to_state, TensorState)
 
-        chunk_id = self.chunk_tensor_index.get_chunk_id(param, access_type)
-        logger.debug(
-            f"rank {rank} release a tensor of {access_type} chunk_id {chunk_id} to {reset_to_state}"
-        )
+        if plan is None:
+            chunk_id = self.chunk_tensor_index.get_chunk_id(param, access_type)
+            logger.debug(
+                f"rank {self.local_rank} release a tensor of {access_type} "
+                f"chunk_id {chunk_id} to {reset_to_state}"
+            )
+        else:
+            chunk_id = plan.chunk_id
 
         # Update the state of tensor and chunk.
         self.chunk_list.update_state(
@@ -899,12 +1574,18 @@ class PatrickStarClient(object):
         if access_type == AccessType.DATA:
             # NOTE(jiaruifang) device must be the same as the origin param.
             # Or it will affect hook of param.grad_fn.next_functions[0][0].
-            param.data = torch.tensor(
-                [], dtype=param.ps_attr.data_type, device=param.device
-            )
+            param.data = self._empty_tensor(param.ps_attr.data_type, param.device)
         elif access_type == AccessType.GRAD:
             param.grad = None
 
+        # The frozen params have no grad.
+        if (
+            reset_to_state == TensorState.HOLD_AFTER_BWD
+            and not param.ps_attr.is_frozen()
+            and self.chunk_list[chunk_id].all_tensor_state(TensorState.HOLD_AFTER_BWD)
+        ):
+            self._local_grads_ready(chunk_id)
+
         if self._time_profile:
             global_timer.my_timer.finish_profile("CLIENT_release")
 
@@ -912,9 +1593,10 @@ class PatrickStarClient(object):
         self,
         param: torch.nn.Parameter,
         reset_to_state: TensorState = TensorState.HOLD,
+        plan: ParamAccessPlan = None,
     ):
         r"""release the param tensor to FREE or HOLD"""
-        self.release(param, AccessType.DATA, reset_to_state)
+        self.release(param, AccessType.DATA, reset_to_state, plan)
 
     def release_grad(
         self,
@@ -930,7 +1612,6 @@ class PatrickStarClient(object):
         """
         return the overall size of all chunks and
         the overall chunk utilization excluding fragments.
-        Excepting the dummy chunk if using MSC.
         """
         overall_size = 0
         overall_chunk_num = 0
@@ -943,8 +1624,6 @@ class PatrickStarClient(object):
             logger.debug(f"Chunk list {type}")
             for chunk_id in type_chunk_list:
                 chunk = self.chunk_list[chunk_id]
-                if self.opt_config["with_mem_saving_comm"] and chunk.is_dummy():
-                    continue
                 comm_info = self.chunk_tensor_index.chunk_id_to_comm_info_map[chunk_id]
                 assert comm_info is not None
                 last_used_pos = 0
@@ -972,8 +1651,6 @@ class PatrickStarClient(object):
             logger.debug(f"Chunk list {type}")
             for chunk_id in type_chunk_list:
                 chunk = self.chunk_list[chunk_id]
-                if self.opt_config["with_mem_saving_comm"] and chunk.is_dummy():
-                    continue
                 comm_info = self.chunk_tensor_index.chunk_id_to_comm_info_map[chunk_id]
                 assert comm_info is not None
 
@@ -27,7 +27,7 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from patrickstar.utils import get_world_size
+from patrickstar.utils import get_shard_world_size
 
 
 class CommGroupInfo(object):
@@ -47,7 +47,7 @@ class CommGroupInfo(object):
 
 class CommInfo(object):
     def __init__(self, chunk_type, group_id, offset):
-        assert offset < get_world_size()
+        assert offset < get_shard_world_size()
         self.group = CommGroupInfo(chunk_type=chunk_type, id=group_id)
         self.offset = offset
 
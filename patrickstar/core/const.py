@@ -79,6 +79,14 @@ class ChunkType(Enum):
     MOMENTUM = 2
     VARIANCE = 3
     UNDEF = 4
+    # Checkpointed activations.
+    ACTIVATION = 5
+    # Params not requiring grad, fp16 only and read only.
+    PARAM_FP16_FROZEN = 6
+    # Block-wise int8 quantized optimizer states and their fp32 block scales.
+    MOMENTUM_INT8 = 7
+    VARIANCE_INT8 = 8
+    QUANT_SCALE = 9
 
 
 class ParamType(Enum):
@@ -30,8 +30,8 @@
 import torch
 
 import patrickstar.utils.global_timer as global_timer
-from patrickstar.core.parameter import ParamType
-from patrickstar.utils import logger, get_rank, get_world_size
+from patrickstar.utils import logger, get_rank, get_world_size, sparse_allreduce
+from .access_plan import ModuleAccessPlan
 from .const import TensorState, AccessType, TrainingStage
 
 
@@ -120,113 +120,138 @@ class PostBackwardFunction(torch.autograd.Function):
 
 
 # Need to be idempotent.
-def pre_sub_module_forward_function(sub_module, client, name):
-    flag = False
-    rank = get_rank()
-    logger.debug(
-        f"rank {rank} FWD pre {name}.{sub_module.__class__.__name__} access data"
-    )
-    for _, param in sub_module.named_parameters(recurse=False):
-        if param.ps_attr.param_type == ParamType.TORCH_BASED:
-            continue
+def pre_sub_module_forward_function(sub_module, client, name, plan):
+    logger.debug(f"FWD pre {name}.{sub_module.__class__.__name__} access data")
+    if len(plan) == 0:
+        return
+    with_mem_saving_comm = client.opt_config["with_mem_saving_comm"]
+    for param_plan in plan:
+        param = param_plan.param
         param.data = client.access_dist(
             param,
             AccessType.DATA,
             client.device,
-            client.opt_config["with_mem_saving_comm"],
+            with_mem_saving_comm,
             training_stage=TrainingStage.FWD,
+            plan=param_plan,
         )
-        flag = True
-    if flag:
-        client.trigger_memory_tracing()
-        client.adjust_chunk_layout()
+    client.prefetch_declared_chunk(plan)
+    client.trigger_memory_tracing()
+    client.adjust_chunk_layout()
 
 
 # release submodule
-def post_sub_module_forward_function(sub_module, client, name):
-    for sub_name, param in sub_module.named_parameters(recurse=False):
-        if param.ps_attr.param_type == ParamType.TORCH_BASED:
-            continue
-        rank = get_rank()
-        logger.debug(f"rank {rank} FWD post {name}.{sub_name}")
-        if get_world_size() > 1:
+def post_sub_module_forward_function(sub_module, client, name, plan):
+    logger.debug(f"FWD post {name}.{sub_module.__class__.__name__}")
+    is_dist = get_world_size() > 1
+    is_fwd = client.training_stage() == TrainingStage.FWD
+    with_mem_saving_comm = client.opt_config["with_mem_saving_comm"]
+    for param_plan in plan:
+        param = param_plan.param
+        if is_dist:
             client.release_dist(
                 param,
                 AccessType.DATA,
                 TensorState.HOLD_AFTER_FWD,
                 training_stage=TrainingStage.FWD,
                 do_allreduce=False,
-                with_mem_saving_comm=client.opt_config["with_mem_saving_comm"],
+                with_mem_saving_comm=with_mem_saving_comm,
+                plan=param_plan,
             )
         else:
-            client.release_data(param, TensorState.HOLD_AFTER_FWD)
+            client.release_data(param, TensorState.HOLD_AFTER_FWD, plan=param_plan)
 
-        if client.training_stage() == TrainingStage.FWD:
+        if is_fwd:
             param.ps_attr.fwd_used_cnt += 1
 
     # client.trigger_memory_tracing()
     # client.adjust_chunk_layout()
 
 
-def pre_sub_module_backward_function(sub_module, client, name):
-    flag = False
-    for sub_name, param in sub_module.named_parameters(recurse=False):
-        if param.ps_attr.param_type == ParamType.TORCH_BASED:
-            continue
-        rank = get_rank()
-        logger.debug(f"rank {rank} BWD pre {name}.{sub_name}")
-        if param.ps_attr.data_type == torch.half:
+def pre_sub_module_backward_function(sub_module, client, name, plan):
+    logger.debug(f"BWD pre {name}.{sub_module.__class__.__name__}")
+    if len(plan) == 0:
+        return
+    with_mem_saving_comm = client.opt_config["with_mem_saving_comm"]
+    for param_plan in plan:
+        param = param_plan.param
+        if param.ps_attr.data_type == client.half_dtype:
             tmp_tensor = client.access_dist(
                 param,
                 AccessType.DATA,
                 client.device,
-                client.opt_config["with_mem_saving_comm"],
+                with_mem_saving_comm,
                 training_stage=TrainingStage.BWD,
+                plan=param_plan,
             )
             param.data = tmp_tensor
 
             # NOTE() bwd first visits this param
-            if param.ps_attr.bwd_used_cnt == 0:
+            if param.ps_attr.bwd_used_cnt == 0 and not param.ps_attr.is_frozen():
                 param.grad = torch.zeros_like(tmp_tensor)
             param.ps_attr.bwd_used_cnt += 1
         elif param.ps_attr.data_type == torch.float:
             raise RuntimeError("fp32 training is not supported!")
-        flag = True
-    if flag:
-        client.trigger_memory_tracing()
-        client.adjust_chunk_layout()
+    client.prefetch_declared_chunk(plan)
+    client.trigger_memory_tracing()
+    client.adjust_chunk_layout()
 
 
-def post_sub_module_backward_function(sub_module, client, name):
-    for sub_name, param in sub_module.named_parameters(recurse=False):
-        if param.ps_attr.param_type == ParamType.TORCH_BASED:
-            continue
+def post_sub_module_backward_function(sub_module, client, name, plan):
+    logger.debug(f"BWD post {name}.{sub_module.__class__.__name__}")
+    is_dist = torch.distributed.is_initialized()
+    with_mem_saving_comm = client.opt_config["with_mem_saving_comm"]
+    for param_plan in plan:
+        param = param_plan.param
         # NOTE() We add a fp16 or fp32 attribute to the ps_attr of param.
         # We should not use the data type of param.data in the condition judgment.
         # Since the data type of param.data and ps_attr are not the same.
         # We can change the param.data at will, and there is no restriction to do this.
-        assert param.ps_attr.data_type == torch.half
+        assert param.ps_attr.data_type == client.half_dtype
         # NOTE() When a parameter is shared by multiple operators,
         # a reference counter is needed to correctly trigger the chunk reusing.
         # The memory space of the last updated param fp16 is covered by grad fp16.
-        client.optimizer.check_overflow(param)
+        is_last_visit = param.ps_attr.bwd_used_cnt == param.ps_attr.fwd_used_cnt
+        if param.ps_attr.is_frozen():
+            # The frozen params have no grad, their chunks are read only
+            # and are not reduced.
+            if is_last_visit:
+                if is_dist:
+                    client.release_dist(
+                        param,
+                        AccessType.DATA,
+                        TensorState.HOLD_AFTER_BWD,
+                        training_stage=TrainingStage.BWD,
+                        do_allreduce=False,
+                        with_mem_saving_comm=with_mem_saving_comm,
+                        plan=param_plan,
+                    )
+                else:
+                    client.release_data(
+                        param, TensorState.HOLD_AFTER_BWD, plan=param_plan
+                    )
+            continue
+        # In the non-last micro-batches of gradient accumulation, the grads
+        # are moved out of the chunks instead of being reduced, see
+        # `PatrickStarClient._accumulate_chunk_grads`.
+        # The grad is checked for overflow once per chunk before the optimizer
+        # step, see `FP16ChunkOptimizer.check_chunk_grads`.
         # NOTE() bwd last visits this pardam
-        if param.ps_attr.bwd_used_cnt == param.ps_attr.fwd_used_cnt:
+        if is_last_visit:
             tmp_tensor = param.ps_attr.access_tensor(AccessType.DATA)
             tmp_tensor.copy_(param.grad)
-            if torch.distributed.is_initialized():
+            if is_dist:
                 client.release_dist(
                     param,
                     AccessType.DATA,
                     TensorState.HOLD_AFTER_BWD,
                     training_stage=TrainingStage.BWD,
                     do_allreduce=True,
-                    with_mem_saving_comm=client.opt_config["with_mem_saving_comm"],
+                    with_mem_saving_comm=with_mem_saving_comm,
+                    plan=param_plan,
                 )
             else:
-                client.release_data(param, TensorState.HOLD_AFTER_BWD)
-            rank = get_rank()
-            logger.debug(f"rank {rank} BWD post before release_dist {name}.{sub_name}")
+                client.release_data(param, TensorState.HOLD_AFTER_BWD, plan=param_plan)
             param.grad = None
 
     # client.trigger_memory_tracing()
@@ -248,16 +273,20 @@ def _register_hooks_recursively(module, client, name=""):
     ):
         return
 
+    # The chunk-tensor-mapping is fixed at this point, so the chunk info
+    # of the params is resolved once instead of at every hook call.
+    plan = ModuleAccessPlan(module, client)
+
     def _pre_forward_module_hook(module, *args):
-        pre_sub_module_forward_function(module, client, name)
+        pre_sub_module_forward_function(module, client, name, plan)
 
     def _post_forward_module_hook(module, *args):
-        post_sub_module_forward_function(module, client, name)
+        post_sub_module_forward_function(module, client, name, plan)
 
     # The hook can modify the output
     def _pre_backward_module_hook(module, inputs, output):
         def _run_before_backward_function(sub_module):
-            pre_sub_module_backward_function(sub_module, client, name)
+            pre_sub_module_backward_function(sub_module, client, name, plan)
 
         return _apply_to_tensors_only(
             module, PreBackwardFunction, _run_before_backward_function, output
@@ -265,7 +294,7 @@ def _register_hooks_recursively(module, client, name=""):
 
     def _post_backward_module_hook(module, inputs):
         def _run_after_backward_function(sub_module):
-            post_sub_module_backward_function(sub_module, client, name)
+            post_sub_module_backward_function(sub_module, client, name, plan)
 
         return _apply_to_tensors_only(
             module, PostBackwardFunction, _run_after_backward_function, inputs
@@ -278,23 +307,67 @@ def _register_hooks_recursively(module, client, name=""):
     module.register_forward_pre_hook(_post_backward_module_hook)
 
 
+def _register_inference_hooks_recursively(module, client, name=""):
+    r"""Register forward hooks only, in post order traverse."""
+    for child_name, child in module.named_children():
+        _register_inference_hooks_recursively(child, client, name + child_name)
+
+    if (
+        len(list(module.named_parameters(recurse=False))) == 0
+        and len(list(module.named_buffers(recurse=False))) == 0
+    ):
+        return
+
+    plan = ModuleAccessPlan(module, client)
+
+    def _pre_forward_module_hook(module, *args):
+        # The chunks are managed by the caller, e.g. the layer-major
+        # batch inference runner.
+        if client.hooks_paused:
+            return
+        pre_sub_module_forward_function(module, client, name, plan)
+        client.prefetch_next_chunk(plan)
+
+    def _post_forward_module_hook(module, *args):
+        if client.hooks_paused:
+            return
+        post_sub_module_forward_function(module, client, name, plan)
+
+    module.register_forward_pre_hook(_pre_forward_module_hook)
+    module.register_forward_hook(_post_forward_module_hook)
+
+
+def setup_patrickstar_inference_hooks(module, client):
+    _register_inference_hooks_recursively(module, client)
+
+
 def setup_patrickstar_hooks(module, client):
     _register_hooks_recursively(module, client)
 
     def make_post_backward_hook(param):
         def hook(*ignore):
+            # The grads accumulate in `param.grad` until the last micro-batch.
+            if client.accumulate_grads:
+                return
             client.optimizer.check_overflow(param)
             # Here we use gloo backend group for the cpu tensors (embedding).
             if get_world_size() > 1:
                 global_timer.my_timer.start_profile("HOOK_torch_allreduce")
                 world_size = get_world_size()
-                torch.distributed.all_reduce(
-                    param.grad,
-                    op=torch.distributed.ReduceOp.SUM,
-                    group=client.cpu_comm_group,
-                    async_op=False,
-                )
-                param.grad /= world_size
+                if param.grad.is_sparse:
+                    # Row-sparse grad of CPU embedding, only the indices and
+                    # values of the touched rows are exchanged.
+                    param.grad = sparse_allreduce(
+                        param.grad, group=client.cpu_comm_group
+                    )
+                else:
+                    torch.distributed.all_reduce(
+                        param.grad,
+                        op=torch.distributed.ReduceOp.SUM,
+                        group=client.cpu_comm_group,
+                        async_op=False,
+                    )
+                    param.grad /= world_size
                 global_timer.my_timer.finish_profile("HOOK_torch_allreduce")
             logger.debug(f"rank {get_rank()} allreduce grad {param.ps_attr.name}")
 
@@ -39,7 +39,7 @@ from patrickstar.utils import (
     get_sys_memory_used,
     get_local_world_size,
     logger,
-    get_world_size,
+    get_shard_world_size,
 )
 from patrickstar.core.memtracer.metronome import Metronome
 from concurrent.futures import ThreadPoolExecutor
@@ -98,7 +98,11 @@ class RuntimeMemTracer(object):
     """
 
     def __init__(
-        self, local_rank: int = 0, config=None, with_mem_saving_comm: bool = False
+        self,
+        local_rank: int = 0,
+        config=None,
+        with_mem_saving_comm: bool = False,
+        msc_max_inflight: int = 1,
     ):
         self.local_rank = local_rank
         self.metronome = Metronome()
@@ -109,6 +113,7 @@ class RuntimeMemTracer(object):
         self.cpu_chunk_used_mem = 0
         self.cpu_chunk_used_mem_pinned = 0
         self.with_mem_saving_comm = with_mem_saving_comm
+        self.msc_max_inflight = msc_max_inflight
         if config is not None:
             self._overall_gpu_mem_ratio = config.get("overall_gpu_mem_ratio", 0.8)
             self._overall_cpu_mem_ratio = config.get("overall_cpu_mem_ratio", 0.8)
@@ -128,12 +133,20 @@ class RuntimeMemTracer(object):
             self.use_fake_dist = False
             self.with_static_partition = False
             self.use_async_mem_monitor = True
+        if not torch.cuda.is_available():
+            # There is no GPU memory to monitor in the device abstracted mode.
+            self.use_async_mem_monitor = False
         if self.use_async_mem_monitor:
             self.async_mem_monitor = AsyncMemoryMonitor()
 
         mem_info = get_memory_info()
         local_world_size = get_local_world_size()
-        if self.use_fake_dist:
+        if not torch.cuda.is_available():
+            self._overall_gpu_mem = 0
+            self._overall_cpu_mem = (
+                mem_info.total * self._overall_cpu_mem_ratio / local_world_size
+            )
+        elif self.use_fake_dist:
             # Fake distribtued mode: all processes share the same GPU.
             self._overall_gpu_mem = (
                 torch.cuda.get_device_properties(0).total_memory
@@ -169,6 +182,9 @@ class RuntimeMemTracer(object):
         # Calculated by substracting the peak memory of fp16 params
         # from peak system memory.
         self._margin_chunk_num_for_gpu_adam = 0
+        # The bytes of the fp32 param and the optimizer states per element,
+        # 12 = 4 + 4 + 4 (fp32 + m + v).
+        self.optimizer_state_bytes_per_elem = 12
         self._default_chunk_size = 0
         self.max_cpu_sys_used = 0
 
@@ -208,9 +224,10 @@ class RuntimeMemTracer(object):
         margin_mem_size = (
             self._overall_gpu_mem - max_gpu_sys_used - self._param_fp16_chunk_size
         )
-        # 12 = 4 + 4 + 4 (fp32 + m + v)
         self._margin_chunk_num_for_gpu_adam = (
-            (margin_mem_size) / (self._default_chunk_size * 12) * self._margin_use_ratio
+            (margin_mem_size)
+            / (self._default_chunk_size * self.optimizer_state_bytes_per_elem)
+            * self._margin_use_ratio
         )
 
         log_dist("--------------- GPU INFO AFTER BWD ----------------")
@@ -400,9 +417,10 @@ class RuntimeMemTracer(object):
                 return self._overall_cpu_mem
         elif device_type == "cuda":
             if self.with_mem_saving_comm:
-                msc_factor = 1
+                # Pipelined MSC keeps multiple remote chunks in flight.
+                msc_factor = self.msc_max_inflight
             else:
-                msc_factor = get_world_size()
+                msc_factor = get_shard_world_size()
             if self.metronome.training_stage() == TrainingStage.ADAM:
                 return self._overall_gpu_mem - 4 * self._default_chunk_size * 4
             elif self.metronome.training_stage() == TrainingStage.FWD:
@@ -86,6 +86,8 @@ class PSParameter(object):
 
         # Whether the param belongs to local chunk.
         self._is_local = True
+        # Whether the param is in the read only frozen chunks.
+        self._is_frozen = False
 
     def __str__(self):
         return (
@@ -97,6 +99,9 @@ class PSParameter(object):
     def is_local(self):
         return self._is_local
 
+    def is_frozen(self):
+        return self._is_frozen
+
     def reset_shape(self, new_shape):
         self.shape = new_shape
         self.numel = new_shape.numel()
@@ -131,6 +136,10 @@ class PSParameter(object):
         ps_tensor = self._access_ps_tensor(access_type)
         ps_tensor.tensor = tensor.view(self.shape)
 
+    def set_view(self, view: torch.Tensor, access_type: AccessType):
+        r"""Set a tensor already viewed in the shape of the param."""
+        self._access_ps_tensor(access_type).tensor = view
+
     def access_tensor(self, access_type: AccessType):
         return self._access_ps_tensor(access_type).tensor
 
@@ -86,6 +86,21 @@ def torch_scope(do_allreduce=True):
     _runtime_config.pop()
 
 
+@contextlib.contextmanager
+def frozen_scope():
+    r"""All parameters initialized in this scope will be frozen.
+
+    The frozen params are stored in fp16 only chunks, without fp32 copy and
+    optimizer states, and are never updated. Params with `requires_grad`
+    being False at the end of the constructor of their module are frozen
+    as well.
+    """
+    _runtime_config.push()
+    _runtime_config.config["frozen"] = True
+    yield
+    _runtime_config.pop()
+
+
 def cast_forward(module, dtype):
     if not isinstance(dtype, torch.dtype):
         raise ValueError("dtype should be of torch.dtype.")
@@ -211,6 +226,9 @@ class InsertPostInitMethodToModuleSubClasses(object):
 class PSPreProcessCtx(InsertPostInitMethodToModuleSubClasses):
     """
     A context to initialize model
+
+    If `inference` is set, only the param fp16 chunks are built for
+    forward-only execution, no fp32 params are created.
     """
 
     def __init__(
@@ -218,24 +236,29 @@ class PSPreProcessCtx(InsertPostInitMethodToModuleSubClasses):
         client: PatrickStarClient,
         release_after_init=False,
         use_cpu_embedding=False,
+        sparse_embedding_grad=False,
         dtype=None,
         not_init=False,
+        inference=False,
     ):
         super().__init__(config=None, dtype=dtype)
         self.rank = get_rank()
         self.world_size = get_world_size()
         self.client = client
-        self.dummy_param_list = []
         self.param_idx = 0
 
         self.release_after_init = release_after_init
         self.use_cpu_embedding = use_cpu_embedding
+        self.sparse_embedding_grad = sparse_embedding_grad
 
         self.submodule_id = -1
         self.not_init = not_init
+        self.inference = inference
 
     def _pre_context_exec(self):
         Embedding.use_cpu = self.use_cpu_embedding
+        Embedding.sparse_grad = self.sparse_embedding_grad
+        Embedding.dtype = self.client.half_dtype
 
         def _new(cls, *args, **kwargs):
             embedding = object.__new__(Embedding)
@@ -247,9 +270,10 @@ class PSPreProcessCtx(InsertPostInitMethodToModuleSubClasses):
         """The callback function when the context exits.
 
         1. Copy param.data to fp16 and fp32 chunk based params.
-        2. Append dummy chunk so that the number of chunks is an integer multiple of
-            number of processes.
-        3. Add a dummy param at the start of CPU Embedding for huggingface.
+        2. Add a dummy param at the start of CPU Embedding for huggingface.
+
+        NOTE() The number of chunks is not required to be an integer multiple of
+        number of processes. The last comm group may have less chunks.
         """
         log_dist("Post Model Init Context")
 
@@ -272,18 +296,25 @@ class PSPreProcessCtx(InsertPostInitMethodToModuleSubClasses):
                 # TODO(zilinzhu) Figure out why dummy in the __init__ of Embedding will
                 # cause numeric error.
                 instance.dummy = torch.nn.Parameter(
-                    torch.tensor([], dtype=torch.half), requires_grad=False
+                    torch.tensor([], dtype=self.client.half_dtype),
+                    requires_grad=False,
                 )
                 register_param(
                     instance.dummy,
                     ParamType.TORCH_BASED,
-                    torch.half,
+                    self.client.half_dtype,
                     "embedding_dummy",
                 )
                 instance._parameters.move_to_end("dummy", last=False)
             # Clean the members to prevent elements not grabage collected.
             Embedding.instances = []
             Embedding.use_cpu = False
+        Embedding.sparse_grad = False
+        Embedding.dtype = torch.half
+
+        if self.inference:
+            self._copy_to_param_fp16_chunks(ChunkType.PARAM_FP16)
+            return
 
         chunk_num = 0
         for param_fp16_chunk_id, param_fp32_chunk_id in zip(
@@ -317,7 +348,7 @@ class PSPreProcessCtx(InsertPostInitMethodToModuleSubClasses):
 
                             self.client.release_data(param_fp16)
                             self.client.release_data(param_fp32)
-                            param_fp16 = param_fp16.to(torch.half)
+                            param_fp16 = param_fp16.to(self.client.half_dtype)
             else:
                 for param_fp16 in self.client.chunk_tensor_index.params_generator(
                     param_fp16_chunk_id
@@ -326,18 +357,38 @@ class PSPreProcessCtx(InsertPostInitMethodToModuleSubClasses):
                     # When release_after_init is True, we will release the remote
                     # param tensor here.
                     # When release_after_init is False, this will help cast dtype of
-                    # remote params to torch.half (See the NOTE below).
+                    # remote params to the half dtype (See the NOTE below).
                     param_fp16.data = torch.tensor(
-                        [], dtype=torch.half, device=param_fp16.device
+                        [], dtype=self.client.half_dtype, device=param_fp16.device
                     )
             chunk_num += 1
 
-        world_size = get_world_size()
         log_dist(f"Param fp16 chunk num {chunk_num}")
-        while chunk_num % world_size != 0:
-            self.client.append_dummy_chunk(torch.half, ChunkType.PARAM_FP16)
+        self._copy_to_param_fp16_chunks(ChunkType.PARAM_FP16_FROZEN)
+
+    def _copy_to_param_fp16_chunks(self, chunk_type):
+        r"""Copy param.data to the fp16 chunks without fp32 copies, i.e. all
+        the fp16 chunks for inference and the frozen chunks for training."""
+        chunk_num = 0
+        for param_fp16_chunk_id in self.client.chunk_ids_generator(chunk_type):
+            for param_fp16 in self.client.chunk_tensor_index.params_generator(
+                param_fp16_chunk_id
+            ):
+                if self.client.is_local_param(param_fp16, AccessType.DATA):
+                    if not self.not_init:
+                        ps_data_fp16 = self.client.access_data(
+                            param_fp16, torch.device("cpu:0")
+                        )
+                        ps_data_fp16.copy_(param_fp16.data)
+                        self.client.release_data(param_fp16)
+                else:
+                    param_fp16.data = torch.tensor(
+                        [], dtype=self.client.half_dtype, device=param_fp16.device
+                    )
             chunk_num += 1
 
+        log_dist(f"{chunk_type} chunk num {chunk_num}")
+
     def _post_init_method(self, module):
         r"""The function to call at the end of the constructor of each nn.Module.
 
@@ -380,14 +431,29 @@ class PSPreProcessCtx(InsertPostInitMethodToModuleSubClasses):
         # the one in optimizer parameter group.
         param_fp16_list = []
         param_fp32_list = []
+        # The params not requiring grad are packed into separate chunks,
+        # which have no fp32 copies and optimizer states.
+        frozen_param_list = []
         for name, param in module.named_parameters(recurse=False):
             name = f"{module.__class__.__name__}.{name}_{self.param_idx}"
-            register_param(param, ParamType.CHUNK_BASED, torch.half, name)
+            is_frozen = not self.inference and (
+                _runtime_config.frozen or not param.requires_grad
+            )
+            if is_frozen:
+                param.requires_grad = False
+            register_param(param, ParamType.CHUNK_BASED, self.client.half_dtype, name)
             self.param_idx += 1
-            param_fp16_list.append(param)
             logger.debug(
                 f"** Converting Params {name} in module id {self.submodule_id}"
             )
+            self.client.chunk_based_param_fp16.append(param)
+            if is_frozen:
+                param.ps_attr._is_frozen = True
+                frozen_param_list.append(param)
+                continue
+            param_fp16_list.append(param)
+            if self.inference:
+                continue
             # Append a tensor to the param fp32 chunk list.
             # Before that, we have to build a fp32 param.
             param_fp32 = torch.nn.Parameter(
@@ -400,20 +466,37 @@ class PSPreProcessCtx(InsertPostInitMethodToModuleSubClasses):
             )
             param_fp32.ps_attr.reset_shape(param.shape)
             self.client.param_fp16_to_param_fp32_map[param] = param_fp32
-            self.client.chunk_based_param_fp16.append(param)
 
         self.client.append_tensor(
-            param_fp16_list, torch.half, AccessType.DATA, ChunkType.PARAM_FP16
-        )
-        self.client.append_tensor(
-            param_fp32_list, torch.float, AccessType.DATA, ChunkType.PARAM_FP32
+            param_fp16_list,
+            self.client.half_dtype,
+            AccessType.DATA,
+            ChunkType.PARAM_FP16,
         )
+        if self.inference:
+            # No fp32 params for forward-only execution.
+            param_fp32_list = [None] * len(param_fp16_list)
+        else:
+            self.client.append_tensor(
+                param_fp32_list, torch.float, AccessType.DATA, ChunkType.PARAM_FP32
+            )
+        if len(frozen_param_list) > 0:
+            self.client.append_tensor(
+                frozen_param_list,
+                self.client.half_dtype,
+                AccessType.DATA,
+                ChunkType.PARAM_FP16_FROZEN,
+            )
 
-        for param_fp16, param_fp32 in zip(param_fp16_list, param_fp32_list):
+        for param_fp16, param_fp32 in zip(
+            param_fp16_list + frozen_param_list,
+            param_fp32_list + [None] * len(frozen_param_list),
+        ):
             # Delete the memory of non local tensors
             if not self.client.is_local_param(param_fp16, AccessType.DATA):
                 param_fp16.ps_attr._is_local = False
-                param_fp32.ps_attr._is_local = False
+                if param_fp32 is not None:
+                    param_fp32.ps_attr._is_local = False
                 # TODO(jiaruifang) fix distributed init bug.
                 # Check results will fail when not release_after_init.
                 # As release tensor here will make the random seed generator
@@ -430,6 +513,7 @@ class PSPreProcessCtx(InsertPostInitMethodToModuleSubClasses):
                     )
             else:
                 param_fp16.ps_attr._is_local = True
-                param_fp32.ps_attr._is_local = True
+                if param_fp32 is not None:
+                    param_fp32.ps_attr._is_local = True
 
-        cast_forward(module, torch.half)
+        cast_forward(module, self.client.half_dtype)
@@ -42,6 +42,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import torch
+
 
 class LossScaler:
     """
@@ -64,6 +66,11 @@ class LossScaler:
     def _has_inf_or_nan(x):
         return False
 
+    @staticmethod
+    def inf_or_nan_flag(x):
+        r"""The static loss scale never checks overflow."""
+        return None
+
     def update_scale(self, overflow):
         pass
 
@@ -131,28 +138,22 @@ class DynamicLossScaler:
         return False
 
     def _has_inf_or_nan(x):
-        try:
-            # if x is half, the .float() incurs an additional deep copy, but it's necessary if
-            # Pytorch's .sum() creates a one-element tensor of the same type as x
-            # (which is true for some recent version of pytorch).
-            cpu_sum = float(x.float().sum())
-            # More efficient version that can be used if .sum() returns a Python scalar
-            # cpu_sum = float(x.sum())
-        except RuntimeError as instance:
-            # We want to check if inst is actually an overflow exception.
-            # RuntimeError could come from a different error.
-            # If so, we still want the exception to propagate.
-            if "value cannot be converted" not in instance.args[0]:
-                raise
-            return True
-        else:
-            if (
-                cpu_sum == float("inf")
-                or cpu_sum == -float("inf")
-                or cpu_sum != cpu_sum
-            ):
-                return True
-            return False
+        return bool(DynamicLossScaler.inf_or_nan_flag(x))
+
+    @staticmethod
+    def inf_or_nan_flag(x):
+        r"""Return a 0-dim bool tensor on the device of `x`, True if `x` has
+        inf or nan. The flag is not synced to the host, so that the flags of
+        many tensors can be accumulated and read once.
+        """
+        if x.is_sparse:
+            # Only the stored values of a sparse grad could overflow.
+            x = x.coalesce()._values()
+        # A single fused reduction. The sum is accumulated in fp32, which can
+        # not overflow for finite fp16 elements, while any inf or nan element
+        # propagates to the result. There is no deep copy of `x` as in
+        # `float(x.float().sum())`.
+        return ~torch.isfinite(x.sum(dtype=torch.float))
 
     # `overflow` is boolean indicating whether the gradient overflowed
     def update_scale(self, overflow):
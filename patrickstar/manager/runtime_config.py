@@ -38,6 +38,8 @@ class RuntimeConfig(metaclass=SingletonMeta):
             # Whether the torch based tensors will do allreduce,
             # this is strongly related to `torch_scope`
             "do_allreduce": True,
+            # Whether the params are frozen, see `frozen_scope`
+            "frozen": False,
         }
         self.old_configs = []
 
@@ -49,6 +51,10 @@ class RuntimeConfig(metaclass=SingletonMeta):
     def do_allreduce(self):
         return self.config["do_allreduce"]
 
+    @property
+    def frozen(self):
+        return self.config["frozen"]
+
     def push(self):
         self.old_configs.append(self.config)
         self.config = deepcopy(self.config)
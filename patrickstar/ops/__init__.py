@@ -28,4 +28,8 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 from .embedding import Embedding
+from .chunk_optimizer import FP16ChunkOptimizer
 from .fp16_cpu_adam import FP16Adam
+from .fp16_lamb import FP16Lamb
+from .fp16_adafactor import FP16Adafactor
+from .tiling import TiledLinear, TiledEmbedding
@@ -0,0 +1,177 @@
+# BSD 3-Clause License
+#
+# Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the psutil authors nor the names of its contributors
+#    may be used to endorse or promote products derived from this software without
+#    specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import time
+
+from patrickstar.profiler import profiler
+
+# The CPU Adam throughput (elements per second) assumed before the first
+# CPU update is measured.
+DEFAULT_CPU_ADAM_THROUGHPUT = 1e9
+
+
+class HybridAdamPlacement(object):
+    r"""The cost model deciding which chunks hybrid Adam updates on GPU.
+
+    For every local param fp16 chunk, the time of its update on GPU and on
+    CPU is estimated from the bytes moved over PCIe and the CPU Adam
+    throughput, given where its chunks currently reside:
+
+    - GPU: the fp32 param and optimizer state chunks on CPU are moved to
+      GPU, the grad is read to GPU if the fp16 chunk is on CPU, and so is
+      the write-back of the updated params.
+    - CPU: the fp32 param and optimizer state chunks on GPU are moved to
+      CPU, the grad is read to CPU if the fp16 chunk is on GPU, the fp32
+      params are written back to the fp16 chunk on GPU, plus the CPU Adam
+      computation.
+
+    The GPU computation is neglected. The chunks saving the most time are
+    updated on GPU, no more than the margin left by the peak memory of FWD
+    and BWD. The ties, e.g. before any state has moved, are broken by the
+    order the fp16 chunks are accessed in the next FWD, which is the
+    visiting order of the previous placement in most models.
+    """
+
+    def __init__(
+        self, client, pcie_bandwidth, cpu_adam_throughput=0, half_write_back=False
+    ):
+        """
+        Args:
+            client: :class:`PatrickStarClient`.
+            pcie_bandwidth: `float`. The CPU-GPU bandwidth in bytes per second.
+            cpu_adam_throughput: `float`. The elements updated per second by
+                the CPU Adam. Measured from the CPU updates if not positive.
+            half_write_back: `bool`. The params updated on CPU are written
+                back to GPU in fp16.
+        """
+        self.client = client
+        self.pcie_bandwidth = pcie_bandwidth
+        self.half_write_back = half_write_back
+        self.calibrate = cpu_adam_throughput <= 0
+        if self.calibrate:
+            cpu_adam_throughput = DEFAULT_CPU_ADAM_THROUGHPUT
+        self.cpu_adam_throughput = cpu_adam_throughput
+        self._cpu_update_numel = 0
+        self._cpu_update_time = 0.0
+        # The decisions of the last `plan`, see `_chunk_decision`.
+        self.decisions = []
+
+    def record_cpu_update(self, numel, elapsed):
+        r"""Record a CPU update of `numel` elements taking `elapsed` seconds."""
+        self._cpu_update_numel += numel
+        self._cpu_update_time += elapsed
+
+    def finish_step(self):
+        r"""Calibrate the CPU Adam throughput with the updates of the step."""
+        if self.calibrate and self._cpu_update_time > 0:
+            self.cpu_adam_throughput = self._cpu_update_numel / self._cpu_update_time
+        self._cpu_update_numel = 0
+        self._cpu_update_time = 0.0
+
+    def _on_gpu(self, chunk_id):
+        device = self.client.chunk_list[chunk_id].get_device()
+        return device is not None and device.type == "cuda"
+
+    def _chunk_decision(self, fp16_chunk_id, fp32_chunk_id, state_chunk_ids):
+        r"""The estimated costs of updating the chunk on either device."""
+        chunk_list = self.client.chunk_list
+        fp16_chunk = chunk_list[fp16_chunk_id]
+        grad_bytes = fp16_chunk.get_chunk_space()
+        # The write-back moves the whole fp32 chunk, or the fp16 chunk if
+        # cast on CPU.
+        write_back_bytes = chunk_list[fp32_chunk_id].get_chunk_space()
+        cpu_write_back_bytes = grad_bytes if self.half_write_back else write_back_bytes
+        grad_on_gpu = self._on_gpu(fp16_chunk_id)
+
+        state_bytes_on_cpu = 0
+        state_bytes_on_gpu = 0
+        for chunk_id in [fp32_chunk_id] + state_chunk_ids:
+            if self._on_gpu(chunk_id):
+                state_bytes_on_gpu += chunk_list[chunk_id].get_chunk_space()
+            else:
+                state_bytes_on_cpu += chunk_list[chunk_id].get_chunk_space()
+
+        gpu_bytes = state_bytes_on_cpu
+        cpu_bytes = state_bytes_on_gpu
+        if grad_on_gpu:
+            cpu_bytes += grad_bytes + cpu_write_back_bytes
+        else:
+            gpu_bytes += grad_bytes + write_back_bytes
+        gpu_cost = gpu_bytes / self.pcie_bandwidth
+        cpu_cost = (
+            cpu_bytes / self.pcie_bandwidth
+            + fp16_chunk.capacity / self.cpu_adam_throughput
+        )
+        return {
+            "chunk_id": fp16_chunk_id,
+            "grad_on_gpu": grad_on_gpu,
+            "state_bytes_on_gpu": state_bytes_on_gpu,
+            "state_bytes_on_cpu": state_bytes_on_cpu,
+            "fwd_pos": self.client.get_fwd_chunk_pos(fp16_chunk_id),
+            "gpu_cost": gpu_cost,
+            "cpu_cost": cpu_cost,
+            "saving": cpu_cost - gpu_cost,
+            "on_gpu": False,
+        }
+
+    def plan(self, chunk_groups, gpu_chunk_num):
+        r"""Decide the chunks to update on GPU.
+
+        Args:
+            chunk_groups: list of (fp16 chunk id, fp32 chunk id, list of the
+                optimizer state chunk ids) of the local chunks.
+            gpu_chunk_num: `int`. The max number of chunks updated on GPU.
+        Returns:
+            The set of the fp16 chunk ids to update on GPU.
+        """
+        self.decisions = [self._chunk_decision(*group) for group in chunk_groups]
+        candidates = [d for d in self.decisions if d["saving"] > 0]
+        num_chunks = len(self.decisions)
+
+        def order(decision):
+            fwd_pos = decision["fwd_pos"]
+            return -decision["saving"], num_chunks if fwd_pos is None else fwd_pos
+
+        candidates.sort(key=order)
+        gpu_chunk_ids = set()
+        for decision in candidates[: max(0, gpu_chunk_num)]:
+            decision["on_gpu"] = True
+            gpu_chunk_ids.add(decision["chunk_id"])
+
+        if profiler.started():
+            profiler.hybrid_adam_placement.append(
+                {
+                    "time": time.time(),
+                    "pcie_bandwidth": self.pcie_bandwidth,
+                    "cpu_adam_throughput": self.cpu_adam_throughput,
+                    "gpu_chunk_num": gpu_chunk_num,
+                    "decisions": [dict(d) for d in self.decisions],
+                }
+            )
+        return gpu_chunk_ids
@@ -43,6 +43,17 @@ class FP16ChunkWriteBuffer(object):
     And because the params are organized in chunks, we can optimize the copy and cast
     by doing it at the granularity of chunk.
     This class is for doing the above copy and cast optimization.
+
+    The buffer is owned by the optimizer and reused across steps. The GPU
+    buffer is acquired in `prepare` at the beginning of a step and given
+    back in `reset`, so that its memory is available for the chunks during
+    forward and backward.
+
+    With `half_staging`, the fp32 params on CPU are cast to fp16 on CPU
+    into a pinned staging buffer, param by param, and the chunk is copied
+    to GPU in fp16. That halves the CPU-GPU traffic of the write-back and
+    needs no GPU buffer. The optimizer may write the fp16 params into the
+    staging buffer itself, see `staging_buff`.
     """
 
     def __init__(
@@ -51,12 +62,16 @@ class FP16ChunkWriteBuffer(object):
         chunk_tensor_index: ChunkTensorIndex,
         chunk_size: int,
         mem_cache: Optional[MemoryCache] = None,
+        half_staging: bool = False,
+        dtype: torch.dtype = torch.half,
     ):
         """
         Args:
             chunk_list: :class:`ChunkList`.
             chunk_tensor_index: :class:`ChunkTensorIndex`.
             chunk_size: `int`.
+            half_staging: `bool`. Write back through the pinned fp16 buffer.
+            dtype: :class:`torch.dtype`. The dtype of the param fp16 chunks.
         """
         self.chunk_list = chunk_list
         self.chunk_tensor_index = chunk_tensor_index
@@ -65,24 +80,107 @@ class FP16ChunkWriteBuffer(object):
         # NOTE() We found that doing a two stage copy, 1) CPU fp32 -> GPU fp32,
         # 2) GPU fp32 -> GPU fp16 is faster than one single copy_. And the
         # gpu_fp32_buff member is the itermediate buffer.
+        self.chunk_size = chunk_size
 
         self.with_mem_cache = mem_cache is not None
         if self.with_mem_cache:
             self.memory_cache = mem_cache
-            self.gpu_fp32_buff = self.memory_cache.pop_or_allocate(
-                torch.device(f"cuda:{torch.cuda.current_device()}"),
+        self.gpu_fp32_buff = None
+        self.half_staging = half_staging
+        self.cpu_half_buff = None
+        # Whether the cached chunk is written back through `cpu_half_buff`.
+        self.cached_staging = False
+        # The [start, end) ranges of `cpu_half_buff` written for the cached
+        # chunk. The params not visited by the optimizer are not flushed.
+        self.staged_ranges = []
+        if half_staging:
+            self.cpu_half_buff = torch.empty(
                 chunk_size,
+                dtype=dtype,
+                device=torch.device("cpu:0"),
+                # Pinned memory is not available without GPU.
+                pin_memory=torch.cuda.is_available(),
+            )
+        self.prepare()
+
+    def prepare(self):
+        r"""Acquire the GPU buffer for a step, if not yet."""
+        if self.half_staging or self.gpu_fp32_buff is not None:
+            return
+        gpu_device = torch.device(f"cuda:{torch.cuda.current_device()}")
+        if self.with_mem_cache:
+            self.gpu_fp32_buff = self.memory_cache.pop_or_allocate(
+                gpu_device,
+                self.chunk_size,
                 torch.float,
                 False,
             )
         else:
-            self.gpu_fp32_buff = torch.zeros(
-                chunk_size,
-                dtype=torch.float,
-                device=torch.device(f"cuda:{torch.cuda.current_device()}"),
+            # The buffer is always overwritten before read, no need to zero.
+            self.gpu_fp32_buff = torch.empty(
+                self.chunk_size, dtype=torch.float, device=gpu_device
             )
 
-    def write_from_cache(self, target_param, src_param):
+    def _flush(self):
+        r"""Copy the cached fp32 chunk to the cached fp16 chunk."""
+        target_payload = self.chunk_list[self.cached_target_chunk_id].payload
+        src_payload = self.chunk_list[self.cached_src_chunk_id].payload
+        logger.debug(
+            f"Write chunk {self.cached_src_chunk_id} -> {self.cached_target_chunk_id}, "
+            f"{src_payload.device} -> {target_payload.device}"
+        )
+        if self.cached_staging:
+            for start, end in self.staged_ranges:
+                target_payload.narrow(0, start, end - start).copy_(
+                    self.cpu_half_buff.narrow(0, start, end - start)
+                )
+        elif (
+            target_payload.device.type == "cuda"
+            and src_payload.device.type == "cpu"
+            and self.gpu_fp32_buff is not None
+        ):
+            self.gpu_fp32_buff.copy_(src_payload)
+            target_payload.copy_(self.gpu_fp32_buff)
+        else:
+            target_payload.copy_(src_payload)
+
+    def _switch_chunk(self, target_info, src_info):
+        r"""Write back the cached chunk if the params of a new chunk come."""
+        if src_info.chunk_id == self.cached_src_chunk_id:
+            return
+        if self.cached_src_chunk_id is not None:
+            self._flush()
+        self.cached_src_chunk_id = src_info.chunk_id
+        self.cached_target_chunk_id = target_info.chunk_id
+        self.staged_ranges = []
+        self.cached_staging = (
+            self.half_staging
+            and self.chunk_list[target_info.chunk_id].payload.device.type == "cuda"
+            and self.chunk_list[src_info.chunk_id].payload.device.type == "cpu"
+        )
+
+    def staging_buff(self, target_param, src_param):
+        r"""The view of `target_param` in the pinned fp16 staging buffer.
+
+        The optimizer may write the updated `target_param` into the view,
+        and call `write_from_cache` with `staged` set. None if the chunk of
+        `target_param` is not written back through the staging buffer.
+
+        Args:
+            target_param: A :class:`torch.nn.Parameter`. The fp16 param to copy to.
+            src_param: A :class:`torch.nn.Parameter`. The fp32 param to copy from.
+        """
+        assert src_param.ps_attr.param_type == ParamType.CHUNK_BASED
+        src_info = self.chunk_tensor_index.get_tensor_info(src_param.ps_attr.data_id())
+        target_info = self.chunk_tensor_index.get_tensor_info(
+            target_param.ps_attr.data_id()
+        )
+        self._switch_chunk(target_info, src_info)
+        if not self.cached_staging:
+            return None
+        return self.cpu_half_buff.narrow(0, target_info.start_offset, target_info.numel)
+
+    def write_from_cache(self, target_param, src_param, staged=False):
         r"""Write the value of `target_param` to `src_param` with casting.
 
         We assume the order of the `src_param` and `target_param` coming in
@@ -94,6 +192,8 @@ class FP16ChunkWriteBuffer(object):
         Args:
             target_param: A :class:`torch.nn.Parameter`. The fp16 param to copy to.
             src_param: A :class:`torch.nn.Parameter`. The fp32 param to copy from.
+            staged: `bool`. The fp16 value is already written to the view
+                returned by `staging_buff`.
         """
         # Torch params are of fp32 all the time, so we don't need to copy them.
         assert src_param.ps_attr.param_type == ParamType.CHUNK_BASED
@@ -101,54 +201,50 @@ class FP16ChunkWriteBuffer(object):
         target_info = self.chunk_tensor_index.get_tensor_info(
             target_param.ps_attr.data_id()
         )
-
-        if (
-            self.cached_src_chunk_id is not None
-            and src_info.chunk_id != self.cached_src_chunk_id
-        ):
-            # TODO(jiaruifang) Optimize CPU -> GPU copy.
-            target_device = self.chunk_list[self.cached_target_chunk_id].payload.device
-            src_device = self.chunk_list[self.cached_src_chunk_id].payload.device
-            logger.debug(
-                f"Write chunk {self.cached_src_chunk_id} -> {self.cached_target_chunk_id}, "
-                f"{src_device} -> {target_device}"
-            )
-            if target_device.type == "cuda" and src_device.type == "cpu":
-                self.gpu_fp32_buff.copy_(
-                    self.chunk_list[self.cached_src_chunk_id].payload
-                )
-                self.chunk_list[self.cached_target_chunk_id].payload.copy_(
-                    self.gpu_fp32_buff
-                )
-            else:
-                self.chunk_list[self.cached_target_chunk_id].payload.copy_(
-                    self.chunk_list[self.cached_src_chunk_id].payload
-                )
-        self.cached_src_chunk_id = src_info.chunk_id
-        self.cached_target_chunk_id = target_info.chunk_id
+        self._switch_chunk(target_info, src_info)
+        if not self.cached_staging:
+            return
+        if not staged:
+            # Cast on CPU while the updated param is still in cache.
+            src_payload = self.chunk_list[src_info.chunk_id].payload
+            self.cpu_half_buff.narrow(
+                0, target_info.start_offset, target_info.numel
+            ).copy_(src_payload.narrow(0, src_info.start_offset, src_info.numel))
+        start = target_info.start_offset
+        end = start + target_info.numel
+        # The params come in the order of the chunk, merge the adjacent ones.
+        if len(self.staged_ranges) > 0 and self.staged_ranges[-1][1] == start:
+            self.staged_ranges[-1][1] = end
+        else:
+            self.staged_ranges.append([start, end])
 
     def reset(self):
         r"""Reset the chunk buffer.
 
         During reset, we will copy the last chunk from fp32 to fp16.
+        The GPU buffer is given back until the next `prepare`.
         """
-        if self.cached_src_chunk_id is None:
-            return
-        global_rank = get_rank()
-        logger.debug(
-            f"global_rank {global_rank} finally, write chunk {self.cached_target_chunk_id}"
-        )
-        # It's possible that the chunk is empty (no payload), e.g. the process only possesses
-        # a large torch based embedding layer.
-        if self.chunk_list[self.cached_src_chunk_id] is not None:
-            self.chunk_list[self.cached_target_chunk_id].payload.copy_(
-                self.chunk_list[self.cached_src_chunk_id].payload
+        if self.cached_src_chunk_id is not None:
+            global_rank = get_rank()
+            logger.debug(
+                f"global_rank {global_rank} finally, write chunk {self.cached_target_chunk_id}"
             )
-        self.cached_src_chunk_id = None
-        self.cached_target_chunk_id = None
+            # It's possible that the chunk is empty (no payload), e.g. the process
+            # only possesses a large torch based embedding layer.
+            if self.chunk_list[self.cached_src_chunk_id] is not None:
+                self._flush()
+            self.cached_src_chunk_id = None
+            self.cached_target_chunk_id = None
+            self.cached_staging = False
+            self.staged_ranges = []
+        self.release_gpu_buff()
+
+    def release_gpu_buff(self):
+        if self.gpu_fp32_buff is None:
+            return
         if self.with_mem_cache:
             self.memory_cache.push(self.gpu_fp32_buff)
-            self.gpu_fp32_buff = None
+        self.gpu_fp32_buff = None
 
 
 class FP32ChunkReadBuffer(object):
@@ -158,6 +254,10 @@ class FP32ChunkReadBuffer(object):
     gradients and sometimes copy them to GPU.
     As they are organized in chunks, we will move them by chunks.
     This class is for such optimization.
+
+    The buffer is owned by the optimizer and reused across steps, so the
+    pinned CPU buffer is page-locked only once. The GPU buffer is acquired
+    in `prepare` and given back in `reset`.
     """
 
     def __init__(
@@ -167,6 +267,8 @@ class FP32ChunkReadBuffer(object):
         chunk_size: int,
         margin_chunk_num_for_gpu_adam: int,
         mem_cache: Optional[MemoryCache] = None,
+        dtype: torch.dtype = torch.half,
+        gpu_chunk_ids=None,
     ):
         """
         Args:
@@ -174,11 +276,19 @@ class FP32ChunkReadBuffer(object):
             chunk_tensor_index: :class:`ChunkTensorIndex`.
             chunk_size: `int`.
             margin_chunk_num_for_gpu_adam: `int`. the number of GPU chunks for Adam state.
+            dtype: :class:`torch.dtype`. The dtype of the grad chunks.
+            gpu_chunk_ids: The set of the chunk ids read to GPU, see `prepare`.
         """
         self.chunk_list = chunk_list
         self.chunk_tensor_index = chunk_tensor_index
+        self.chunk_size = chunk_size
+        self.dtype = dtype
         self.cpu_payload = torch.empty(
-            chunk_size, dtype=torch.half, device=torch.device("cpu:0"), pin_memory=True
+            chunk_size,
+            dtype=dtype,
+            device=torch.device("cpu:0"),
+            # Pinned memory is not available without GPU.
+            pin_memory=torch.cuda.is_available(),
         )
         self.local_rank = chunk_list.local_rank
 
@@ -187,29 +297,39 @@ class FP32ChunkReadBuffer(object):
             self.memory_cache = mem_cache
 
         self.gpu_payload = None
-        if margin_chunk_num_for_gpu_adam > 0:
-            # When `margin_chunk_num_for_gpu_adam` > 0, it means there will be optimizer
-            # state resides on GPU. So we need to allocate a GPU buffer for those.
-            gpu_device = torch.device(f"cuda:{self.local_rank}")
-
-            if self.with_mem_cache:
-                self.gpu_payload = self.memory_cache.pop_or_allocate(
-                    gpu_device, chunk_size, torch.half, False
-                )
-            else:
-                logger.debug(
-                    f"Allocate fp32 Chunk Buffer of size {chunk_size / 1e6} MB on CPU."
-                )
-                self.gpu_payload = torch.empty(
-                    chunk_size, dtype=torch.half, device=gpu_device
-                )
-            logger.debug(
-                f"Allocate fp32 Chunk Buffer of size {chunk_size / 1e6} MB on {gpu_device}."
-            )
         self.cached_chunk_id = None
-        self.margin_chunk_num_for_gpu_adam = margin_chunk_num_for_gpu_adam
         self.cached_chunk_num = 0
         self.ret_payload = None
+        self.prepare(margin_chunk_num_for_gpu_adam, gpu_chunk_ids)
+
+    def prepare(self, margin_chunk_num_for_gpu_adam, gpu_chunk_ids=None):
+        r"""Prepare the buffer for a step.
+
+        Args:
+            margin_chunk_num_for_gpu_adam: `int`. the number of GPU chunks for Adam state.
+            gpu_chunk_ids: The set of the chunk ids whose grads are read to
+                GPU. If None, the first chunks within the margin in the
+                visiting order are read to GPU.
+        """
+        self.margin_chunk_num_for_gpu_adam = margin_chunk_num_for_gpu_adam
+        self.gpu_chunk_ids = gpu_chunk_ids
+        if margin_chunk_num_for_gpu_adam <= 0 or self.gpu_payload is not None:
+            return
+        # When `margin_chunk_num_for_gpu_adam` > 0, it means there will be optimizer
+        # state resides on GPU. So we need to allocate a GPU buffer for those.
+        gpu_device = torch.device(f"cuda:{self.local_rank}")
+
+        if self.with_mem_cache:
+            self.gpu_payload = self.memory_cache.pop_or_allocate(
+                gpu_device, self.chunk_size, self.dtype, False
+            )
+        else:
+            self.gpu_payload = torch.empty(
+                self.chunk_size, dtype=self.dtype, device=gpu_device
+            )
+        logger.debug(
+            f"Allocate fp32 Chunk Buffer of size {self.chunk_size / 1e6} MB on {gpu_device}."
+        )
 
     def access_from_cache(self, param) -> torch.Tensor:
         r"""Access the underlying data of the param.
@@ -233,7 +353,11 @@ class FP32ChunkReadBuffer(object):
             # its chunk.
             if info.start_offset == 0:
                 self.cached_chunk_num += 1
-                if self.cached_chunk_num < self.margin_chunk_num_for_gpu_adam:
+                if self.gpu_chunk_ids is not None:
+                    on_gpu = info.chunk_id in self.gpu_chunk_ids
+                else:
+                    on_gpu = self.cached_chunk_num < self.margin_chunk_num_for_gpu_adam
+                if on_gpu:
                     target_device = torch.device(f"cuda:{self.local_rank}")
                 else:
                     target_device = torch.device("cpu:0")
@@ -258,7 +382,7 @@ class FP32ChunkReadBuffer(object):
         self.cached_chunk_num = 0
         self.ret_payload = None
         self.cached_chunk_id = None
-        if self.with_mem_cache:
-            if self.gpu_payload is not None:
+        if self.gpu_payload is not None:
+            if self.with_mem_cache:
                 self.memory_cache.push(self.gpu_payload)
-                self.gpu_payload = None
+            self.gpu_payload = None
@@ -0,0 +1,976 @@
+# BSD 3-Clause License
+#
+# Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the psutil authors nor the names of its contributors
+#    may be used to endorse or promote products derived from this software without
+#    specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from copy import deepcopy
+import math
+import time
+from typing import List
+
+import torch
+
+from patrickstar.core.const import TensorState, AccessType, TrainingStage, ChunkType
+from patrickstar.core.parameter import register_param, ParamType
+import patrickstar.utils.global_timer as global_timer
+from patrickstar.utils import logger, get_rank
+from .adam_placement import HybridAdamPlacement
+from .chunk_io_buff import FP32ChunkReadBuffer, FP16ChunkWriteBuffer
+from patrickstar.utils.helper import get_real_data_tensor
+from patrickstar.profiler import profiler
+
+
+def empty_cpu_param():
+    return torch.nn.Parameter(
+        torch.tensor([], dtype=torch.float, device=torch.device("cpu:0")),
+        requires_grad=False,
+    )
+
+
+class FP16ChunkOptimizer(torch.optim.Optimizer):
+    r"""The base of the optimizers updating the chunk based params.
+
+    The local params of all groups are visited in the order of chunks. The
+    fp16 grad chunks are read with `FP32ChunkReadBuffer`, the fp32 params are
+    updated and written back to the fp16 chunks with `FP16ChunkWriteBuffer`.
+    Subclasses create the optimizer state params in `init_state_params` and
+    update a single param in `update`.
+    """
+
+    # The keys of the optimizer state params in `self.state[p]`.
+    state_param_keys = ()
+    # Whether to update the params of a chunk together with `update_batch`.
+    batched_update = False
+    # Whether `update` takes a `half_data` keyword, the view in the fp16
+    # staging buffer of the write-back to fill with the updated param.
+    fused_half_write_back = False
+
+    def __init__(
+        self,
+        client,
+        params,
+        defaults,
+        loss_scaler=None,
+        gradient_clipping=-1,
+        use_hybrid_adam=True,
+        max_grad_norm=-1,
+    ):
+        super().__init__(params, defaults)
+        self.client = client
+
+        self.loss_scaler = loss_scaler
+        # device -> 0-dim bool tensor, the overflow flag accumulated on device.
+        self.overflow_flags = {}
+        # chunk_id -> the number of elements occupied by tensors.
+        self._chunk_used_numel = {}
+
+        self.gradient_clipping = gradient_clipping
+
+        # Clip the grads by the global L2 norm if positive.
+        self.max_grad_norm = max_grad_norm
+        # device -> squared L2 norm of the local grad chunks on the device.
+        self.grad_norm_sq_parts = {}
+        # The global L2 norm of the unscaled grads of the last step.
+        self.global_grad_norm = None
+        # The grads are divided by `combined_scale` in the update, folding
+        # the loss scale and the norm clipping. None for no division.
+        self.combined_scale = None
+
+        self.use_hybrid_adam = use_hybrid_adam
+        # Decide the chunks updated on GPU in hybrid Adam by the estimated
+        # transfer and compute time, instead of the visiting order.
+        opt_config = client.opt_config
+        if opt_config["hybrid_adam_placement"] not in ["cost_model", "visit_order"]:
+            raise ValueError(
+                "Invalid hybrid_adam_placement: "
+                f"{opt_config['hybrid_adam_placement']}"
+            )
+        self.placement = None
+        if use_hybrid_adam and opt_config["hybrid_adam_placement"] == "cost_model":
+            self.placement = HybridAdamPlacement(
+                client,
+                opt_config["pcie_bandwidth"],
+                opt_config["cpu_adam_throughput"],
+                half_write_back=opt_config["with_half_write_back"],
+            )
+
+        # Eager state initialization, different from Pytorch.
+        # Visit the params in the order of chunks, so that the optimizer
+        # state chunks are laid out as the param fp16 chunks.
+        for p, group in self.chunk_ordered_params():
+            self._init_param_state(p, group)
+
+        # The staging buffers of the chunks in the optimizer step. They are
+        # created at the first step and reused by the later ones.
+        self.read_chunk_buff = None
+        self.write_chunk_buff = None
+
+    def add_param_group(self, param_group):
+        super().add_param_group(param_group)
+        # The hyperparams are read from the groups at every step, only the
+        # param order needs rebuilding.
+        self._chunk_ordered_params = None
+        if hasattr(self, "client"):
+            group = self.param_groups[-1]
+            for p in group["params"]:
+                self._init_param_state(p, group)
+
+    def _init_param_state(self, p, group):
+        r"""Initialize the step and the optimizer state params of `p`."""
+        state = self.state[p]
+        state["step"] = 0
+        # Only create the optimizer states of the local params.
+        # The frozen params have no optimizer states.
+        if not p.requires_grad:
+            return
+        if p.ps_attr.param_type == ParamType.CHUNK_BASED and not p.ps_attr.is_local():
+            return
+        self.init_state_params(p, group)
+
+    def init_state_params(self, p, group):
+        r"""Create the optimizer state params of `p` with `create_state_param`."""
+        raise NotImplementedError
+
+    def create_state_param(
+        self, p, key, chunk_type, shape=None, as_ref=True, dtype=torch.float
+    ):
+        r"""Create the optimizer state param `key` of `p`.
+
+        Args:
+            p: :class:`torch.nn.Parameter`. The param fp16.
+            key: str. The key in `self.state[p]`.
+            chunk_type: :class:`ChunkType`. The chunk type of the state.
+            shape: :class:`torch.Size`. Defaults to the shape of `p`.
+            as_ref: bool. Place the state in the chunk paired with the chunk
+                of `p`, so that the layout is the same as the param fp16
+                chunks. Otherwise the state is packed into the last chunk
+                of `chunk_type`, which suits the states smaller than `p`.
+            dtype: :class:`torch.dtype`. The dtype of the state.
+        """
+        state = self.state[p]
+        if shape is None:
+            shape = p.ps_attr.shape
+        if p.ps_attr.param_type == ParamType.TORCH_BASED:
+            state[key] = torch.nn.Parameter(
+                torch.zeros(shape, dtype=dtype, device=p.device),
+                requires_grad=False,
+            )
+            register_param(state[key], ParamType.TORCH_BASED, dtype)
+            return
+
+        state[key] = empty_cpu_param()
+        register_param(
+            state[key],
+            ParamType.CHUNK_BASED,
+            dtype,
+            f"{p.ps_attr.name}.{key}",
+        )
+        state[key].ps_attr.reset_shape(shape)
+        state[key].ps_attr._is_local = p.ps_attr.is_local()
+        if as_ref:
+            self.client.append_tensor_as_ref(
+                state[key], dtype, AccessType.DATA, chunk_type, p
+            )
+        else:
+            self.client.append_tensor([state[key]], dtype, AccessType.DATA, chunk_type)
+
+    def update(self, data, grad, states, step, group):
+        r"""Update a param inplace.
+
+        Args:
+            data: the fp32 param.
+            grad: the grad on the same device as `data`, scaled by the loss
+                scale. fp16 for the chunk based params.
+            states: dict of the optimizer state tensors.
+            step: int.
+            group: dict. The param group.
+        """
+        raise NotImplementedError
+
+    def chunk_ordered_params(self):
+        r"""The (param, group) pairs of all groups in the order of chunks.
+
+        The chunk based params are ordered by the chunk and the offset in
+        the chunk, so that the chunks are copied once in the walk of
+        `fp16_chunk_adam_ops` however the params are grouped. The torch
+        based params follow in their group order.
+        """
+        if self._chunk_ordered_params is None:
+            chunk_based = []
+            torch_based = []
+            for group in self.param_groups:
+                for p in group["params"]:
+                    if p.ps_attr.param_type == ParamType.TORCH_BASED:
+                        torch_based.append((p, group))
+                        continue
+                    info = self.client.chunk_tensor_index.get_tensor_info(
+                        p.ps_attr.data_id()
+                    )
+                    chunk_based.append(((info.chunk_id, info.start_offset), p, group))
+            chunk_based.sort(key=lambda item: item[0])
+            self._chunk_ordered_params = [
+                (p, group) for _, p, group in chunk_based
+            ] + torch_based
+        return self._chunk_ordered_params
+
+    def _accumulate_overflow(self, tensor):
+        r"""OR whether `tensor` has inf or nan into the flag of its device.
+
+        No device to host sync happens here.
+        """
+        flag = self.loss_scaler.inf_or_nan_flag(tensor)
+        if flag is None:
+            return
+        if flag.device in self.overflow_flags:
+            self.overflow_flags[flag.device].logical_or_(flag)
+        else:
+            self.overflow_flags[flag.device] = flag
+
+    def check_overflow(self, param):
+        r"""Check the grad of a torch based param for overflow.
+
+        The grads of the chunk based params are checked per chunk in
+        `check_chunk_grads`. With norm clipping, the overflow is given by
+        the global grad norm.
+        """
+        if self.loss_scaler is not None and self.max_grad_norm <= 0:
+            self._accumulate_overflow(param.grad)
+
+    def _accumulate_grad_norm_sq(self, tensor):
+        # One fused reduction accumulating in fp32 without copying `tensor`.
+        norm_sq = torch.norm(tensor, 2, dtype=torch.float).square()
+        if norm_sq.device in self.grad_norm_sq_parts:
+            self.grad_norm_sq_parts[norm_sq.device].add_(norm_sq)
+        else:
+            self.grad_norm_sq_parts[norm_sq.device] = norm_sq
+
+    def _used_numel(self, chunk_id):
+        # The tail of the payload may be left over from the memory cache.
+        if chunk_id not in self._chunk_used_numel:
+            used_numel = 0
+            for info in self.client.chunk_tensor_index.generate_tensor_info_in_order(
+                chunk_id
+            ):
+                used_numel = max(used_numel, info.start_offset + info.numel)
+            self._chunk_used_numel[chunk_id] = used_numel
+        return self._chunk_used_numel[chunk_id]
+
+    def check_chunk_grads(self):
+        r"""Reduce the grads in the local param fp16 chunks.
+
+        There is one fused reduction per chunk, running on the device holding
+        the chunk. With `max_grad_norm`, it is the squared L2 norm of the
+        chunk, accumulated in `self.grad_norm_sq_parts`, whose isfinite also
+        tells the overflow. Otherwise it is the overflow check, accumulated
+        in `self.overflow_flags`.
+        """
+        compute_norm = self.max_grad_norm > 0
+        if not compute_norm and self.loss_scaler is None:
+            return
+        chunk_list = self.client.chunk_list
+        chunk_tensor_index = self.client.chunk_tensor_index
+        for chunk_id in self.client.chunk_ids_generator(ChunkType.PARAM_FP16):
+            chunk = chunk_list[chunk_id]
+            if chunk.payload is None:
+                continue
+            if not chunk_tensor_index.is_local_chunk(chunk_id):
+                continue
+            used_numel = self._used_numel(chunk_id)
+            if used_numel == 0:
+                continue
+            if compute_norm:
+                self._accumulate_grad_norm_sq(chunk.payload[:used_numel])
+            else:
+                self._accumulate_overflow(chunk.payload[:used_numel])
+
+    def compute_global_grad_norm(self):
+        r"""Return the global L2 norm of the unscaled grads.
+
+        The partial norms of the chunks are summed with a single allreduce
+        and read to the host once.
+        """
+        device = self.client.device
+        norm_sq = torch.zeros(1, dtype=torch.float, device=device)
+        for part in self.grad_norm_sq_parts.values():
+            norm_sq.add_(part.to(device))
+        self.grad_norm_sq_parts = {}
+        if torch.distributed.is_initialized():
+            # The local chunks are the same in the replicas of hybrid
+            # sharding, only sum over the shard group.
+            torch.distributed.all_reduce(
+                norm_sq,
+                op=torch.distributed.ReduceOp.SUM,
+                group=self.client.shard_comm_group,
+            )
+        # The grads of the torch based params are the same on all processes.
+        for p, _ in self.chunk_ordered_params():
+            if p.ps_attr.param_type != ParamType.TORCH_BASED or p.grad is None:
+                continue
+            grad = p.grad.coalesce()._values() if p.grad.is_sparse else p.grad
+            norm_sq.add_(torch.norm(grad, 2, dtype=torch.float).square().to(device))
+        norm = norm_sq.sqrt().item()
+        if self.loss_scaler is not None:
+            norm /= self.loss_scaler.loss_scale
+        return norm
+
+    def compute_combined_scale(self):
+        r"""The divisor of the grads, unscaling the loss scale and clipping
+        the global grad norm. None if the grads need no division.
+        """
+        combined_scale = (
+            self.loss_scaler.loss_scale if self.loss_scaler is not None else 1.0
+        )
+        clipped = False
+        if self.max_grad_norm > 0:
+            assert math.isfinite(
+                self.global_grad_norm
+            ), "The step should be skipped for a non-finite grad norm."
+            # The same as `torch.nn.utils.clip_grad_norm_`.
+            clip_coef = self.max_grad_norm / (self.global_grad_norm + 1e-6)
+            if clip_coef < 1:
+                combined_scale /= clip_coef
+                clipped = True
+        if self.loss_scaler is None and not clipped:
+            return None
+        return combined_scale
+
+    def has_overflow_and_reset_param(self, write_chunk_buff):
+        r"""Method for collective communicating overflow and reset params.
+        This method should be called after `check_chunk_grads`, and after
+        `compute_global_grad_norm` with norm clipping. The overflow flags
+        of all devices are read to the host only once.
+
+        With norm clipping, a non-finite norm is an overflow even without
+        loss scaler, e.g. in bf16 training. Otherwise the grads are only
+        checked with loss scaler.
+        """
+        if self.loss_scaler is None and self.max_grad_norm <= 0:
+            return False
+        if self.max_grad_norm > 0:
+            # The norm is not finite if and only if some grad overflows.
+            has_overflow = not math.isfinite(self.global_grad_norm)
+        else:
+            overflow_gpu = torch.zeros(1, dtype=torch.uint8, device=self.client.device)
+            for flag in self.overflow_flags.values():
+                overflow_gpu.logical_or_(flag.to(self.client.device))
+            if torch.distributed.is_initialized():
+                torch.distributed.all_reduce(
+                    overflow_gpu, op=torch.distributed.ReduceOp.MAX
+                )
+            has_overflow = overflow_gpu[0].item()
+        self.overflow_flags = {}
+        if has_overflow:
+            # TODO(zilinzhu): Find a better way to overwrite the grads
+            # Visit in the order of chunks, the write buffer copies whole
+            # chunks and may stage the params of only one chunk.
+            for p, _ in self.chunk_ordered_params():
+                if p.ps_attr.param_type == ParamType.TORCH_BASED:
+                    continue
+                if not p.ps_attr.is_local() or p.ps_attr.is_frozen():
+                    continue
+                fp32_param = self.client.param_fp16_to_param_fp32_map[p]
+                write_chunk_buff.write_from_cache(p, fp32_param)
+            write_chunk_buff.reset()
+            return True
+        return False
+
+    def update_batch(self, datas, grads, states_list, step, group):
+        r"""Update a batch of params of the same chunk inplace.
+
+        The params share `step` and `group`. Override to apply the update
+        over the lists at once. The default updates them one by one.
+        """
+        for data, grad, states in zip(datas, grads, states_list):
+            self.update(data, grad, states, step, group)
+
+    def _in_same_batch(self, p0, p1, group0, group1, step0, step1):
+        if not self.batched_update:
+            return False
+        if (
+            p0.ps_attr.param_type == ParamType.TORCH_BASED
+            or p1.ps_attr.param_type == ParamType.TORCH_BASED
+        ):
+            return False
+        chunk_tensor_index = self.client.chunk_tensor_index
+        return (
+            group0 is group1
+            and step0 == step1
+            and chunk_tensor_index.get_chunk_id(p0, AccessType.DATA)
+            == chunk_tensor_index.get_chunk_id(p1, AccessType.DATA)
+        )
+
+    def _update_batch_in_chunk(
+        self,
+        client,
+        batch,
+        fp32_param_list,
+        fp16_param_with_grad_list,
+        state_list,
+        state_steps,
+        hyperparam_list,
+        read_chunk_buff,
+        write_chunk_buff,
+        gradient_clipping,
+        cpu_gradient_clipping,
+        time_profile,
+    ):
+        r"""Update the params of indices `batch`, which are in the same chunk."""
+        fp32_params = []
+        fp32_data_tensors = []
+        grads = []
+        states_list = []
+        state_params_list = []
+        for i in batch:
+            # 1. prepare data for Adam
+            fp32_param = fp32_param_list[i]
+            fp16_param = fp16_param_with_grad_list[i]
+
+            if time_profile:
+                global_timer.my_timer.start_profile("ADAM_prepare_data")
+                global_timer.my_timer.start_profile("ADAM_prepare_data_grad_copy")
+
+            # Copy the fp16 grads in the granularity of chunks.
+            if fp16_param.ps_attr.param_type == ParamType.TORCH_BASED:
+                # If fp16_param is managed by native torch, it should be on CPU,
+                # because only cpu_embedding optimization are managed by native torch
+                # now and it is fp32.
+                assert fp32_param is None
+                fp32_param = fp16_param
+                # Here the grad is already of dtype fp32.
+                fp16_grad_tensor = fp16_param.grad
+                assert fp16_grad_tensor.dtype == torch.float
+                if fp16_grad_tensor.is_sparse:
+                    # Row-sparse grad from CPU embedding.
+                    fp16_grad_tensor = fp16_grad_tensor.coalesce()
+            else:
+                # Copy the fp16 grad chunk to the compute_device of fp32 param chunk.
+                # As we are visiting  params by its storing order in the chunk,
+                # we will only copy the chunk when visiting its first tensor and store it
+                # in the buffer. For the rest of the tensors, we will directly indexing from
+                # the buffer.
+                fp16_grad_tensor = read_chunk_buff.access_from_cache(fp16_param).view(
+                    fp16_param.ps_attr.shape
+                )
+
+            # Gradient value clipping. The norm clipping is folded into
+            # `self.combined_scale`.
+            if gradient_clipping is not None:
+                if fp16_grad_tensor.device.type == "cpu":
+                    clip = cpu_gradient_clipping
+                else:
+                    clip = gradient_clipping
+                if fp16_grad_tensor.is_sparse:
+                    fp16_grad_tensor._values().clamp_(-clip, clip)
+                else:
+                    fp16_grad_tensor.clamp_(-clip, clip)
+
+            compute_device = fp16_grad_tensor.device
+
+            if time_profile:
+                global_timer.my_timer.finish_profile("ADAM_prepare_data_grad_copy")
+                if fp16_grad_tensor.is_sparse:
+                    grad_numel = fp16_grad_tensor._values().numel()
+                else:
+                    grad_numel = fp16_grad_tensor.numel()
+                global_timer.data_move_cnter.update(
+                    "ADAM_prepare_data_grad_copy", grad_numel * 2
+                )
+
+            client.access_data(fp32_param, compute_device)
+            fp32_data_tensor = get_real_data_tensor(fp32_param)
+
+            state_params = [
+                (key, state_list[i][key])
+                for key in self.state_param_keys
+                if key in state_list[i]
+            ]
+            states = {}
+            for key, state_param in state_params:
+                client.access_data(state_param, compute_device)
+                states[key] = get_real_data_tensor(state_param)
+
+            if time_profile:
+                global_timer.my_timer.finish_profile("ADAM_prepare_data")
+
+            fp32_params.append(fp32_param)
+            fp32_data_tensors.append(fp32_data_tensor)
+            grads.append(fp16_grad_tensor)
+            states_list.append(states)
+            state_params_list.append(state_params)
+
+        # 2. Start Adam
+        if time_profile:
+            global_timer.my_timer.start_profile("ADAM_compute")
+
+        # Calibrate the cost model with the chunk based CPU updates.
+        measure_cpu_update = (
+            self.placement is not None
+            and grads[0].device.type == "cpu"
+            and fp32_params[0].ps_attr.param_type == ParamType.CHUNK_BASED
+        )
+        if measure_cpu_update:
+            update_start_time = time.time()
+
+        staged = False
+        if len(batch) == 1:
+            update_kwargs = {}
+            if (
+                self.fused_half_write_back
+                and fp32_params[0].ps_attr.param_type == ParamType.CHUNK_BASED
+                and grads[0].device.type == "cpu"
+            ):
+                half_data = write_chunk_buff.staging_buff(
+                    fp16_param_with_grad_list[batch[0]], fp32_params[0]
+                )
+                if half_data is not None:
+                    update_kwargs["half_data"] = half_data
+                    staged = True
+            self.update(
+                fp32_data_tensors[0],
+                grads[0],
+                states_list[0],
+                state_steps[batch[0]],
+                hyperparam_list[batch[0]],
+                **update_kwargs,
+            )
+        else:
+            self.update_batch(
+                fp32_data_tensors,
+                grads,
+                states_list,
+                state_steps[batch[0]],
+                hyperparam_list[batch[0]],
+            )
+
+        if measure_cpu_update:
+            self.placement.record_cpu_update(
+                sum(data.numel() for data in fp32_data_tensors),
+                time.time() - update_start_time,
+            )
+
+        if time_profile:
+            global_timer.my_timer.finish_profile("ADAM_compute")
+
+        # 3. Finish Adam.
+        for i, fp32_param, fp32_data_tensor, state_params in zip(
+            batch, fp32_params, fp32_data_tensors, state_params_list
+        ):
+            if time_profile:
+                global_timer.my_timer.start_profile("ADAM_param_fp32_to_fp16")
+
+            # Copy fp32_param back to fp16_param.
+            if fp32_param.ps_attr.param_type == ParamType.CHUNK_BASED:
+                write_chunk_buff.write_from_cache(
+                    fp16_param_with_grad_list[i], fp32_param, staged=staged
+                )
+
+            if time_profile:
+                global_timer.my_timer.finish_profile("ADAM_param_fp32_to_fp16")
+                global_timer.data_move_cnter.update(
+                    "ADAM_param_fp32_to_fp16", fp32_data_tensor.numel() * 4
+                )
+                global_timer.my_timer.start_profile("ADAM_release_data")
+
+            client.release_data(fp32_param)
+            for _, state_param in state_params:
+                client.release_data(state_param)
+
+            if time_profile:
+                global_timer.my_timer.finish_profile("ADAM_release_data")
+
+    def fp16_chunk_adam_ops(
+        self,
+        client,
+        fp32_param_list: List[torch.nn.Parameter],
+        fp16_param_with_grad_list,
+        state_list: List[dict],
+        state_steps: List[int],
+        hyperparam_list: List[dict],
+        read_chunk_buff,
+        write_chunk_buff,
+        time_profile=True,
+        margin_chunk_num_for_gpu_adam=0,
+    ):
+        r"""Functional API that performs the optimizer computation.
+        Visit fp16_param_with_grad_list in the order of tensors stored in chunks.
+        Copy the chunk into a tmp buffer to speed up the memcpy between devices.
+        """
+        local_rank = client.local_rank
+        logger.debug(
+            f"local_rank {local_rank} margin_chunk_num_for_gpu_adam {margin_chunk_num_for_gpu_adam}, "
+            f"param cnt {len(fp32_param_list)}"
+        )
+        if self.gradient_clipping > 0:
+            # The gradient clipping may be larger than the max fp16 value
+            # after being amplified by loss scale.
+            gradient_clipping = self.gradient_clipping
+            if self.loss_scaler is not None:
+                gradient_clipping *= self.loss_scaler.loss_scale
+            gradient_clipping = min(
+                torch.finfo(client.half_dtype).max, gradient_clipping
+            )
+            # clamp_scalar_cpu does not support fp16. Turn the gradient_clipping
+            # to tensor to use clamp_cpu instead.
+            cpu_gradient_clipping = torch.Tensor([gradient_clipping])
+        else:
+            gradient_clipping = None
+            cpu_gradient_clipping = None
+
+        # Group the params to update together, see `update_batch`.
+        batches = []
+        for i, fp16_param in enumerate(fp16_param_with_grad_list):
+            if batches and self._in_same_batch(
+                fp16_param_with_grad_list[batches[-1][0]],
+                fp16_param,
+                hyperparam_list[batches[-1][0]],
+                hyperparam_list[i],
+                state_steps[batches[-1][0]],
+                state_steps[i],
+            ):
+                batches[-1].append(i)
+            else:
+                batches.append([i])
+
+        for batch in batches:
+            self._update_batch_in_chunk(
+                client,
+                batch,
+                fp32_param_list,
+                fp16_param_with_grad_list,
+                state_list,
+                state_steps,
+                hyperparam_list,
+                read_chunk_buff,
+                write_chunk_buff,
+                gradient_clipping,
+                cpu_gradient_clipping,
+                time_profile,
+            )
+
+        write_chunk_buff.reset()
+        read_chunk_buff.reset()
+
+    def hybrid_adam_chunk_groups(self):
+        r"""The (fp16 chunk id, fp32 chunk id, list of the optimizer state
+        chunk ids) of the local chunks with grads, in the order of chunks."""
+        chunk_tensor_index = self.client.chunk_tensor_index
+        chunk_groups = {}
+        for p, _ in self.chunk_ordered_params():
+            if (
+                p.ps_attr.param_type == ParamType.TORCH_BASED
+                or not p.requires_grad
+                or not p.ps_attr.is_local()
+            ):
+                continue
+            fp16_chunk_id = chunk_tensor_index.get_chunk_id(p, AccessType.DATA)
+            if fp16_chunk_id not in chunk_groups:
+                fp32_param = self.client.param_fp16_to_param_fp32_map[p]
+                chunk_groups[fp16_chunk_id] = (
+                    chunk_tensor_index.get_chunk_id(fp32_param, AccessType.DATA),
+                    [],
+                )
+            state_chunk_ids = chunk_groups[fp16_chunk_id][1]
+            for key in self.state_param_keys:
+                if key not in self.state[p]:
+                    continue
+                chunk_id = chunk_tensor_index.get_chunk_id(
+                    self.state[p][key], AccessType.DATA
+                )
+                if chunk_id not in state_chunk_ids:
+                    state_chunk_ids.append(chunk_id)
+        return [
+            (fp16_chunk_id, fp32_chunk_id, state_chunk_ids)
+            for fp16_chunk_id, (fp32_chunk_id, state_chunk_ids) in chunk_groups.items()
+        ]
+
+    def plan_gpu_chunks(self, margin_chunk_num_for_gpu_adam):
+        r"""The set of the fp16 chunk ids updated on GPU, decided by the
+        cost model. None for the visiting order placement."""
+        if self.placement is None or margin_chunk_num_for_gpu_adam <= 0:
+            return None
+        # The same number of chunks as the visiting order placement, which
+        # puts the chunks with 1-based index below the margin on GPU.
+        gpu_chunk_num = max(0, math.ceil(margin_chunk_num_for_gpu_adam) - 1)
+        return self.placement.plan(self.hybrid_adam_chunk_groups(), gpu_chunk_num)
+
+    def prepare_chunk_buffs(self, margin_chunk_num_for_gpu_adam, gpu_chunk_ids=None):
+        r"""Create the staging buffers at the first step, or prepare them
+        for the current step. The chunk sizes are fixed after init, so the
+        buffers are sized once.
+        """
+        if self.read_chunk_buff is not None:
+            self.read_chunk_buff.prepare(margin_chunk_num_for_gpu_adam, gpu_chunk_ids)
+            self.write_chunk_buff.prepare()
+            return
+        max_chunk_size = self.client.chunk_list.max_chunk_size()
+        self.read_chunk_buff = FP32ChunkReadBuffer(
+            self.client.chunk_list,
+            self.client.chunk_tensor_index,
+            max_chunk_size,
+            margin_chunk_num_for_gpu_adam,
+            self.client.chunk_list.memory_cache
+            if self.client.opt_config["with_mem_cache"]
+            else None,
+            dtype=self.client.half_dtype,
+            gpu_chunk_ids=gpu_chunk_ids,
+        )
+        self.write_chunk_buff = FP16ChunkWriteBuffer(
+            self.client.chunk_list,
+            self.client.chunk_tensor_index,
+            max_chunk_size,
+            self.client.chunk_list.memory_cache
+            if self.client.opt_config["with_mem_cache"]
+            else None,
+            half_staging=self.client.opt_config["with_half_write_back"],
+            dtype=self.client.half_dtype,
+        )
+
+    def release_computing_params(self):
+        r"""Release the chunk based params still in COMPUTE after backward.
+
+        Their grads are written to the param fp16 chunk and reduced.
+        The frozen params are released without writing back.
+        """
+        rank = get_rank()
+        for name, param in self.client.module.named_parameters():
+            if param.ps_attr.param_type == ParamType.TORCH_BASED:
+                continue
+            if param.ps_attr.get_state(AccessType.DATA) == TensorState.COMPUTE:
+                logger.debug(
+                    f"adam forces rank {rank} to"
+                    f"release param {self.client.module.__class__.__name__}.{name} from COMPUTE to HOLD_AFTER_BWD"
+                )
+                # The frozen params are read only, they have no grad.
+                is_frozen = param.ps_attr.is_frozen()
+                if not is_frozen:
+                    tmp_tensor = param.ps_attr.access_tensor(AccessType.DATA)
+                    tmp_tensor.copy_(param.grad)
+                    param.grad = None
+                if torch.distributed.is_initialized():
+                    self.client.release_dist(
+                        param,
+                        AccessType.DATA,
+                        TensorState.HOLD_AFTER_BWD,
+                        training_stage=TrainingStage.BWD,
+                        do_allreduce=not is_frozen,
+                        with_mem_saving_comm=self.client.opt_config[
+                            "with_mem_saving_comm"
+                        ],
+                    )
+                else:
+                    self.client.release_data(param, TensorState.HOLD_AFTER_BWD)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        """Performs a single optimization step.
+
+        Args:
+            closure (callable, optional): A closure that reevaluates the model
+                and returns the loss.
+        """
+        global_timer.my_timer.start_profile("ADAM")
+
+        mem_tracer = self.client.mem_tracer
+        self.release_computing_params()
+        if self.client.accumulate_grads:
+            # Non-last micro-batch of gradient accumulation.
+            global_timer.my_timer.finish_profile("ADAM")
+            return None
+
+        if profiler.started():
+            profiler.stage_convert_time.append((time.time(), TrainingStage.ADAM))
+
+        self.client.reset_visited_chunk()
+        self.client.set_training_phase(TrainingStage.ADAM)
+
+        self.client.trigger_memory_tracing()
+        self.client.adjust_chunk_layout()
+
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        if self.use_hybrid_adam:
+            margin_chunk_num_for_gpu_adam = (
+                mem_tracer.get_margin_chunk_num_for_gpu_adam()
+            )
+        else:
+            margin_chunk_num_for_gpu_adam = 0
+
+        self.prepare_chunk_buffs(
+            margin_chunk_num_for_gpu_adam,
+            self.plan_gpu_chunks(margin_chunk_num_for_gpu_adam),
+        )
+
+        self.check_chunk_grads()
+        if self.max_grad_norm > 0:
+            self.global_grad_norm = self.compute_global_grad_norm()
+        if self.has_overflow_and_reset_param(write_chunk_buff=self.write_chunk_buff):
+            self.read_chunk_buff.reset()
+            global_timer.my_timer.finish_profile("ADAM")
+            if self.loss_scaler is None:
+                logger.warning(
+                    f"Gradient norm is {self.global_grad_norm}, skip the step."
+                )
+                return loss
+            old_loss_scale = self.loss_scaler.loss_scale
+            self.loss_scaler.update_scale(True)
+            new_loss_scale = self.loss_scaler.loss_scale
+            logger.warning(
+                f"Gradient overflow! Update loss scale from {old_loss_scale} to {new_loss_scale}."
+            )
+
+            return loss
+        self.combined_scale = self.compute_combined_scale()
+
+        fp16_param_with_grad_list = []
+        fp32_param_list = []
+        state_list = []
+
+        hyperparam_list = []
+        state_steps = []
+
+        max_param_size = 0
+        for p, group in self.chunk_ordered_params():
+            if p.requires_grad:
+                # update the steps for each param group update
+                state = self.state[p]
+                state["step"] += 1
+
+                # When p is not torch param and belongs to a remote chunk, skip.
+                if (
+                    p.ps_attr.param_type == ParamType.CHUNK_BASED
+                    and not p.ps_attr.is_local()
+                ):
+                    continue
+
+                if p.ps_attr.param_type == ParamType.TORCH_BASED:
+                    max_param_size = max(p.numel(), max_param_size)
+
+                fp16_param_with_grad_list.append(p)
+
+                state_list.append(state)
+                if p in self.client.param_fp16_to_param_fp32_map:
+                    fp32_param_list.append(self.client.param_fp16_to_param_fp32_map[p])
+                else:
+                    fp32_param_list.append(None)
+                # The hyperparams are read from the group, so the updates of
+                # lr schedulers take effect without copying.
+                hyperparam_list.append(group)
+
+                # record the step after step update
+                state_steps.append(state["step"])
+
+        # Hybrid Adam. Put some chunks on GPU based on the warmup info.
+        self.fp16_chunk_adam_ops(
+            self.client,
+            fp32_param_list,
+            fp16_param_with_grad_list,
+            state_list,
+            state_steps,
+            hyperparam_list,
+            self.read_chunk_buff,
+            self.write_chunk_buff,
+            True,
+            margin_chunk_num_for_gpu_adam,
+        )
+        if self.placement is not None:
+            self.placement.finish_step()
+
+        if self.loss_scaler:
+            self.loss_scaler.update_scale(False)
+
+        global_timer.my_timer.finish_profile("ADAM")
+        return loss
+
+    def state_dict(self):
+        r"""Returns the state of the optimizer as a :class:`dict`.
+
+        It contains two entries:
+
+        * state - a dict holding current optimization state. Its content
+            differs between optimizer classes.
+        * param_groups - a dict containing all parameter self.param_groups
+        """
+        raw_state_dict = super().state_dict()
+        old_packed_state = raw_state_dict["state"]
+        param_groups = raw_state_dict["param_groups"]
+        packed_state = {}
+        for idx in old_packed_state:
+            packed_state[idx] = {}
+            for k, v in old_packed_state[idx].items():
+                if isinstance(v, torch.nn.Parameter):
+                    packed_state[idx][k] = (
+                        self.client.access_data(v, torch.device("cpu:0"))
+                        .clone()
+                        .detach()
+                    )
+                else:
+                    packed_state[idx][k] = v
+        return {
+            "state": packed_state,
+            "param_groups": param_groups,
+        }
+
+    def load_state_dict(self, state_dict):
+        r"""Loads the optimizer state.
+
+        Args:
+            state_dict (dict): optimizer state. Should be an object returned
+                from a call to :meth:`state_dict`.
+        """
+        # deepcopy, to be consistent with module API
+        state_dict = deepcopy(state_dict)
+
+        saved_groups = state_dict["param_groups"]
+        saved_state = state_dict["state"]
+
+        assert len(saved_groups) == len(self.param_groups)
+        for saved_group, group in zip(saved_groups, self.param_groups):
+            assert len(saved_group["params"]) == len(group["params"])
+        assert len(saved_state) == len(self.state)
+
+        # Update the state
+        id_map = {}
+        for saved_group, group in zip(saved_groups, self.param_groups):
+            id_map.update(zip(saved_group["params"], group["params"]))
+            # Restore the hyperparams of the group, e.g. the scheduled lr.
+            for k, v in saved_group.items():
+                if k != "params":
+                    group[k] = v
+
+        for idx, p in id_map.items():
+            saved_single_state = saved_state[idx]
+            single_state = self.state[p]
+            for k, v in single_state.items():
+                assert k in saved_single_state
+                if isinstance(v, torch.nn.Parameter):
+                    tensor = self.client.access_data(v, torch.device("cpu:0"))
+                    tensor.copy_(saved_single_state[k])
+                else:
+                    single_state[k] = saved_single_state[k]
@@ -37,7 +37,9 @@ void Adam_Optimizer::Step(float* _params,
                           size_t _param_size,
                           bool param_half_precision,
                           bool grad_half_precision,
-                          float loss_scale)
+                          float loss_scale,
+                          bool grad_bf16,
+                          __half* half_params)
 {
     float betta1_minus1 = 1 - _betta1;
     float betta2_minus1 = 1 - _betta2;
@@ -91,7 +93,7 @@ void Adam_Optimizer::Step(float* _params,
         for (size_t i = t; i < offset; i += SIMD_WIDTH) {
             AVX_Data grad_4;
             if (grad_half_precision) {
-                grad_4.data = SIMD_LOAD_HALF(grads_cast_h + i);
+                grad_4.data = SIMD_LOAD_GRAD16(grads_cast_h + i, grad_bf16);
             } else {
                 grad_4.data = SIMD_LOAD(grads + i);
             }
@@ -135,6 +137,7 @@ void Adam_Optimizer::Step(float* _params,
             } else {
                 SIMD_STORE(_params + i, param_4.data);
             }
+            if (half_params) { SIMD_STOREU_HALF(half_params + i, param_4.data); }
 
             SIMD_STORE(_exp_avg + i, momentum_4.data);
             SIMD_STORE(_exp_avg_sq + i, variance_4.data);
@@ -152,7 +155,10 @@ void Adam_Optimizer::Step(float* _params,
 
 #pragma omp parallel for
             for (size_t k = t; k < offset; k++) {
-                float grad = grad_half_precision ? (float)grads_cast_h[k] : grads[k];
+                float grad = grad_half_precision
+                                 ? (grad_bf16 ? bf16_to_float(grads_cast_h + k)
+                                              : (float)grads_cast_h[k])
+                                 : grads[k];
                 if (loss_scale > 0) {
                   grad /= loss_scale;
                 }
@@ -177,6 +183,7 @@ void Adam_Optimizer::Step(float* _params,
                     params_cast_h[k] = (__half)param;
                 else
                     _params[k] = param;
+                if (half_params) half_params[k] = (__half)param;
                 _exp_avg[k] = momentum;
                 _exp_avg_sq[k] = variance;
             }
@@ -191,7 +198,9 @@ void Adam_Optimizer::Step_4(float* _params,
                             size_t _param_size,
                             bool param_half_precision,
                             bool grad_half_precision,
-                            float loss_scale)
+                            float loss_scale,
+                            bool grad_bf16,
+                            __half* half_params)
 {
     size_t rounded_size = 0;
 
@@ -243,10 +252,10 @@ void Adam_Optimizer::Step_4(float* _params,
         for (size_t i = t; i < offset; i += (SIMD_WIDTH << 2)) {
             AVX_Data grad_4[4];
             if (grad_half_precision) {
-                grad_4[0].data = SIMD_LOAD_HALF(grads_cast_h + i);
-                grad_4[1].data = SIMD_LOAD_HALF(grads_cast_h + i + SIMD_WIDTH);
-                grad_4[2].data = SIMD_LOAD_HALF(grads_cast_h + i + (SIMD_WIDTH << 1));
-                grad_4[3].data = SIMD_LOAD_HALF(grads_cast_h + i + SIMD_WIDTH * 3);
+                grad_4[0].data = SIMD_LOAD_GRAD16(grads_cast_h + i, grad_bf16);
+                grad_4[1].data = SIMD_LOAD_GRAD16(grads_cast_h + i + SIMD_WIDTH, grad_bf16);
+                grad_4[2].data = SIMD_LOAD_GRAD16(grads_cast_h + i + (SIMD_WIDTH << 1), grad_bf16);
+                grad_4[3].data = SIMD_LOAD_GRAD16(grads_cast_h + i + SIMD_WIDTH * 3, grad_bf16);
             } else {
                 grad_4[0].data = SIMD_LOAD(grads + i);
                 grad_4[1].data = SIMD_LOAD(grads + i + SIMD_WIDTH);
@@ -352,6 +361,12 @@ void Adam_Optimizer::Step_4(float* _params,
                 SIMD_STORE(_params + i + (SIMD_WIDTH << 1), param_4[2].data);
                 SIMD_STORE(_params + i + SIMD_WIDTH * 3, param_4[3].data);
             }
+            if (half_params) {
+                SIMD_STOREU_HALF(half_params + i, param_4[0].data);
+                SIMD_STOREU_HALF(half_params + i + SIMD_WIDTH, param_4[1].data);
+                SIMD_STOREU_HALF(half_params + i + (SIMD_WIDTH << 1), param_4[2].data);
+                SIMD_STOREU_HALF(half_params + i + SIMD_WIDTH * 3, param_4[3].data);
+            }
 
             SIMD_STORE(_exp_avg + i, momentum_4[0].data);
             SIMD_STORE(_exp_avg + i + SIMD_WIDTH, momentum_4[1].data);
@@ -373,7 +388,9 @@ void Adam_Optimizer::Step_4(float* _params,
              (_param_size - rounded_size),
              param_half_precision,
              grad_half_precision,
-             loss_scale);
+             loss_scale,
+             grad_bf16,
+             (half_params ? half_params + rounded_size : nullptr));
 }
 
 int create_adam_optimizer(int optimizer_id,
@@ -423,7 +440,9 @@ void Adam_Optimizer::Step_8(float* _params,
                             size_t _param_size,
                             bool param_half_precision,
                             bool grad_half_precision,
-                            float loss_scale)
+                            float loss_scale,
+                            bool grad_bf16,
+                            __half* half_params)
 {
     size_t rounded_size = 0;
 
@@ -475,14 +494,14 @@ void Adam_Optimizer::Step_8(float* _params,
         for (size_t i = t; i < offset; i += (SIMD_WIDTH << 3)) {
             AVX_Data grad_4[8];
             if (grad_half_precision) {
-                grad_4[0].data = SIMD_LOAD_HALF(grads_cast_h + i);
-                grad_4[1].data = SIMD_LOAD_HALF(grads_cast_h + i + SIMD_WIDTH);
-                grad_4[2].data = SIMD_LOAD_HALF(grads_cast_h + i + (SIMD_WIDTH << 1));
-                grad_4[3].data = SIMD_LOAD_HALF(grads_cast_h + i + SIMD_WIDTH * 3);
-                grad_4[4].data = SIMD_LOAD_HALF(grads_cast_h + i + (SIMD_WIDTH << 2));
-                grad_4[5].data = SIMD_LOAD_HALF(grads_cast_h + i + SIMD_WIDTH * 5);
-                grad_4[6].data = SIMD_LOAD_HALF(grads_cast_h + i + SIMD_WIDTH * 6);
-                grad_4[7].data = SIMD_LOAD_HALF(grads_cast_h + i + SIMD_WIDTH * 7);
+                grad_4[0].data = SIMD_LOAD_GRAD16(grads_cast_h + i, grad_bf16);
+                grad_4[1].data = SIMD_LOAD_GRAD16(grads_cast_h + i + SIMD_WIDTH, grad_bf16);
+                grad_4[2].data = SIMD_LOAD_GRAD16(grads_cast_h + i + (SIMD_WIDTH << 1), grad_bf16);
+                grad_4[3].data = SIMD_LOAD_GRAD16(grads_cast_h + i + SIMD_WIDTH * 3, grad_bf16);
+                grad_4[4].data = SIMD_LOAD_GRAD16(grads_cast_h + i + (SIMD_WIDTH << 2), grad_bf16);
+                grad_4[5].data = SIMD_LOAD_GRAD16(grads_cast_h + i + SIMD_WIDTH * 5, grad_bf16);
+                grad_4[6].data = SIMD_LOAD_GRAD16(grads_cast_h + i + SIMD_WIDTH * 6, grad_bf16);
+                grad_4[7].data = SIMD_LOAD_GRAD16(grads_cast_h + i + SIMD_WIDTH * 7, grad_bf16);
             } else {
                 grad_4[0].data = SIMD_LOAD(grads + i);
                 grad_4[1].data = SIMD_LOAD(grads + i + SIMD_WIDTH);
@@ -665,6 +684,16 @@ void Adam_Optimizer::Step_8(float* _params,
                 SIMD_STORE(_params + i + SIMD_WIDTH * 6, param_4[6].data);
                 SIMD_STORE(_params + i + SIMD_WIDTH * 7, param_4[7].data);
             }
+            if (half_params) {
+                SIMD_STOREU_HALF(half_params + i, param_4[0].data);
+                SIMD_STOREU_HALF(half_params + i + SIMD_WIDTH, param_4[1].data);
+                SIMD_STOREU_HALF(half_params + i + (SIMD_WIDTH << 1), param_4[2].data);
+                SIMD_STOREU_HALF(half_params + i + SIMD_WIDTH * 3, param_4[3].data);
+                SIMD_STOREU_HALF(half_params + i + (SIMD_WIDTH << 2), param_4[4].data);
+                SIMD_STOREU_HALF(half_params + i + SIMD_WIDTH * 5, param_4[5].data);
+                SIMD_STOREU_HALF(half_params + i + SIMD_WIDTH * 6, param_4[6].data);
+                SIMD_STOREU_HALF(half_params + i + SIMD_WIDTH * 7, param_4[7].data);
+            }
 
             SIMD_STORE(_exp_avg + i, momentum_4[0].data);
             SIMD_STORE(_exp_avg + i + SIMD_WIDTH, momentum_4[1].data);
@@ -694,7 +723,9 @@ void Adam_Optimizer::Step_8(float* _params,
                (_param_size - rounded_size),
                param_half_precision,
                grad_half_precision,
-               loss_scale);
+               loss_scale,
+               grad_bf16,
+               (half_params ? half_params + rounded_size : nullptr));
 }
 
 int ds_adam_step(int optimizer_id,
@@ -734,8 +765,64 @@ int ds_adam_step(int optimizer_id,
                 exp_avg_sq_ptr,
                 params_c.size(0),
                 (params.options().dtype() == at::kHalf),
-                (grads.options().dtype() == at::kHalf),
-                loss_scale);
+                (grads.options().dtype() == at::kHalf ||
+                 grads.options().dtype() == at::kBFloat16),
+                loss_scale,
+                (grads.options().dtype() == at::kBFloat16));
+
+    opt->SynchronizeStreams();
+    return 0;
+}
+
+// Update the fp32 params as `ds_adam_step` and write their fp16 copy to
+// `half_params` in the same pass, e.g. a pinned staging buffer copied to
+// the fp16 params on GPU.
+int ds_adam_step_plus_copy(int optimizer_id,
+                           size_t step,
+                           float lr,
+                           float beta1,
+                           float beta2,
+                           float epsilon,
+                           float weight_decay,
+                           bool bias_correction,
+                           torch::Tensor& params,
+                           torch::Tensor& grads,
+                           torch::Tensor& exp_avg,
+                           torch::Tensor& exp_avg_sq,
+                           float loss_scale,
+                           torch::Tensor& half_params)
+{
+    auto params_c = params.contiguous();
+    auto grads_c = grads.contiguous();
+    auto exp_avg_c = exp_avg.contiguous();
+    auto exp_avg_sq_c = exp_avg_sq.contiguous();
+
+    assert(half_params.options().dtype() == at::kHalf);
+    assert(half_params.is_contiguous());
+    assert(half_params.size(0) == params_c.size(0));
+
+    float* params_ptr = (float*)params_c.data_ptr();
+    float* grads_ptr = (float*)grads_c.data_ptr();
+    float* exp_avg_ptr = (float*)exp_avg_c.data_ptr();
+    float* exp_avg_sq_ptr = (float*)exp_avg_sq_c.data_ptr();
+    __half* half_params_ptr = (__half*)half_params.data_ptr();
+
+    std::shared_ptr<Adam_Optimizer> opt =
+        std::static_pointer_cast<Adam_Optimizer>(s_optimizers[optimizer_id]);
+    opt->IncrementStep(step, beta1, beta2);
+    opt->update_state(lr, epsilon, weight_decay, bias_correction);
+
+    opt->Step_8(params_ptr,
+                grads_ptr,
+                exp_avg_ptr,
+                exp_avg_sq_ptr,
+                params_c.size(0),
+                false,
+                (grads.options().dtype() == at::kHalf ||
+                 grads.options().dtype() == at::kBFloat16),
+                loss_scale,
+                (grads.options().dtype() == at::kBFloat16),
+                half_params_ptr);
 
     opt->SynchronizeStreams();
     return 0;
@@ -751,6 +838,9 @@ int destroy_adam_optimizer(int optimizer_id)
 PYBIND11_MODULE(TORCH_EXTENSION_NAME, m)
 {
     m.def("adam_update", &ds_adam_step, "DeepSpeed CPU Adam update (C++)");
+    m.def("adam_update_copy",
+          &ds_adam_step_plus_copy,
+          "DeepSpeed CPU Adam update and copy to fp16 params (C++)");
     m.def("create_adam", &create_adam_optimizer, "DeepSpeed CPU Adam (C++)");
     m.def("destroy_adam", &destroy_adam_optimizer, "DeepSpeed CPU Adam destroy (C++)");
 }
@@ -20,8 +20,10 @@
 
 #include <cuda_fp16.h>
 #include <cuda_runtime_api.h>
+#include <stdint.h>
 #include <stdio.h>
 #include <cassert>
+#include <cstring>
 #include "context.h"
 #include "cublas_v2.h"
 #include "cuda.h"
@@ -42,8 +44,15 @@
 #define SIMD_STORE(a, d) _mm512_storeu_ps(a, d)
 #define SIMD_STORE_HALF(a, d) \
     _mm256_store_ps(a, _mm256_castsi256_ps(_mm512_cvtps_ph(d, _MM_FROUND_TO_NEAREST_INT)))
+// Unaligned store of fp16, for the params at any offset of a chunk.
+#define SIMD_STOREU_HALF(a, d) \
+    _mm256_storeu_si256((__m256i*)(a), _mm512_cvtps_ph(d, _MM_FROUND_TO_NEAREST_INT))
 #define SIMD_LOAD(x) _mm512_loadu_ps(x)
 #define SIMD_LOAD_HALF(x) _mm512_cvtph_ps(_mm256_loadu_si256((const __m256i*)(x)))
+// bf16 is the upper half of fp32, widen to 32 bits and shift.
+#define SIMD_LOAD_BF16(x) \
+    _mm512_castsi512_ps(  \
+        _mm512_slli_epi32(_mm512_cvtepu16_epi32(_mm256_loadu_si256((const __m256i*)(x))), 16))
 #define SIMD_LOAD_SCALAR(x) _mm512_set1_ps(x)
 #define SIMD_SET(x) _mm512_set1_ps(x)
 #define SIMD_MUL(x, y) _mm512_mul_ps(x, y)
@@ -61,8 +70,14 @@
 #define SIMD_STORE(a, d) _mm256_storeu_ps(a, d)
 #define SIMD_STORE_HALF(a, d) \
     _mm_store_ps(a, _mm_castsi128_ps(_mm256_cvtps_ph(d, _MM_FROUND_TO_NEAREST_INT)))
+#define SIMD_STOREU_HALF(a, d) \
+    _mm_storeu_si128((__m128i*)(a), _mm256_cvtps_ph(d, _MM_FROUND_TO_NEAREST_INT))
 #define SIMD_LOAD(x) _mm256_loadu_ps(x)
 #define SIMD_LOAD_HALF(x) _mm256_cvtph_ps(_mm_loadu_si128((const __m128i*)(x)))
+// bf16 is the upper half of fp32, widen to 32 bits and shift.
+#define SIMD_LOAD_BF16(x) \
+    _mm256_castsi256_ps(  \
+        _mm256_slli_epi32(_mm256_cvtepu16_epi32(_mm_loadu_si128((const __m128i*)(x))), 16))
 #define SIMD_LOAD_SCALAR(x) _mm256_set1_ps(x)
 #define SIMD_SET(x) _mm256_set1_ps(x)
 #define SIMD_MUL(x, y) _mm256_mul_ps(x, y)
@@ -79,6 +94,17 @@
 #endif
 #endif
 
+// Load 16 bit grads, which are either fp16 or bf16.
+#define SIMD_LOAD_GRAD16(x, bf16) ((bf16) ? SIMD_LOAD_BF16(x) : SIMD_LOAD_HALF(x))
+
+inline float bf16_to_float(const __half* x)
+{
+    uint32_t bits = ((uint32_t)(*reinterpret_cast<const uint16_t*>(x))) << 16;
+    float f;
+    std::memcpy(&f, &bits, sizeof(f));
+    return f;
+}
+
 class Adam_Optimizer {
 public:
     Adam_Optimizer(float alpha = 1e-3,
@@ -116,7 +142,9 @@ public:
               size_t param_size,
               bool param_half_precision = false,
               bool grad_half_precision = false,
-              float loss_scale = -1);
+              float loss_scale = -1,
+              bool grad_bf16 = false,
+              __half* half_params = nullptr);
 
     void Step_4(float* _params,
                 float* grads,
@@ -125,7 +153,9 @@ public:
                 size_t param_size,
                 bool param_half_precision = false,
                 bool grad_half_precision = false,
-                float loss_scale = -1);
+                float loss_scale = -1,
+                bool grad_bf16 = false,
+                __half* half_params = nullptr);
 
     void Step_8(float* _params,
                 float* grads,
@@ -134,7 +164,9 @@ public:
                 size_t _param_size,
                 bool param_half_precision = false,
                 bool grad_half_precision = false,
-                float loss_scale = -1);
+                float loss_scale = -1,
+                bool grad_bf16 = false,
+                __half* half_params = nullptr);
 
     inline void SynchronizeStreams()
     {
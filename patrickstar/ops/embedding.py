@@ -82,8 +82,14 @@ class Embedding(nn.Embedding):
 
     If `use_cpu` is set, the embedding operations will
     be performed on CPU.
+    If `sparse_grad` is also set, the weight will get a row-sparse
+    gradient, so that only the rows of the looked up ids are
+    communicated and updated.
+    The output is cast to `dtype`, the dtype of the param chunks.
     """
     use_cpu = False
+    sparse_grad = False
+    dtype = torch.half
     # `instances` is a helper class static member for
     # preprocess context. For detail, see comments there.
     instances = []
@@ -91,6 +97,9 @@ class Embedding(nn.Embedding):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.use_cpu = Embedding.use_cpu
+        self.dtype = Embedding.dtype
+        if self.use_cpu and Embedding.sparse_grad:
+            self.sparse = True
         Embedding.instances.append(self)
 
     def forward(self, input_):
@@ -101,4 +110,4 @@ class Embedding(nn.Embedding):
         output = super().forward(input_)
         if self.use_cpu:
             output = copy_to_gpu(output)
-        return output.to(torch.half)
+        return output.to(self.dtype)
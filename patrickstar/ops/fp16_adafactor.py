@@ -0,0 +1,187 @@
+# BSD 3-Clause License
+#
+# Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the psutil authors nor the names of its contributors
+#    may be used to endorse or promote products derived from this software without
+#    specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import math
+
+import torch
+
+from patrickstar.core import ChunkType
+from .chunk_optimizer import FP16ChunkOptimizer
+
+
+def _rms(tensor):
+    return tensor.norm() / (tensor.numel() ** 0.5)
+
+
+class FP16Adafactor(FP16ChunkOptimizer):
+    r"""Adafactor for the chunk based params.
+
+    The second moment of the params with 2 or more dims is factored into a
+    row and a column vector, see https://arxiv.org/abs/1804.04235.
+    The factored states are much smaller than the params, so instead of
+    mirroring the layout of the param fp16 chunks, they are packed densely
+    into the VARIANCE chunks. The first moment is only kept when `beta1`
+    is set.
+
+    As the VARIANCE chunks do not pair with the param chunks, all params
+    are updated on CPU, i.e. hybrid Adam is disabled.
+
+    Args:
+        lr: float. If None, use the relative step size
+            `min(1e-2, 1 / sqrt(step))`.
+        eps: (float, float). Regularization constants of the squared grad
+            and the param scale.
+        clip_threshold: float. Threshold of the RMS of the final update.
+        decay_rate: float. Coefficient of the running average of the
+            squared grad.
+        beta1: float. Coefficient of the running average of the update.
+        weight_decay: float.
+        scale_parameter: bool. Scale the lr by the RMS of the param.
+    """
+
+    state_param_keys = ("exp_avg", "exp_avg_sq", "exp_avg_sq_row", "exp_avg_sq_col")
+
+    def __init__(
+        self,
+        client,
+        params,
+        loss_scaler=None,
+        gradient_clipping=-1,
+        max_grad_norm=-1,
+        lr=None,
+        eps=(1e-30, 1e-3),
+        clip_threshold=1.0,
+        decay_rate=-0.8,
+        beta1=None,
+        weight_decay=0,
+        scale_parameter=True,
+    ):
+        if lr is not None and not 0.0 <= lr:
+            raise ValueError("Invalid learning rate: {}".format(lr))
+        if not 0.0 <= eps[0] or not 0.0 <= eps[1]:
+            raise ValueError("Invalid epsilon value: {}".format(eps))
+        if not 0.0 < clip_threshold:
+            raise ValueError("Invalid clip_threshold: {}".format(clip_threshold))
+        if not decay_rate < 0.0:
+            raise ValueError("Invalid decay_rate: {}".format(decay_rate))
+        if beta1 is not None and not 0.0 <= beta1 < 1.0:
+            raise ValueError("Invalid beta1 parameter: {}".format(beta1))
+        if not 0.0 <= weight_decay:
+            raise ValueError("Invalid weight_decay value: {}".format(weight_decay))
+        defaults = dict(
+            lr=lr,
+            eps=eps,
+            clip_threshold=clip_threshold,
+            decay_rate=decay_rate,
+            beta1=beta1,
+            weight_decay=weight_decay,
+            scale_parameter=scale_parameter,
+        )
+        super(FP16Adafactor, self).__init__(
+            client,
+            params,
+            defaults,
+            loss_scaler=loss_scaler,
+            gradient_clipping=gradient_clipping,
+            max_grad_norm=max_grad_norm,
+            use_hybrid_adam=False,
+        )
+
+    def init_state_params(self, p, group):
+        shape = p.ps_attr.shape
+        if group["beta1"] is not None:
+            self.create_state_param(p, "exp_avg", ChunkType.MOMENTUM)
+        if len(shape) >= 2:
+            self.create_state_param(
+                p,
+                "exp_avg_sq_row",
+                ChunkType.VARIANCE,
+                shape=shape[:-1],
+                as_ref=False,
+            )
+            self.create_state_param(
+                p,
+                "exp_avg_sq_col",
+                ChunkType.VARIANCE,
+                shape=shape[:-2] + shape[-1:],
+                as_ref=False,
+            )
+        else:
+            self.create_state_param(p, "exp_avg_sq", ChunkType.VARIANCE, as_ref=False)
+
+    def update(self, data, grad, states, step, group):
+        if grad.is_sparse:
+            grad = grad.to_dense()
+        # The cpu kernels of fp16 are slow, update in fp32.
+        grad = grad.float()
+        if self.combined_scale is not None:
+            grad.div_(self.combined_scale)
+
+        eps1, eps2 = group["eps"]
+        if group["lr"] is None:
+            lr = min(1e-2, 1.0 / math.sqrt(step))
+        else:
+            lr = group["lr"]
+        if group["scale_parameter"]:
+            # The scale stays on device, no synchronization in the walk.
+            lr = _rms(data).clamp_(min=eps2).mul_(lr)
+
+        beta2t = 1.0 - math.pow(step, group["decay_rate"])
+        update = grad.square().add_(eps1)
+        if "exp_avg_sq_row" in states:
+            exp_avg_sq_row = states["exp_avg_sq_row"]
+            exp_avg_sq_col = states["exp_avg_sq_col"]
+            exp_avg_sq_row.mul_(beta2t).add_(update.mean(dim=-1), alpha=1 - beta2t)
+            exp_avg_sq_col.mul_(beta2t).add_(update.mean(dim=-2), alpha=1 - beta2t)
+            # Approximate the second moment with the outer product of the
+            # row and column running averages.
+            row_factor = (
+                (exp_avg_sq_row / exp_avg_sq_row.mean(dim=-1, keepdim=True))
+                .rsqrt_()
+                .unsqueeze(-1)
+            )
+            col_factor = exp_avg_sq_col.unsqueeze(-2).rsqrt()
+            update = torch.mul(row_factor, col_factor)
+        else:
+            exp_avg_sq = states["exp_avg_sq"]
+            exp_avg_sq.mul_(beta2t).add_(update, alpha=1 - beta2t)
+            update = exp_avg_sq.rsqrt()
+        update.mul_(grad)
+
+        update.div_((_rms(update) / group["clip_threshold"]).clamp_(min=1.0))
+        update.mul_(lr)
+
+        if group["beta1"] is not None:
+            exp_avg = states["exp_avg"]
+            exp_avg.mul_(group["beta1"]).add_(update, alpha=1 - group["beta1"])
+            update = exp_avg
+
+        if group["weight_decay"] != 0:
+            data.mul_(1 - group["weight_decay"] * lr)
+        data.sub_(update)
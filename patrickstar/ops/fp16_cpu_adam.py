@@ -27,39 +27,68 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from copy import deepcopy
 import math
-from typing import List
+
 import torch
-import time
 
 from patrickstar.core import ChunkType
-from patrickstar.core.const import TensorState, AccessType, TrainingStage
-from patrickstar.core.parameter import register_param, ParamType
-import patrickstar.utils.global_timer as global_timer
-from patrickstar.utils import logger, get_rank
-from .chunk_io_buff import FP32ChunkReadBuffer, FP16ChunkWriteBuffer
+from .chunk_optimizer import FP16ChunkOptimizer
 from .op_builder.cpu_adam import CPUAdamBuilder
-from patrickstar.utils.helper import get_real_data_tensor
-from patrickstar.profiler import profiler
-
+from .quantization import (
+    num_quant_blocks,
+    dequantize_blockwise_log,
+    quantize_blockwise_log_,
+)
+
+
+def foreach_adam_update(
+    datas,
+    grads,
+    exp_avgs,
+    exp_avg_sqs,
+    lr,
+    beta1,
+    beta2,
+    eps,
+    weight_decay,
+    bias_correction1,
+    bias_correction2,
+    use_adamw=False,
+    grad_scale=None,
+):
+    r"""Adam over lists of fp32 tensors with the `torch._foreach_*` ops.
+
+    Each op is applied to the whole lists at once, instead of issuing
+    one sequence of elementwise ops per tensor. `grads` are divided by
+    `grad_scale` if it is not None and are not modified inplace.
+    """
+    grads = [grad.float() for grad in grads]
+    if grad_scale is not None:
+        grads = torch._foreach_div(grads, grad_scale)
+    if weight_decay != 0:
+        if use_adamw:
+            # Perform stepweight decay
+            torch._foreach_mul_(datas, 1 - lr * weight_decay)
+        else:
+            grads = torch._foreach_add(grads, datas, alpha=weight_decay)
 
-def zero_param(p):
-    return torch.nn.Parameter(
-        torch.zeros_like(p, dtype=torch.float),
-        requires_grad=False,
-    )
+    # Decay the first and second moment running average coefficient
+    torch._foreach_mul_(exp_avgs, beta1)
+    torch._foreach_add_(exp_avgs, grads, alpha=1 - beta1)
+    torch._foreach_mul_(exp_avg_sqs, beta2)
+    torch._foreach_addcmul_(exp_avg_sqs, grads, grads, 1 - beta2)
 
+    denom = torch._foreach_sqrt(exp_avg_sqs)
+    torch._foreach_div_(denom, math.sqrt(bias_correction2))
+    torch._foreach_add_(denom, eps)
 
-def empty_cpu_param():
-    return torch.nn.Parameter(
-        torch.tensor([], dtype=torch.float, device=torch.device("cpu:0")),
-        requires_grad=False,
-    )
+    step_size = lr / bias_correction1
+    torch._foreach_addcdiv_(datas, exp_avgs, denom, -step_size)
 
 
-class FP16Adam(torch.optim.Optimizer):
+class FP16Adam(FP16ChunkOptimizer):
     optimizer_id = 0
+    state_param_keys = ("exp_avg", "exp_avg_sq", "exp_avg_absmax", "exp_avg_sq_absmax")
 
     def __init__(
         self,
@@ -67,6 +96,7 @@ class FP16Adam(torch.optim.Optimizer):
         params,
         loss_scaler=None,
         gradient_clipping=-1,
+        max_grad_norm=-1,
         lr=1e-3,
         betas=(0.9, 0.999),
         eps=1e-8,
@@ -74,10 +104,28 @@ class FP16Adam(torch.optim.Optimizer):
         use_adamw=False,
         amsgrad=False,
         use_hybrid_adam=True,
+        use_8bit_states=False,
+        state_block_size=2048,
+        use_foreach_adam=False,
     ):
         """
         The implementation was based on
         https://github.com/pytorch/pytorch/blob/c371542efc/torch/optim/optimizer.py
+
+        If `use_8bit_states` is set, the momentum and variance are stored
+        block-wise quantized to int8 in the MOMENTUM_INT8 and VARIANCE_INT8
+        chunks, with the fp32 scale of every `state_block_size` elements in
+        the QUANT_SCALE chunks. They are dequantized before and quantized
+        after the update on the compute device, in the buffers reused
+        across params.
+
+        If `use_foreach_adam` is set, the C++ CPU Adam extension is not
+        loaded, which saves its JIT compilation. The params of a chunk are
+        updated together with the `torch._foreach_*` ops on CPU and GPU.
+
+        With the `with_half_write_back` opt of the client, the C++ CPU Adam
+        writes the fp16 copy of the updated params into the pinned staging
+        buffer of the write-back in the same pass as the update.
         """
         if not 0.0 <= lr:
             raise ValueError("Invalid learning rate: {}".format(lr))
@@ -89,113 +137,133 @@ class FP16Adam(torch.optim.Optimizer):
             raise ValueError("Invalid beta parameter at index 1: {}".format(betas[1]))
         if not 0.0 <= weight_decay:
             raise ValueError("Invalid weight_decay value: {}".format(weight_decay))
+        if not 0 < state_block_size:
+            raise ValueError("Invalid state_block_size: {}".format(state_block_size))
+        if use_foreach_adam and not hasattr(torch, "_foreach_addcdiv_"):
+            raise RuntimeError("use_foreach_adam requires torch >= 1.8.")
+        self.use_foreach_adam = use_foreach_adam
+        # The dequantized states share one buffer per device, update the
+        # params one by one with 8 bit states.
+        self.batched_update = use_foreach_adam and not use_8bit_states
+        self.ds_opt_adam = None
+        # Used in the state initialization in the constructor of the base class.
+        self.use_8bit_states = use_8bit_states
+        self.state_block_size = state_block_size
+        # device -> fp32 buffer of the dequantized momentum and variance.
+        self._dequant_buffs = {}
         defaults = dict(
             lr=lr, betas=betas, eps=eps, weight_decay=weight_decay, amsgrad=amsgrad
         )
-        super(FP16Adam, self).__init__(params, defaults)
-        self.client = client
+        super(FP16Adam, self).__init__(
+            client,
+            params,
+            defaults,
+            loss_scaler=loss_scaler,
+            gradient_clipping=gradient_clipping,
+            max_grad_norm=max_grad_norm,
+            use_hybrid_adam=use_hybrid_adam,
+        )
+        if use_8bit_states:
+            # 6 = 4 + 1 + 1 (fp32 + m + v)
+            client.mem_tracer.optimizer_state_bytes_per_elem = 6
 
-        self.loss_scaler = loss_scaler
-        self.has_overflow = False
+        self.use_adamw = use_adamw
+        if not use_foreach_adam:
+            self.opt_id = FP16Adam.optimizer_id
+            FP16Adam.optimizer_id = FP16Adam.optimizer_id + 1
+            try:
+                # The pre-compiled cpu adam extension.
+                from .adam import cpu_adam_op
+            except ImportError:
+                cpu_adam_op = CPUAdamBuilder().load()
+
+            self.ds_opt_adam = cpu_adam_op
+            self.ds_opt_adam.create_adam(
+                self.opt_id,
+                lr,
+                betas[0],
+                betas[1],
+                eps,
+                weight_decay,
+                self.use_adamw,
+                True,
+            )
+            # The kernel only casts to fp16, not bf16.
+            self.fused_half_write_back = (
+                client.opt_config["with_half_write_back"]
+                and client.half_dtype == torch.half
+                and hasattr(cpu_adam_op, "adam_update_copy")
+            )
 
-        self.gradient_clipping = gradient_clipping
-        # clamp_scalar_cpu does not support fp16. Turn the gradient_clipping
-        # to tensor to use clamp_cpu instead.
-        self.cpu_gradient_clipping = torch.Tensor([gradient_clipping])
+    def init_state_params(self, p, group):
+        # Chunk layout of Momentum and Variance should be consist with param fp16
+        if not self.use_8bit_states:
+            self.create_state_param(p, "exp_avg", ChunkType.MOMENTUM)
+            self.create_state_param(p, "exp_avg_sq", ChunkType.VARIANCE)
+            return
+        self.create_state_param(p, "exp_avg", ChunkType.MOMENTUM_INT8, dtype=torch.int8)
+        self.create_state_param(
+            p, "exp_avg_sq", ChunkType.VARIANCE_INT8, dtype=torch.int8
+        )
+        # The scales are much smaller than the params, pack them densely.
+        num_blocks = num_quant_blocks(p.ps_attr.numel, self.state_block_size)
+        for key in ["exp_avg_absmax", "exp_avg_sq_absmax"]:
+            self.create_state_param(
+                p,
+                key,
+                ChunkType.QUANT_SCALE,
+                shape=torch.Size([num_blocks]),
+                as_ref=False,
+            )
 
-        self.use_hybrid_adam = use_hybrid_adam
+    def _dequantize_states(self, states, numel, shape, device):
+        r"""Dequantize the momentum and variance into the fp32 buffers.
 
-        assert (
-            len(self.param_groups) == 1
-        ), "Only support one param group at the moment."
-        # Eager state initialization, different from Pytorch
-        for group in self.param_groups:
-            for p in group["params"]:
-                state = self.state[p]
-                self.state[p]["betas"] = group["betas"]
-                self.state[p]["lr"] = group["lr"]
-                self.state[p]["weight_decay"] = group["weight_decay"]
-                self.state[p]["eps"] = group["eps"]
-
-                state["step"] = 0
-
-                if p.ps_attr.param_type == ParamType.TORCH_BASED:
-                    if p.requires_grad:
-                        state["exp_avg"] = zero_param(p)
-                        register_param(
-                            state["exp_avg"], ParamType.TORCH_BASED, torch.float
-                        )
-                        state["exp_avg_sq"] = zero_param(p)
-                        register_param(
-                            state["exp_avg_sq"], ParamType.TORCH_BASED, torch.float
-                        )
-                elif p.ps_attr.is_local():
-                    # Only create the local optimizer state params.
-                    name = p.ps_attr.name
-                    state["exp_avg"] = empty_cpu_param()
-                    register_param(
-                        state["exp_avg"],
-                        ParamType.CHUNK_BASED,
-                        torch.float,
-                        f"{name}.exp_avg",
-                    )
-                    state["exp_avg"].ps_attr.reset_shape(p.ps_attr.shape)
-                    state["exp_avg"].ps_attr._is_local = p.ps_attr.is_local()
-
-                    state["exp_avg_sq"] = empty_cpu_param()
-                    register_param(
-                        state["exp_avg_sq"],
-                        ParamType.CHUNK_BASED,
-                        torch.float,
-                        f"{name}.exp_avg_sq",
-                    )
-                    state["exp_avg_sq"].ps_attr.reset_shape(p.ps_attr.shape)
-                    state["exp_avg_sq"].ps_attr._is_local = p.ps_attr.is_local()
-
-                    # Chunk layout of Momentum and Variance should be consist with param fp16
-                    self.client.append_tensor_as_ref(
-                        state["exp_avg"],
-                        torch.float,
-                        AccessType.DATA,
-                        ChunkType.MOMENTUM,
-                        p,
-                    )
-
-                    self.client.append_tensor_as_ref(
-                        state["exp_avg_sq"],
-                        torch.float,
-                        AccessType.DATA,
-                        ChunkType.VARIANCE,
-                        p,
-                    )
-
-        # The buffer for fp16 grad.
-        self.read_chunk_buff = None
-        self.use_adamw = use_adamw
-        self.opt_id = FP16Adam.optimizer_id
-        FP16Adam.optimizer_id = FP16Adam.optimizer_id + 1
-        try:
-            # The pre-compiled cpu adam extension.
-            from .adam import cpu_adam_op
-        except ImportError:
-            cpu_adam_op = CPUAdamBuilder().load()
-
-        self.ds_opt_adam = cpu_adam_op
-        self.ds_opt_adam.create_adam(
-            self.opt_id,
-            lr,
-            betas[0],
-            betas[1],
-            eps,
-            weight_decay,
-            self.use_adamw,
-            True,
+        The states are stored with the log code, which keeps the relative
+        precision of the small values of a block, see
+        `quantize_blockwise_log_`.
+        """
+        buff = self._dequant_buffs.get(device)
+        if buff is None or buff.shape[1] < numel:
+            buff = torch.empty(2, numel, dtype=torch.float, device=device)
+            self._dequant_buffs[device] = buff
+        exp_avg = buff[0, :numel].view(shape)
+        exp_avg_sq = buff[1, :numel].view(shape)
+        dequantize_blockwise_log(
+            states["exp_avg"],
+            states["exp_avg_absmax"],
+            self.state_block_size,
+            exp_avg,
+            signed=True,
+        )
+        dequantize_blockwise_log(
+            states["exp_avg_sq"],
+            states["exp_avg_sq_absmax"],
+            self.state_block_size,
+            exp_avg_sq,
+        )
+        return exp_avg, exp_avg_sq
+
+    def _quantize_states(self, states, exp_avg, exp_avg_sq):
+        quantize_blockwise_log_(
+            exp_avg,
+            states["exp_avg"],
+            states["exp_avg_absmax"],
+            self.state_block_size,
+            signed=True,
+        )
+        quantize_blockwise_log_(
+            exp_avg_sq,
+            states["exp_avg_sq"],
+            states["exp_avg_sq_absmax"],
+            self.state_block_size,
         )
 
     def __del__(self):
         # need to destroy the C++ object explicitly to avoid a memory leak when intialize_engine
         # is used multiple times in the same process.
-        self.ds_opt_adam.destroy_adam(self.opt_id)
+        if getattr(self, "ds_opt_adam", None) is not None:
+            self.ds_opt_adam.destroy_adam(self.opt_id)
 
     def __setstate__(self, state):
         super(FP16Adam, self).__setstate__(state)
@@ -215,17 +283,38 @@ class FP16Adam(torch.optim.Optimizer):
         eps,
         weight_decay,
         bias_correction,
+        half_data=None,
     ):
         """
         This function will update the data, momentum and variance inplace.
+        The updated data is also written to `half_data` in fp16 if given.
         """
         assert data.device.type == "cpu"
         assert grad.device.type == "cpu"
         assert momentum.device.type == "cpu"
         assert variance.device.type == "cpu"
 
-        loss_scale = self.loss_scaler.loss_scale if self.loss_scaler is not None else -1
+        # The kernel divides the grad by `loss_scale` if it is positive.
+        loss_scale = self.combined_scale if self.combined_scale is not None else -1
         # Inputs of DS CPU Adam need to be flattened.
+        if half_data is not None:
+            self.ds_opt_adam.adam_update_copy(
+                self.opt_id,
+                step,
+                lr,
+                beta1,
+                beta2,
+                eps,
+                weight_decay,
+                bias_correction,
+                data.view(-1),
+                grad.view(-1),
+                momentum.view(-1),
+                variance.view(-1),
+                loss_scale,
+                half_data.view(-1),
+            )
+            return
         self.ds_opt_adam.adam_update(
             self.opt_id,
             step,
@@ -242,6 +331,64 @@ class FP16Adam(torch.optim.Optimizer):
             loss_scale,
         )
 
+    def sparse_cpu_adam_update(
+        self,
+        data,
+        grad,
+        momentum,
+        variance,
+        step,
+        lr,
+        beta1,
+        beta2,
+        eps,
+        weight_decay,
+        bias_correction,
+    ):
+        """
+        Lazy Adam for the row-sparse grad of embedding.
+        Only the rows appearing in `grad` will be updated, the same as
+        `torch.optim.SparseAdam`. `grad` should be coalesced.
+        """
+        indices = grad._indices()[0]
+        if indices.numel() == 0:
+            return
+        values = grad._values()
+        data_rows = data.index_select(0, indices)
+        momentum_rows = momentum.index_select(0, indices)
+        variance_rows = variance.index_select(0, indices)
+        if self.ds_opt_adam is not None:
+            self.ds_cpu_adam_update(
+                data_rows,
+                values.contiguous(),
+                momentum_rows,
+                variance_rows,
+                step,
+                lr,
+                beta1,
+                beta2,
+                eps,
+                weight_decay,
+                bias_correction,
+            )
+        else:
+            self.torch_adam_update(
+                data_rows,
+                values.float(),
+                momentum_rows,
+                variance_rows,
+                lr,
+                beta1,
+                beta2,
+                eps,
+                weight_decay,
+                1 - beta1 ** step if bias_correction else 1,
+                1 - beta2 ** step if bias_correction else 1,
+            )
+        data.index_copy_(0, indices, data_rows)
+        momentum.index_copy_(0, indices, momentum_rows)
+        variance.index_copy_(0, indices, variance_rows)
+
     def torch_adam_update(
         self,
         data,
@@ -256,8 +403,8 @@ class FP16Adam(torch.optim.Optimizer):
         bias_correction1,
         bias_correction2,
     ):
-        if self.loss_scaler is not None:
-            grad.div_(self.loss_scaler.loss_scale)
+        if self.combined_scale is not None:
+            grad.div_(self.combined_scale)
         if weight_decay != 0:
             if self.use_adamw:
                 # Perform stepweight decay
@@ -276,419 +423,91 @@ class FP16Adam(torch.optim.Optimizer):
 
         data.addcdiv_(exp_avg, denom, value=-step_size)
 
-    def check_overflow(self, param):
-        if (
-            self.loss_scaler is not None
-            and not self.has_overflow
-            and self.loss_scaler.has_overflow(param)
-        ):
-            self.has_overflow = True
-
-    def has_overflow_and_reset_param(self, write_chunk_buff):
-        r"""Method for collective communicating overflow and reset params.
-        This method should be called after checking if each individual
-        grad has overflow.
-        """
-        if torch.distributed.is_initialized():
-            overflow_gpu = torch.cuda.ByteTensor([self.has_overflow])
-            torch.distributed.all_reduce(
-                overflow_gpu, op=torch.distributed.ReduceOp.MAX
+    def update(self, data, grad, states, step, group, half_data=None):
+        quantized = "exp_avg_absmax" in states
+        if quantized:
+            exp_avg, exp_avg_sq = self._dequantize_states(
+                states, data.numel(), data.shape, data.device
             )
-            self.has_overflow = overflow_gpu[0].item()
-        if self.has_overflow:
-            # TODO(zilinzhu): Find a better way to overwrite the grads
-            for _, p in self.client.module.named_parameters():
-                if p.ps_attr.param_type == ParamType.TORCH_BASED:
-                    continue
-                if not p.ps_attr.is_local():
-                    continue
-                fp32_param = self.client.param_fp16_to_param_fp32_map[p]
-                write_chunk_buff.write_from_cache(p, fp32_param)
-            self.has_overflow = False
-            write_chunk_buff.reset()
-            return True
-        return False
-
-    def fp16_chunk_adam_ops(
-        self,
-        client,
-        fp32_param_list: List[torch.nn.Parameter],
-        fp16_param_with_grad_list,
-        exp_avg_list: List[torch.nn.Parameter],
-        exp_avg_sq_list: List[torch.nn.Parameter],
-        state_steps: List[int],
-        amsgrad: bool,
-        hyperparam_list: List[dict],
-        read_chunk_buff,
-        write_chunk_buff,
-        time_profile=True,
-        margin_chunk_num_for_gpu_adam=0,
-    ):
-        r"""Functional API that performs Adam algorithm computation.
-        Visit fp16_param_with_grad_list in the order of tensors stored in chunks.
-        Copy the chunk into a tmp buffer to speed up the memcpy between devices.
-        """
-        local_rank = client.local_rank
-        logger.debug(
-            f"local_rank {local_rank} margin_chunk_num_for_gpu_adam {margin_chunk_num_for_gpu_adam}, "
-            f"param cnt {len(fp32_param_list)}"
-        )
-        for i, fp32_param in enumerate(fp32_param_list):
-            # 1. prepare data for Adam
-            fp16_param = fp16_param_with_grad_list[i]
-
-            if time_profile:
-                global_timer.my_timer.start_profile("ADAM_prepare_data")
-                global_timer.my_timer.start_profile("ADAM_prepare_data_grad_copy")
-
-            # Copy the fp16 grads in the granularity of chunks.
-            if fp16_param.ps_attr.param_type == ParamType.TORCH_BASED:
-                # If fp16_param is managed by native torch, it should be on CPU,
-                # because only cpu_embedding optimization are managed by native torch
-                # now and it is fp32.
-                assert fp32_param is None
-                fp32_param = fp16_param
-                # Here the grad is already of dtype fp32.
-                fp16_grad_tensor = fp16_param.grad
-                assert fp16_grad_tensor.dtype == torch.float
-            else:
-                # Copy the fp16 grad chunk to the compute_device of fp32 param chunk.
-                # As we are visiting  params by its storing order in the chunk,
-                # we will only copy the chunk when visiting its first tensor and store it
-                # in the buffer. For the rest of the tensors, we will directly indexing from
-                # the buffer.
-                fp16_grad_tensor = read_chunk_buff.access_from_cache(fp16_param).view(
-                    fp16_param.ps_attr.shape
-                )
-
-            # Gradient clipping
-            if self.gradient_clipping > 0:
-                # The gradient clipping may be larger than the max fp16 value
-                # after being amplified by loss scale.
-                max_fp16 = torch.finfo(torch.half).max
-                if fp16_grad_tensor.device.type == "cpu":
-                    gradient_clipping = self.cpu_gradient_clipping
-                    if self.loss_scaler is not None:
-                        gradient_clipping *= self.loss_scaler.loss_scale
-                    gradient_clipping = min(torch.Tensor([max_fp16]), gradient_clipping)
-                else:
-                    gradient_clipping = self.gradient_clipping
-                    if self.loss_scaler is not None:
-                        gradient_clipping *= self.loss_scaler.loss_scale
-                    gradient_clipping = min(max_fp16, gradient_clipping)
-                fp16_grad_tensor.clamp_(-gradient_clipping, gradient_clipping)
-
-            compute_device = fp16_grad_tensor.device
-
-            if time_profile:
-                global_timer.my_timer.finish_profile("ADAM_prepare_data_grad_copy")
-                global_timer.data_move_cnter.update(
-                    "ADAM_prepare_data_grad_copy", fp16_grad_tensor.numel() * 2
-                )
-
-            client.access_data(fp32_param, compute_device)
-            fp32_data_tensor = get_real_data_tensor(fp32_param)
-
-            exp_avg_param = exp_avg_list[i]
-            exp_avg_sq_param = exp_avg_sq_list[i]
-
-            client.access_data(exp_avg_param, compute_device)
-            client.access_data(exp_avg_sq_param, compute_device)
-
-            exp_avg = get_real_data_tensor(exp_avg_param)
-            exp_avg_sq = get_real_data_tensor(exp_avg_sq_param)
-
-            # 2. Start Adam
-            if time_profile:
-                global_timer.my_timer.finish_profile("ADAM_prepare_data")
-                global_timer.my_timer.start_profile("ADAM_compute")
-
-            step = state_steps[i]
-            beta1, beta2 = hyperparam_list[i]["betas"]
-            eps = hyperparam_list[i]["eps"]
-            weight_decay = hyperparam_list[i]["weight_decay"]
-            lr = hyperparam_list[i]["lr"]
-
-            bias_correction1 = 1 - beta1 ** step
-            bias_correction2 = 1 - beta2 ** step
-
-            if compute_device.type == "cpu" and fp16_grad_tensor.device.type == "cpu":
-                self.ds_cpu_adam_update(
-                    fp32_data_tensor,
-                    fp16_grad_tensor,
-                    exp_avg,
-                    exp_avg_sq,
-                    step,
-                    lr,
-                    beta1,
-                    beta2,
-                    eps,
-                    weight_decay,
-                    True,
-                )
-            else:
-                fp32_grad_tensor = fp16_grad_tensor.float()
-                self.torch_adam_update(
-                    fp32_data_tensor,
-                    fp32_grad_tensor,
-                    exp_avg,
-                    exp_avg_sq,
-                    lr,
-                    beta1,
-                    beta2,
-                    eps,
-                    weight_decay,
-                    bias_correction1,
-                    bias_correction2,
-                )
-
-            if time_profile:
-                global_timer.my_timer.finish_profile("ADAM_compute")
-                global_timer.my_timer.start_profile("ADAM_param_fp32_to_fp16")
-
-            # 3. Finish Adam.
-
-            # Copy fp32_param back to fp16_param.
-            if fp32_param.ps_attr.param_type == ParamType.CHUNK_BASED:
-                write_chunk_buff.write_from_cache(fp16_param, fp32_param)
-
-            if time_profile:
-                global_timer.my_timer.finish_profile("ADAM_param_fp32_to_fp16")
-                global_timer.data_move_cnter.update(
-                    "ADAM_param_fp32_to_fp16", fp32_data_tensor.numel() * 4
-                )
-                global_timer.my_timer.start_profile("ADAM_release_data")
-
-            client.release_data(fp32_param)
-            client.release_data(exp_avg_param)
-            client.release_data(exp_avg_sq_param)
-
-            if time_profile:
-                global_timer.my_timer.finish_profile("ADAM_release_data")
-
-        write_chunk_buff.reset()
-        read_chunk_buff.reset()
-
-    @torch.no_grad()
-    def step(self, closure=None):
-        """Performs a single optimization step.
-
-        Args:
-            closure (callable, optional): A closure that reevaluates the model
-                and returns the loss.
-        """
-        global_timer.my_timer.start_profile("ADAM")
-
-        rank = get_rank()
-        mem_tracer = self.client.mem_tracer
-        for name, param in self.client.module.named_parameters():
-            if param.ps_attr.param_type == ParamType.TORCH_BASED:
-                continue
-            if param.ps_attr.get_state(AccessType.DATA) == TensorState.COMPUTE:
-                self.client.optimizer.check_overflow(param)
-                logger.debug(
-                    f"adam forces rank {rank} to"
-                    f"release param {self.client.module.__class__.__name__}.{name} from COMPUTE to HOLD_AFTER_BWD"
-                )
-                tmp_tensor = param.ps_attr.access_tensor(AccessType.DATA)
-                tmp_tensor.copy_(param.grad)
-                param.grad = None
-                if torch.distributed.is_initialized():
-                    self.client.release_dist(
-                        param,
-                        AccessType.DATA,
-                        TensorState.HOLD_AFTER_BWD,
-                        training_stage=TrainingStage.BWD,
-                        do_allreduce=True,
-                        with_mem_saving_comm=self.client.opt_config[
-                            "with_mem_saving_comm"
-                        ],
-                    )
-                else:
-                    self.client.release_data(param, TensorState.HOLD_AFTER_BWD)
-        if profiler.started():
-            profiler.stage_convert_time.append((time.time(), TrainingStage.ADAM))
-
-        self.client.reset_visited_chunk()
-        self.client.set_training_phase(TrainingStage.ADAM)
-
-        self.client.trigger_memory_tracing()
-        self.client.adjust_chunk_layout()
-
-        loss = None
-        if closure is not None:
-            with torch.enable_grad():
-                loss = closure()
-
-        if self.use_hybrid_adam:
-            margin_chunk_num_for_gpu_adam = (
-                mem_tracer.get_margin_chunk_num_for_gpu_adam()
+        else:
+            exp_avg = states["exp_avg"]
+            exp_avg_sq = states["exp_avg_sq"]
+        beta1, beta2 = group["betas"]
+        eps = group["eps"]
+        weight_decay = group["weight_decay"]
+        lr = group["lr"]
+
+        bias_correction1 = 1 - beta1 ** step
+        bias_correction2 = 1 - beta2 ** step
+
+        if grad.is_sparse:
+            self.sparse_cpu_adam_update(
+                data,
+                grad,
+                exp_avg,
+                exp_avg_sq,
+                step,
+                lr,
+                beta1,
+                beta2,
+                eps,
+                weight_decay,
+                True,
             )
+        elif grad.device.type == "cpu" and self.ds_opt_adam is not None:
+            self.ds_cpu_adam_update(
+                data,
+                grad,
+                exp_avg,
+                exp_avg_sq,
+                step,
+                lr,
+                beta1,
+                beta2,
+                eps,
+                weight_decay,
+                True,
+                half_data=half_data,
+            )
+            # Already written by the kernel.
+            half_data = None
         else:
-            margin_chunk_num_for_gpu_adam = 0
-
-        max_chunk_size = self.client.chunk_list.max_chunk_size()
-        self.read_chunk_buff = FP32ChunkReadBuffer(
-            self.client.chunk_list,
-            self.client.chunk_tensor_index,
-            max_chunk_size,
-            margin_chunk_num_for_gpu_adam,
-            self.client.chunk_list.memory_cache
-            if self.client.opt_config["with_mem_cache"]
-            else None,
-        )
-        self.write_chunk_buff = FP16ChunkWriteBuffer(
-            self.client.chunk_list,
-            self.client.chunk_tensor_index,
-            max_chunk_size,
-            self.client.chunk_list.memory_cache
-            if self.client.opt_config["with_mem_cache"]
-            else None,
-        )
-
-        if self.has_overflow_and_reset_param(write_chunk_buff=self.write_chunk_buff):
-            global_timer.my_timer.finish_profile("ADAM")
-            old_loss_scale = self.loss_scaler.loss_scale
-            self.loss_scaler.update_scale(True)
-            new_loss_scale = self.loss_scaler.loss_scale
-            logger.warning(
-                f"Gradient overflow! Update loss scale from {old_loss_scale} to {new_loss_scale}."
+            self.torch_adam_update(
+                data,
+                grad.float(),
+                exp_avg,
+                exp_avg_sq,
+                lr,
+                beta1,
+                beta2,
+                eps,
+                weight_decay,
+                bias_correction1,
+                bias_correction2,
             )
 
-            return loss
-
-        fp16_param_with_grad_list = []
-        fp32_param_list = []
-        exp_avg_list = []
-        exp_avg_sq_list = []
-
-        hyperparam_list = []
-        state_steps = []
-
-        max_param_size = 0
-        for _, group in enumerate(self.param_groups):
-            for _, p in enumerate(group["params"]):
-                if p.requires_grad:
-                    # update the steps for each param group update
-                    state = self.state[p]
-                    state["step"] += 1
-
-                    # When p is not torch param and belongs to a remote chunk, skip.
-                    if (
-                        p.ps_attr.param_type == ParamType.CHUNK_BASED
-                        and not p.ps_attr.is_local()
-                    ):
-                        continue
-
-                    if p.ps_attr.param_type == ParamType.TORCH_BASED:
-                        max_param_size = max(p.numel(), max_param_size)
-
-                    fp16_param_with_grad_list.append(p)
-
-                    exp_avg_list.append(state["exp_avg"])
-                    exp_avg_sq_list.append(state["exp_avg_sq"])
-                    if p in self.client.param_fp16_to_param_fp32_map:
-                        fp32_param_list.append(
-                            self.client.param_fp16_to_param_fp32_map[p]
-                        )
-                    else:
-                        fp32_param_list.append(None)
-                    hyperparam = {
-                        "betas": state["betas"],
-                        "lr": state["lr"],
-                        "weight_decay": state["weight_decay"],
-                        "eps": state["eps"],
-                    }
-
-                    hyperparam_list.append(hyperparam)
-
-                    # record the step after step update
-                    state_steps.append(state["step"])
-
-        # Hybrid Adam. Put some chunks on GPU based on the warmup info.
-        self.fp16_chunk_adam_ops(
-            self.client,
-            fp32_param_list,
-            fp16_param_with_grad_list,
-            exp_avg_list,
-            exp_avg_sq_list,
-            state_steps,
-            False,
-            hyperparam_list,
-            self.read_chunk_buff,
-            self.write_chunk_buff,
-            True,
-            margin_chunk_num_for_gpu_adam,
+        if half_data is not None:
+            half_data.copy_(data)
+        if quantized:
+            self._quantize_states(states, exp_avg, exp_avg_sq)
+
+    def update_batch(self, datas, grads, states_list, step, group):
+        if any(grad.is_sparse for grad in grads):
+            super().update_batch(datas, grads, states_list, step, group)
+            return
+        beta1, beta2 = group["betas"]
+        foreach_adam_update(
+            datas,
+            grads,
+            [states["exp_avg"] for states in states_list],
+            [states["exp_avg_sq"] for states in states_list],
+            group["lr"],
+            beta1,
+            beta2,
+            group["eps"],
+            group["weight_decay"],
+            1 - beta1 ** step,
+            1 - beta2 ** step,
+            use_adamw=self.use_adamw,
+            grad_scale=self.combined_scale,
         )
-
-        if self.loss_scaler:
-            self.loss_scaler.update_scale(False)
-
-        global_timer.my_timer.finish_profile("ADAM")
-        return loss
-
-    def state_dict(self):
-        r"""Returns the state of the optimizer as a :class:`dict`.
-
-        It contains two entries:
-
-        * state - a dict holding current optimization state. Its content
-            differs between optimizer classes.
-        * param_groups - a dict containing all parameter self.param_groups
-        """
-        raw_state_dict = super().state_dict()
-        old_packed_state = raw_state_dict["state"]
-        param_groups = raw_state_dict["param_groups"]
-        assert len(param_groups) == 1
-        packed_state = {}
-        for idx in old_packed_state:
-            packed_state[idx] = {}
-            for k, v in old_packed_state[idx].items():
-                if isinstance(v, torch.nn.Parameter):
-                    packed_state[idx][k] = (
-                        self.client.access_data(v, torch.device("cpu:0"))
-                        .clone()
-                        .detach()
-                    )
-                else:
-                    packed_state[idx][k] = v
-        return {
-            "state": packed_state,
-            "param_groups": param_groups,
-        }
-
-    def load_state_dict(self, state_dict):
-        r"""Loads the optimizer state.
-
-        Args:
-            state_dict (dict): optimizer state. Should be an object returned
-                from a call to :meth:`state_dict`.
-        """
-        # deepcopy, to be consistent with module API
-        state_dict = deepcopy(state_dict)
-
-        saved_groups = state_dict["param_groups"]
-        saved_state = state_dict["state"]
-
-        assert len(saved_groups) == 1
-        assert len(saved_groups[0]["params"]) == len(self.param_groups[0]["params"])
-        assert len(saved_state) == len(self.state)
-
-        # Update the state
-        id_map = {
-            old_id: p
-            for old_id, p in zip(
-                saved_groups[0]["params"], self.param_groups[0]["params"]
-            )
-        }
-
-        for idx, p in id_map.items():
-            saved_single_state = saved_state[idx]
-            single_state = self.state[p]
-            assert len(saved_single_state) == len(single_state)
-            for k, v in single_state.items():
-                if isinstance(v, torch.nn.Parameter):
-                    tensor = self.client.access_data(v, torch.device("cpu:0"))
-                    tensor.copy_(saved_single_state[k])
-                else:
-                    single_state[k] = saved_single_state[k]
@@ -0,0 +1,131 @@
+# BSD 3-Clause License
+#
+# Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the psutil authors nor the names of its contributors
+#    may be used to endorse or promote products derived from this software without
+#    specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import torch
+
+from patrickstar.core import ChunkType
+from .chunk_optimizer import FP16ChunkOptimizer
+
+
+class FP16Lamb(FP16ChunkOptimizer):
+    r"""LAMB for the chunk based params.
+
+    The moments are stored in the MOMENTUM and VARIANCE chunks with the same
+    layout as Adam. The trust ratio of each param is computed on the fp32
+    param and the update while walking the chunks, see
+    https://arxiv.org/abs/1904.00962.
+    """
+
+    state_param_keys = ("exp_avg", "exp_avg_sq")
+
+    def __init__(
+        self,
+        client,
+        params,
+        loss_scaler=None,
+        gradient_clipping=-1,
+        max_grad_norm=-1,
+        lr=1e-3,
+        betas=(0.9, 0.999),
+        eps=1e-6,
+        weight_decay=0,
+        max_trust_ratio=10.0,
+        use_hybrid_adam=True,
+    ):
+        if not 0.0 <= lr:
+            raise ValueError("Invalid learning rate: {}".format(lr))
+        if not 0.0 <= eps:
+            raise ValueError("Invalid epsilon value: {}".format(eps))
+        if not 0.0 <= betas[0] < 1.0:
+            raise ValueError("Invalid beta parameter at index 0: {}".format(betas[0]))
+        if not 0.0 <= betas[1] < 1.0:
+            raise ValueError("Invalid beta parameter at index 1: {}".format(betas[1]))
+        if not 0.0 <= weight_decay:
+            raise ValueError("Invalid weight_decay value: {}".format(weight_decay))
+        if not 0.0 < max_trust_ratio:
+            raise ValueError("Invalid max_trust_ratio: {}".format(max_trust_ratio))
+        defaults = dict(
+            lr=lr,
+            betas=betas,
+            eps=eps,
+            weight_decay=weight_decay,
+            max_trust_ratio=max_trust_ratio,
+        )
+        super(FP16Lamb, self).__init__(
+            client,
+            params,
+            defaults,
+            loss_scaler=loss_scaler,
+            gradient_clipping=gradient_clipping,
+            max_grad_norm=max_grad_norm,
+            use_hybrid_adam=use_hybrid_adam,
+        )
+
+    def init_state_params(self, p, group):
+        self.create_state_param(p, "exp_avg", ChunkType.MOMENTUM)
+        self.create_state_param(p, "exp_avg_sq", ChunkType.VARIANCE)
+
+    def update(self, data, grad, states, step, group):
+        exp_avg = states["exp_avg"]
+        exp_avg_sq = states["exp_avg_sq"]
+        beta1, beta2 = group["betas"]
+        eps = group["eps"]
+        weight_decay = group["weight_decay"]
+        lr = group["lr"]
+        max_trust_ratio = group.get("max_trust_ratio", 10.0)
+
+        if grad.is_sparse:
+            # The trust ratio needs the norm of the whole update.
+            grad = grad.to_dense()
+        # The cpu kernels of fp16 are slow, update in fp32.
+        grad = grad.float()
+        if self.combined_scale is not None:
+            grad.div_(self.combined_scale)
+
+        exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+        exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+
+        bias_correction1 = 1 - beta1 ** step
+        bias_correction2 = 1 - beta2 ** step
+        update = (exp_avg / bias_correction1).div_(
+            (exp_avg_sq / bias_correction2).sqrt_().add_(eps)
+        )
+        if weight_decay != 0:
+            update.add_(data, alpha=weight_decay)
+
+        # The norms stay on device, no synchronization in the walk.
+        weight_norm = data.norm()
+        update_norm = update.norm()
+        trust_ratio = torch.where(
+            (weight_norm > 0) & (update_norm > 0),
+            weight_norm / update_norm,
+            torch.ones_like(weight_norm),
+        ).clamp_(max=max_trust_ratio)
+
+        data.addcmul_(update, trust_ratio, value=-lr)
@@ -0,0 +1,162 @@
+# BSD 3-Clause License
+#
+# Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the psutil authors nor the names of its contributors
+#    may be used to endorse or promote products derived from this software without
+#    specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import math
+
+# The codes per octave of the log code of `quantize_blockwise_log_`, the
+# relative error of a value is at most 2 ** (1 / 16) - 1, i.e. 4.4%.
+LOG_CODES_PER_OCTAVE = 8
+
+
+def num_quant_blocks(numel, block_size):
+    r"""The number of blocks of a tensor of `numel` elements."""
+    return (numel + block_size - 1) // block_size
+
+
+def _split_blocks(flat, block_size):
+    r"""Split a flat tensor into the full blocks and the tail block."""
+    num_full = flat.numel() // block_size
+    head = flat[: num_full * block_size].view(num_full, block_size)
+    tail = flat[num_full * block_size :]
+    return head, tail
+
+
+def _mul_blocks_(flat, scale, block_size):
+    r"""Multiply every block of the flat tensor by its scale."""
+    head, tail = _split_blocks(flat, block_size)
+    num_full = head.shape[0]
+    if num_full > 0:
+        head.mul_(scale[:num_full].unsqueeze(1))
+    if tail.numel() > 0:
+        tail.mul_(scale[num_full:])
+
+
+def _scale_by_absmax_(data, absmax, block_size):
+    r"""Write the max absolute value of every block of the flat `data` to
+    `absmax` and divide the blocks by it."""
+    head, tail = _split_blocks(data, block_size)
+    num_full = head.shape[0]
+    if num_full > 0:
+        absmax[:num_full].copy_(head.abs().amax(dim=1))
+    if tail.numel() > 0:
+        absmax[num_full:].copy_(tail.abs().max())
+    # Clamp the absmax of the all zero blocks, 1 / 1e-30 does not overflow.
+    _mul_blocks_(data, 1 / absmax.clamp(min=1e-30), block_size)
+
+
+def dequantize_blockwise(quant, absmax, block_size, out):
+    r"""Dequantize the int8 `quant` with the per-block scales to fp32 `out`.
+
+    Args:
+        quant: int8 tensor.
+        absmax: fp32 tensor of `num_quant_blocks(quant.numel(), block_size)`
+            elements. The max absolute value of each block.
+        block_size: int.
+        out: fp32 tensor of the same numel as `quant`.
+    """
+    out = out.view(-1)
+    out.copy_(quant.view(-1))
+    _mul_blocks_(out, absmax / 127, block_size)
+
+
+def quantize_blockwise_(data, quant, absmax, block_size):
+    r"""Quantize the fp32 `data` to int8 `quant` with per-block scales.
+
+    Each block is scaled linearly by its max absolute value to [-127, 127].
+    `data` is used as the workspace and overwritten.
+
+    Args:
+        data: fp32 tensor.
+        quant: int8 tensor of the same numel as `data`.
+        absmax: fp32 tensor, the output per-block scales.
+        block_size: int.
+    """
+    data = data.view(-1)
+    _scale_by_absmax_(data, absmax, block_size)
+    quant.view(-1).copy_(data.mul_(127).round_().clamp_(-127, 127))
+
+
+def dequantize_blockwise_log(quant, absmax, block_size, out, signed=False):
+    r"""Dequantize the int8 `quant` of `quantize_blockwise_log_` to fp32 `out`.
+
+    Args:
+        quant: int8 tensor.
+        absmax: fp32 tensor of `num_quant_blocks(quant.numel(), block_size)`
+            elements. The max absolute value of each block.
+        block_size: int.
+        out: fp32 tensor of the same numel as `quant`.
+        signed: bool. Whether `quant` was quantized with `signed`.
+    """
+    out = out.view(-1)
+    out.copy_(quant.view(-1))
+    if signed:
+        sign = out.sign()
+        out.abs_()
+    out.sub_(127).mul_(math.log(2) / LOG_CODES_PER_OCTAVE).exp_()
+    if signed:
+        out.mul_(sign)
+    _mul_blocks_(out, absmax, block_size)
+
+
+def quantize_blockwise_log_(data, quant, absmax, block_size, signed=False):
+    r"""Quantize the fp32 `data` to int8 `quant` with a log code.
+
+    The values are coded by the log2 of their ratio to the max absolute
+    value of the block, with `LOG_CODES_PER_OCTAVE` codes per octave. So the
+    small values of a block keep the same relative precision as the large
+    ones, instead of being rounded to the fixed step of the linear code.
+
+    Without `signed`, `data` must be non-negative and the 255 codes cover
+    about 32 octaves. The values below the range, including zero, are coded
+    as the smallest value, so that no denominator is flushed to zero.
+    With `signed`, the sign takes a bit and the 127 codes of the magnitude
+    cover about 16 octaves. Zero stays zero.
+    `data` is used as the workspace and overwritten.
+
+    Args:
+        data: fp32 tensor.
+        quant: int8 tensor of the same numel as `data`.
+        absmax: fp32 tensor, the output per-block scales.
+        block_size: int.
+        signed: bool.
+    """
+    data = data.view(-1)
+    if signed:
+        sign = data.sign()
+        data.abs_()
+        min_code = 1
+    else:
+        min_code = -127
+    _scale_by_absmax_(data, absmax, block_size)
+    min_ratio = 2 ** ((min_code - 127) / LOG_CODES_PER_OCTAVE)
+    data.clamp_(min=min_ratio).log2_().mul_(LOG_CODES_PER_OCTAVE)
+    data.round_().add_(127).clamp_(min_code, 127)
+    if signed:
+        data.mul_(sign)
+    quant.view(-1).copy_(data)
@@ -27,13 +27,12 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-# Copywright DeepSpeed Team
-# DeepSpeed/deepspeed/runtime/zero/tiling.py
-# NOTE: This is not the core function of PatrickStar, we just use
-# this file for benchmarking. The code is not integrated into the wheel package.
+# Adapted from DeepSpeed/deepspeed/runtime/zero/tiling.py
+
+from math import floor
 
 import torch
-from math import floor as floor
+import torch.nn.functional as F
 
 
 def split_tensor_along_last_dim(tensor, partitions, contiguous_split_chunks=False):
@@ -44,15 +43,11 @@ def split_tensor_along_last_dim(tensor, partitions, contiguous_split_chunks=Fals
         contiguous_split_chunks: If True, make each chunk contiguous
                                  in memory.
     """
-    # Get the size and dimension.
     last_dim = tensor.dim() - 1
-
-    # Split.
     tensor_list = torch.split(tensor, partitions, dim=last_dim)
     # Note: torch.split does not create contiguous tensors by default.
     if contiguous_split_chunks:
         return tuple(chunk.contiguous() for chunk in tensor_list)
-
     return tensor_list
 
 
@@ -72,6 +67,41 @@ def partition_uniform(num_items, num_parts):
 
 
 class TiledLinear(torch.nn.Module):
+    r"""A replacement for ``torch.nn.Linear`` split into tiles.
+
+    The input and output dimensions are broken into tiles that are computed
+    in sequence. The tiles are built one after another, so their params are
+    placed in consecutive chunks, and `ps_tiles` declares the computing
+    order to the client, which prefetches the chunk of the next tile while
+    the current one is computed. So a linear layer larger than the GPU
+    budget of chunks, e.g. the vocabulary projection, is streamed tile by
+    tile. Every tile has to fit in a chunk.
+
+    Args:
+        in_features (int): See ``torch.nn.Linear``
+        out_features (int): See ``torch.nn.Linear``
+        bias (bool, optional): See ``torch.nn.Linear``
+        in_splits (int, optional): The number of tiles along the input
+            dimension. Defaults to 1.
+        out_splits (int, optional): The number of tiles along the output
+            dimension. Defaults to 1.
+        input_is_already_split (bool, optional): If set to ``True``, assume
+            that the ``input_`` to ``forward()`` is already split into
+            ``in_splits`` chunks. Defaults to ``False``.
+        combine_out_splits (bool, optional): If set to ``False``, do not
+            combine the ``out_splits`` outputs into a single tensor.
+            Defaults to ``True``.
+        linear_cls (class, optional): The underlying class to build
+            individual tiles. Defaults to ``torch.nn.Linear``.
+        init_linear (``torch.nn.Linear``, optional): If set, copy the
+            parameters of ``init_linear``. Defaults to ``None``.
+        kwargs (dict, optional): additional keyword arguments to provide
+            to ``linear_cls()``.
+    Raises:
+        RuntimeError: ``in_splits`` must be within the range [1, in_features].
+        RuntimeError: ``out_splits`` must be within the range [1, out_features].
+    """
+
     def __init__(
         self,
         in_features,
@@ -85,38 +115,6 @@ class TiledLinear(torch.nn.Module):
         init_linear=None,
         **kwargs,
     ):
-        """A replacement for ``torch.nn.Linear`` that works with ZeRO-3 to reduce
-        memory requirements via tiling.
-        TiledLinear breaks the input and output dimensions of a linear layer
-        into tiles that are processed in sequence. This class enables huge
-        linear layers when combined with ZeRO-3 because inactive tiles can be
-        partitioned and offloaded.
-        .. note::
-            We recommend using as few tiles as necessary. Tiling
-            significantly reduces memory usage, but can reduce throughput
-            for inexpensive layers. This due to the smaller kernels having
-            less parallelism and lower arithmetic intensity, while
-            introducing more frequent synchronization and communication.
-        Args:
-            in_features (int): See ``torch.nn.Linear``
-            out_features (int): See ``torch.nn.Linear``
-            bias (bool, optional): See ``torch.nn.Linear``
-            in_splits (int, optional): The number of tiles along the input dimension. Defaults to 1.
-            out_splits (int, optional): The number of tiles along the output dimension. Defaults to 1.
-            input_is_already_split (bool, optional): If set to ``True``, assume that the ``input_`` in
-                to ``forward()`` is already split into ``in_splits`` chunks. Defaults to ``False``.
-            combine_out_splits (bool, optional): If set to ``False``, do not combine the ``out_splits`` outputs
-                into a single tensor. Defaults to ``True``.
-            linear_cls (class, optional): The underlying class to build individual tiles.
-                Defaults to ``torch.nn.Linear``.
-            init_linear (``torch.nn.Linear``, optional): If set, copy the parameters of
-                ``init_linear``. Useful for debugging. Defaults to ``None``.
-            kwargs (dict, optional): additional keyword arguments to provide to ``linear_cls()``.
-        Raises:
-            RuntimeError: ``in_splits`` must be within the range [1, in_features).
-            RuntimeError: ``out_splits`` must be within the range of [1, out_features).
-        """
-
         super().__init__()
 
         if (in_splits < 1) or (in_splits > in_features):
@@ -124,7 +122,6 @@ class TiledLinear(torch.nn.Module):
         if (out_splits < 1) or (out_splits > out_features):
             raise RuntimeError("out splits must be in range [1, out_features].")
 
-        # global, not necessarily local
         self.in_features = in_features
         self.out_features = out_features
         self.use_bias = bias
@@ -134,18 +131,11 @@ class TiledLinear(torch.nn.Module):
         self.input_is_already_split = input_is_already_split
         self.combine_out_splits = combine_out_splits
 
-        # Build partition-lists. These are CSR-style splits [0, part0, part1, ..., features]
-        # For example, row_parts[p] gives the start of partition p and row_parts[p+1]
-        # is the exclusive end.
+        # CSR-style splits [0, part0, part1, ..., features], part p is
+        # [parts[p], parts[p + 1]).
         self.in_parts = partition_uniform(num_items=in_features, num_parts=in_splits)
         self.out_parts = partition_uniform(num_items=out_features, num_parts=out_splits)
 
-        assert len(self.out_parts) == out_splits + 1
-        assert len(self.in_parts) == in_splits + 1
-        assert self.out_parts[0] == 0
-        assert self.out_parts[out_splits] == out_features
-        assert self.in_parts[in_splits] == in_features
-
         self.linears = torch.nn.ModuleList()
         for out_id in range(out_splits):
             self.linears.append(torch.nn.ModuleList())
@@ -161,25 +151,20 @@ class TiledLinear(torch.nn.Module):
                 )
                 self.linears[out_id].append(local)
 
-        # Optionally initialize with a known tensor
+        # The tiles in the order of computing.
+        self.ps_tiles = [
+            self.linears[out_id][in_id]
+            for out_id in range(out_splits)
+            for in_id in range(in_splits)
+        ]
+
         if init_linear is not None:
             self.copy_params_from(init_linear)
 
     @torch.no_grad()
     def copy_params_from(self, other):
-        """Copy the weight and bias data from ``other``.
-        This is especially useful for reproducible initialization and testing.
-        Equivalent to:
-        .. code-block:: python
-            with torch.no_grad():
-                self.weight.copy_(other.weight)
-                if self.bias is not None:
-                    self.bias.copy_(other.bias)
-        .. note::
-            If ZeRO-3 is enabled, this is a collective operation and the
-            updated parameters of data-parallel rank 0 will be visible on all
-            ranks. See :class:`deepspeed.zero.GatheredParameters` for more
-            information.
+        r"""Copy the weight and bias data from ``other``.
+
         Args:
             other (``torch.nn.Linear``): the linear layer to copy from.
         """
@@ -201,8 +186,7 @@ class TiledLinear(torch.nn.Module):
                 cstop = self.in_parts[col + 1]
 
                 local = self.linears[row][col]
-                global_weight = other.weight[rstart:rstop, cstart:cstop]
-                local.weight.copy_(global_weight)
+                local.weight.copy_(other.weight[rstart:rstop, cstart:cstop])
 
             if local.bias is not None:
                 local.bias.data.copy_(other.bias[rstart:rstop].data)
@@ -213,71 +197,103 @@ class TiledLinear(torch.nn.Module):
             split_sizes = [
                 input_parts[p + 1] - input_parts[p] for p in range(self.in_splits)
             ]
-            inputs = self._split_global_input(input_, split_sizes)
+            inputs = split_tensor_along_last_dim(input_, split_sizes)
         elif self.in_splits > 1:
             inputs = input_
             assert (
                 len(inputs) == self.in_splits
             ), f"Col splits {self.in_splits} does not match input splits {len(inputs)}"
         else:
-            # no splits
             inputs = [input_]
 
         outputs = [None] * self.out_splits
         for out_id in range(self.out_splits):
             for in_id in range(self.in_splits):
                 local_output = self.linears[out_id][in_id](inputs[in_id])
-
-                outputs[out_id] = self._reduce_local_output(
-                    in_id=in_id,
-                    out_id=out_id,
-                    current_out=outputs[out_id],
-                    new_out=local_output,
-                )
+                if outputs[out_id] is None:
+                    # this clone is necessary to preserve auto grad
+                    # there is some issue with inplace update for outputs that are views
+                    outputs[out_id] = local_output.clone()
+                else:
+                    outputs[out_id] = outputs[out_id] + local_output
 
         if self.combine_out_splits:
-            return self._combine_output_splits(outputs)
-
+            return torch.cat(outputs, dim=-1)
         return outputs
 
-    def _split_global_input(self, input, split_sizes):
-        """Partition an input tensor along the last dimension, aligned with given splits.
-        Subclasses should override this method to account for new input types.
-        Args:
-            input (List[Tensor]): The tensor to partition along the last dimension.
-            split_sizes (List[int]): The size of each partition.
-        Returns:
-            List[Any]: A list of the chunks of ``input``.
-        """
-        return split_tensor_along_last_dim(input, split_sizes)
 
-    def _reduce_local_output(self, in_id, out_id, current_out, new_out):
-        """Reduce (sum) a new local result into the existing local results.
-        Subclasses should override this method.
-        For a given ``out_id``, this method is called ``in_id-1`` times. The first input
-        split is a simple assignment.
-        Args:
-            in_id (int): The input split that produced ``new_out``.
-            out_id (int): The output split that produced ``new_out``.
-            current_out (Any): The reduced form of all previous ``out_id`` results.
-            new_out (Any): The local result from forward (``in_id``, ``out_id``)e
-        Returns:
-            Any: The combined result of ``current_out`` and ``new_out``.
-        """
+class _EmbeddingTile(torch.nn.Module):
+    r"""The rows [start, end) of the weight of a `TiledEmbedding`.
 
-        if current_out is None:
-            # this clone is necessary to preserve auto grad
-            # there is some issue with inplace update for outputs that are views
-            return new_out.clone()
-        else:
-            return current_out + new_out
+    Not named Embedding, so that it is always chunk based, even with
+    the CPU embedding optimization.
+    """
+
+    def __init__(self, start, end, embedding_dim):
+        super().__init__()
+        self.start = start
+        self.end = end
+        self.weight = torch.nn.Parameter(torch.empty(end - start, embedding_dim))
+        torch.nn.init.normal_(self.weight)
+
+    def forward(self, input_):
+        mask = (input_ >= self.start) & (input_ < self.end)
+        local_input = torch.where(mask, input_ - self.start, torch.zeros_like(input_))
+        output = F.embedding(local_input, self.weight)
+        return output * mask.unsqueeze(-1).to(output.dtype)
+
+
+class TiledEmbedding(torch.nn.Module):
+    r"""A replacement for ``torch.nn.Embedding`` split into tiles of rows.
+
+    Each tile looks up the ids in its rows and the results are summed.
+    Like `TiledLinear`, the tiles are placed in consecutive chunks and
+    their order is declared to the client for prefetching, so that a
+    vocabulary larger than the GPU budget of chunks is streamed tile by
+    tile. `padding_idx`, `max_norm` and sparse grads are not supported.
+
+    Args:
+        num_embeddings (int): See ``torch.nn.Embedding``
+        embedding_dim (int): See ``torch.nn.Embedding``
+        num_splits (int, optional): The number of tiles along the vocabulary.
+            Defaults to 1.
+        init_embedding (``torch.nn.Embedding``, optional): If set, copy the
+            weight of ``init_embedding``. Defaults to ``None``.
+    """
+
+    def __init__(
+        self, num_embeddings, embedding_dim, num_splits=1, init_embedding=None
+    ):
+        super().__init__()
+        if (num_splits < 1) or (num_splits > num_embeddings):
+            raise RuntimeError("num splits must be in range [1, num_embeddings].")
+        self.num_embeddings = num_embeddings
+        self.embedding_dim = embedding_dim
+        self.num_splits = num_splits
+        self.parts = partition_uniform(num_items=num_embeddings, num_parts=num_splits)
+        self.tiles = torch.nn.ModuleList(
+            _EmbeddingTile(self.parts[i], self.parts[i + 1], embedding_dim)
+            for i in range(num_splits)
+        )
+        self.ps_tiles = list(self.tiles)
+
+        if init_embedding is not None:
+            self.copy_params_from(init_embedding)
+
+    @torch.no_grad()
+    def copy_params_from(self, other):
+        r"""Copy the weight data from ``other``.
 
-    def _combine_output_splits(self, outputs):
-        """Join the splits of the output into a single result.
         Args:
-            outputs (List[Any]): The reduced outputs for each output split.
-        Returns:
-            Any: The combined outputs.
+            other (``torch.nn.Embedding``): the embedding to copy from.
         """
-        assert len(outputs) == self.out_splits
-        return torch.cat(outputs, dim=-1)
+        assert other.weight.size() == (self.num_embeddings, self.embedding_dim)
+        for tile in self.tiles:
+            tile.weight.copy_(other.weight[tile.start : tile.end])
+
+    def forward(self, input_):
+        output = None
+        for tile in self.tiles:
+            local_output = tile(input_)
+            output = local_output if output is None else output + local_output
+        return output
@@ -53,6 +53,9 @@ class Profiler(metaclass=SingletonMeta):
         #     "type": type,
         #     "life_cycle": [(time, type, to_device)]}
         self.chunk_life_cycle = {}
+        # hybrid adam info
+        # [{"time": time, ..., "decisions": [per chunk cost and choice]}]
+        self.hybrid_adam_placement = []
 
     def start(self):
         if self.start_time is None:
@@ -82,6 +85,7 @@ class Profiler(metaclass=SingletonMeta):
             "cpu_chunk_memory_used": self.cpu_chunk_memory_used,
             "stage_convert_time": self.stage_convert_time,
             "chunk_life_cycle": self.chunk_life_cycle,
+            "hybrid_adam_placement": self.hybrid_adam_placement,
         }
 
     def save(self, filename):
@@ -31,63 +31,97 @@ import torch
 from patrickstar.core import PSPreProcessCtx, PatrickStarClient
 from patrickstar.core.memtracer import RuntimeMemTracer
 from patrickstar.utils import logger, log_dist
-from .engine import PatrickStarEngine
+from .engine import PatrickStarEngine, is_bf16_enabled
+from .inference_engine import PatrickStarInferenceEngine
+from .batch_inference import BatchInferenceRunner
 import time
 
 DEFAULT_CHUNK_SIZE = 32 * 1024 * 1024
 
 
-def initialize_engine(model_func, local_rank, config=None, client=None):
+def _init_model(model_func, local_rank, config, client, inference):
+    if isinstance(model_func, torch.nn.Module):
+        logger.debug(
+            "Passing nn.Module into initialize_engine. "
+            "Make sure you have intialized the model within PSPreProcessCtx"
+        )
+        assert client is not None, "Must pass the client when passing a nn.Module."
+        return model_func, client
+
+    assert callable(model_func), "model_func need to be callable."
+
+    if config is None:
+        default_chunk_size = DEFAULT_CHUNK_SIZE
+        release_after_init = False
+        use_cpu_embedding = True
+        sparse_embedding_grad = False
+    else:
+        default_chunk_size = config.get("default_chunk_size", DEFAULT_CHUNK_SIZE)
+        release_after_init = config.get("release_after_init", False)
+        use_cpu_embedding = config.get("use_cpu_embedding", True)
+        sparse_embedding_grad = config.get("sparse_embedding_grad", False)
+
+    client = PatrickStarClient(
+        rank=local_rank,
+        default_chunk_size=default_chunk_size,
+        config=config.get("client", None),
+        half_dtype=torch.bfloat16 if is_bf16_enabled(config) else torch.half,
+    )
+
+    start_time = time.time()
+    log_dist("begin initialize the model parameters...")
+    with PSPreProcessCtx(
+        client=client,
+        dtype=torch.float,
+        release_after_init=release_after_init,
+        use_cpu_embedding=use_cpu_embedding,
+        sparse_embedding_grad=sparse_embedding_grad,
+        inference=inference,
+    ):
+        model = model_func()
+    end_time = time.time()
+    log_dist(f"finished initialized the model parameters... {end_time  - start_time} s")
+    return model, client
+
+
+def initialize_engine(
+    model_func, local_rank, config=None, client=None, param_groups=None
+):
     """Initialize the PatrickStar Engine.
     Arguments:
         model_func: Required: nn.module class before apply any wrappers
         client: Required: PatrickStarClient for orchestrating chunks.
         config: Optional: config json for optimizer.
+        param_groups: Optional: a function taking the model and returning the
+          params or the param groups of the optimizer, e.g. to disable weight
+          decay for bias and LayerNorm. Defaults to all params of the model.
     Returns:
         A tuple of ``engine`` and ``optimizer``
         * ``engine``: PatrickStar runtime engine which wraps the client model for distributed training.
         * ``optimizer``: Wrapped optimizer if a user defined ``optimizer`` is supplied, or if
           optimizer is specified in json config else ``None``.
     """
-    if isinstance(model_func, torch.nn.Module):
-        logger.debug(
-            "Passing nn.Module into initialize_engine. "
-            "Make sure you have intialized the model within PSPreProcessCtx"
-        )
-        assert client is not None, "Must pass the client when passing a nn.Module."
-        model = model_func
-    else:
-        assert callable(model_func), "model_func need to be callable."
+    model, client = _init_model(model_func, local_rank, config, client, False)
 
-        if config is None:
-            default_chunk_size = DEFAULT_CHUNK_SIZE
-            release_after_init = False
-            use_cpu_embedding = True
-        else:
-            default_chunk_size = config.get("default_chunk_size", DEFAULT_CHUNK_SIZE)
-            release_after_init = config.get("release_after_init", False)
-            use_cpu_embedding = config.get("use_cpu_embedding", True)
+    engine = PatrickStarEngine(
+        model=model, client=client, config=config, param_groups=param_groups
+    )
+    client.start_mem_tracer()
+    return (engine, engine.optimizer)
 
-        client = PatrickStarClient(
-            rank=local_rank,
-            default_chunk_size=default_chunk_size,
-            config=config.get("client", None),
-        )
 
-        start_time = time.time()
-        log_dist("begin initialize the model parameters...")
-        with PSPreProcessCtx(
-            client=client,
-            dtype=torch.float,
-            release_after_init=release_after_init,
-            use_cpu_embedding=use_cpu_embedding,
-        ):
-            model = model_func()
-        end_time = time.time()
-        log_dist(
-            f"finished initialized the model parameters... {end_time  - start_time} s"
-        )
+def initialize_inference_engine(model_func, local_rank, config=None, client=None):
+    """Initialize the PatrickStar Engine for forward-only inference.
+    Arguments:
+        model_func: Required: nn.module class before apply any wrappers
+        client: Optional: PatrickStarClient for orchestrating chunks. Required
+          when passing a nn.Module initialized within PSPreProcessCtx(inference=True).
+        config: Optional: config json, the optimizer and fp16 fields are ignored.
+    Returns:
+        * ``engine``: PatrickStar inference engine which wraps the client model.
+    """
+    model, client = _init_model(model_func, local_rank, config, client, True)
 
-    engine = PatrickStarEngine(model=model, client=client, config=config)
+    engine = PatrickStarInferenceEngine(model=model, client=client, config=config)
     client.start_mem_tracer()
-    return (engine, engine.optimizer)
+    return engine
@@ -0,0 +1,119 @@
+# BSD 3-Clause License
+#
+# Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the psutil authors nor the names of its contributors
+#    may be used to endorse or promote products derived from this software without
+#    specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import torch
+
+from patrickstar.core import ModuleAccessPlan
+from patrickstar.core.hook import (
+    pre_sub_module_forward_function,
+    post_sub_module_forward_function,
+)
+
+
+class BatchInferenceRunner(object):
+    r"""Layer-major offline batch inference over a chunk-managed model.
+
+    The batches are queued into waves of `num_micro_batches`. Within a
+    wave, the chunks of a layer are fetched once, the layer is applied to
+    every micro-batch of the wave and then the chunks are released, so
+    each chunk crosses PCIe (or the network) once per wave instead of once
+    per batch.
+
+    The activations of a whole wave stay on the compute device, so
+    `num_micro_batches` trades activation memory for chunk traffic.
+
+    Args:
+        engine: :class:`PatrickStarInferenceEngine`.
+        num_micro_batches: int, the number of batches in a wave.
+        layers: list of :class:`torch.nn.Module`, the layers applied in
+            order to each batch. Default to the children of the model,
+            which must be a :class:`torch.nn.Sequential`.
+    """
+
+    def __init__(self, engine, num_micro_batches=8, layers=None):
+        assert num_micro_batches > 0, "num_micro_batches must be positive."
+        if layers is None:
+            if not isinstance(engine.module, torch.nn.Sequential):
+                raise ValueError(
+                    "Must pass the layers when the model is not a nn.Sequential."
+                )
+            layers = list(engine.module.children())
+        self.engine = engine
+        self.client = engine.client
+        self.layers = layers
+        self.num_micro_batches = num_micro_batches
+        # The (name, module, plan) of the modules owning chunk based params,
+        # for each layer.
+        self.layer_plans = []
+        for layer in layers:
+            module_plans = []
+            for name, module in layer.named_modules():
+                plan = ModuleAccessPlan(module, self.client)
+                if len(plan) > 0:
+                    module_plans.append((name, module, plan))
+            self.layer_plans.append(module_plans)
+
+    def run(self, batches):
+        r"""Run inference over `batches` and yield the output of each batch.
+
+        Args:
+            batches: an iterable of inputs of the first layer.
+        Yields:
+            The outputs, in the order of `batches`.
+        """
+        wave = []
+        for batch in batches:
+            wave.append(batch)
+            if len(wave) == self.num_micro_batches:
+                yield from self._run_wave(wave)
+                wave = []
+        if len(wave) > 0:
+            yield from self._run_wave(wave)
+
+    @torch.no_grad()
+    def _run_wave(self, wave):
+        engine = self.engine
+        client = self.client
+        engine._begin_forward()
+        # The runner accesses and releases the params layer by layer,
+        # the module hooks would otherwise do it once per micro-batch.
+        client.hooks_paused = True
+        try:
+            activations = wave
+            for layer, module_plans in zip(self.layers, self.layer_plans):
+                for name, module, plan in module_plans:
+                    pre_sub_module_forward_function(module, client, name, plan)
+                    client.prefetch_next_chunk(plan)
+                activations = [layer(activation) for activation in activations]
+                for name, module, plan in module_plans:
+                    post_sub_module_forward_function(module, client, name, plan)
+        finally:
+            client.hooks_paused = False
+        engine._end_forward()
+        return activations
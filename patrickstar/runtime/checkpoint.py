@@ -46,7 +46,10 @@ def state_dict(module, client, destination=None, prefix="", keep_vars=False):
                         continue
                     elif param.ps_attr.is_local():
                         if param.ps_attr.param_type == ParamType.CHUNK_BASED:
-                            param_fp32 = client.param_fp16_to_param_fp32_map[param]
+                            # There is no fp32 param in inference mode.
+                            param_fp32 = client.param_fp16_to_param_fp32_map.get(
+                                param, param
+                            )
                             ps_data_fp32 = client.access_data(
                                 param_fp32, torch.device("cpu:0")
                             )
@@ -129,10 +132,16 @@ def _load_from_state_dict(
                 and param.ps_attr.param_type == ParamType.CHUNK_BASED
             ):
                 if param.ps_attr.is_local():
-                    param_fp32 = client.param_fp16_to_param_fp32_map[param]
                     ps_data_fp16 = client.access_data(param, torch.device("cpu:0"))
-                    ps_data_fp32 = client.access_data(param_fp32, torch.device("cpu:0"))
-                    assert ps_data_fp16.shape == ps_data_fp32.shape
+                    # There is no fp32 param in inference mode.
+                    param_fp32 = client.param_fp16_to_param_fp32_map.get(param, None)
+                    if param_fp32 is not None:
+                        ps_data_fp32 = client.access_data(
+                            param_fp32, torch.device("cpu:0")
+                        )
+                        assert ps_data_fp16.shape == ps_data_fp32.shape
+                    else:
+                        ps_data_fp32 = None
 
                     if input_param.shape != ps_data_fp16.shape:
                         # local shape should match the one in checkpoint
@@ -146,7 +155,8 @@ def _load_from_state_dict(
                     try:
                         with torch.no_grad():
                             ps_data_fp16.copy_(input_param)
-                            ps_data_fp32.copy_(input_param)
+                            if ps_data_fp32 is not None:
+                                ps_data_fp32.copy_(input_param)
                     except MemoryError as ex:
                         error_msgs.append(
                             'While copying the parameter named "{}", '
@@ -31,7 +31,7 @@ import torch
 
 from patrickstar.core import ChunkState, TensorState, TrainingStage, ParamType
 from patrickstar.fp16 import LossScaler, DynamicLossScaler
-from patrickstar.ops import FP16Adam
+from patrickstar.ops import FP16Adam, FP16Lamb, FP16Adafactor
 from patrickstar.utils import log_dist, global_timer
 
 from .checkpoint import state_dict, load_state_dict
@@ -39,44 +39,94 @@ from patrickstar.profiler import profiler
 import time
 
 
+def is_bf16_enabled(config):
+    r"""Whether the config enables bf16 training."""
+    return config is not None and config.get("bf16", {}).get("enabled", False)
+
+
+def move_torch_parts_to_device(model, device):
+    r"""Move the buffers and the torch based params to the compute device."""
+    # TODO(zilinzhu) Currently we move all buffers to GPU as the buffer size is
+    # relatively small. Maybe find a better way to deal with them.
+    for buffer in model.buffers():
+        buffer.data = buffer.data.to(device)
+
+    def move_param_to_gpu(module):
+        if module.__class__.__name__ == "Embedding":
+            return
+        for param in module.parameters(recurse=False):
+            if param.ps_attr.param_type == ParamType.TORCH_BASED:
+                param.data = param.data.to(device)
+        for submodule in module.children():
+            move_param_to_gpu(submodule)
+
+    move_param_to_gpu(model)
+
+
 class PatrickStarEngine(torch.nn.Module):
     r"""patrickStar engine for training."""
 
-    def __init__(self, model, client, config):
+    def __init__(self, model, client, config, param_groups=None):
         super(PatrickStarEngine, self).__init__()
         self.module = model
         self.module.train()
 
         self.client = client
 
-        # default parameter for adam.
-        default_optim_config = {
-            "type": "Adam",
-            "params": {
+        # default parameters of the optimizers.
+        adam_params = {
+            "lr": 0.01,
+            "betas": (0.9, 0.999),
+            "eps": 1e-8,
+            "weight_decay": 0,
+            "use_hybrid_adam": True,
+            "use_8bit_states": False,
+            "state_block_size": 2048,
+            "use_foreach_adam": False,
+        }
+        default_optim_params = {
+            "Adam": adam_params,
+            "AdamW": adam_params,
+            "Lamb": {
                 "lr": 0.01,
                 "betas": (0.9, 0.999),
-                "eps": 1e-8,
+                "eps": 1e-6,
                 "weight_decay": 0,
+                "max_trust_ratio": 10.0,
                 "use_hybrid_adam": True,
             },
+            "Adafactor": {
+                "lr": None,
+                "eps": (1e-30, 1e-3),
+                "clip_threshold": 1.0,
+                "decay_rate": -0.8,
+                "beta1": None,
+                "weight_decay": 0,
+                "scale_parameter": True,
+            },
         }
 
         if config is not None:
             # Optimizer configuration
-            optim_config = config.get("optimizer", default_optim_config)
-            optim_type = optim_config.get("type", default_optim_config["type"])
-            if optim_type not in ["Adam", "AdamW"]:
+            optim_config = config.get("optimizer", {})
+            optim_type = optim_config.get("type", "Adam")
+            if optim_type not in default_optim_params:
                 raise ValueError(
-                    f"Only support Adam and AdamW at the moment. "
+                    f"Only support {list(default_optim_params.keys())} at the moment. "
                     f"Get optimizer type {optim_type}"
                 )
-            optim_params = optim_config.get("params", default_optim_config["params"])
-            for key, val in default_optim_config["params"].items():
+            optim_params = optim_config.get("params", {})
+            for key, val in default_optim_params[optim_type].items():
                 if key not in optim_params:
                     optim_params[key] = val
 
             # Loss scaler configuration
-            if "fp16" not in config:
+            if is_bf16_enabled(config):
+                # bf16 has the exponent range of fp32, no loss scaling.
+                if "fp16" in config and config["fp16"].get("enabled", False):
+                    raise ValueError("fp16 and bf16 can not be enabled together.")
+                self.loss_scaler = None
+            elif "fp16" not in config:
                 self.loss_scaler = None
             else:
                 loss_scale_config = config["fp16"]
@@ -103,50 +153,101 @@ class PatrickStarEngine(torch.nn.Module):
                 self.gradient_clipping = -1
             else:
                 self.gradient_clipping = config["gradient_clipping"]
+            # Clip the grads by their global L2 norm, disabled if not positive.
+            self.max_grad_norm = config.get("max_grad_norm", -1)
+
+            self.gradient_accumulation_steps = config.get(
+                "gradient_accumulation_steps", 1
+            )
+            if self.gradient_accumulation_steps < 1:
+                raise ValueError(
+                    f"Invalid gradient_accumulation_steps: "
+                    f"{self.gradient_accumulation_steps}"
+                )
         else:
-            optim_type = default_optim_config["type"]
-            optim_params = default_optim_config["params"]
+            optim_type = "Adam"
+            optim_params = dict(default_optim_params[optim_type])
             self.loss_scaler = None
             self.gradient_clipping = -1
+            self.max_grad_norm = -1
+            self.gradient_accumulation_steps = 1
+
+        half_dtype = torch.bfloat16 if is_bf16_enabled(config) else torch.half
+        if client.half_dtype != half_dtype:
+            raise ValueError(
+                f"The client is created with half_dtype {client.half_dtype}, "
+                f"while the config requires {half_dtype}."
+            )
 
         # This need to be placed before the initialization of optimizer.
         self._move_torch_parts_to_gpu(model)
 
-        self.optimizer = FP16Adam(
-            self.client,
-            self.module.parameters(),
-            loss_scaler=self.loss_scaler,
-            gradient_clipping=self.gradient_clipping,
-            lr=optim_params["lr"],
-            betas=optim_params["betas"],
-            eps=optim_params["eps"],
-            weight_decay=optim_params["weight_decay"],
-            use_adamw=(optim_type == "AdamW"),
-            use_hybrid_adam=optim_params["use_hybrid_adam"],
-        )
+        if param_groups is None:
+            params = self.module.parameters()
+        else:
+            params = param_groups(self.module)
+        self.optimizer = self._create_optimizer(params, optim_type, optim_params)
 
         self.client.init(self.module, self.optimizer)
+        # The number of optimizer steps, the warmup covers the whole first
+        # gradient accumulation cycle.
         self.iteration_cnt_ = 0
+        self.micro_step_cnt_ = 0
         # TODO(jiaruifang) pass in via config.
         self.warmup_times = 1
         log_dist("PatrickStarEngine initialized.")
 
+    def _create_optimizer(self, params, optim_type, optim_params):
+        r"""Create the chunk based optimizer of `optim_type`."""
+        if optim_type in ["Adam", "AdamW"]:
+            return FP16Adam(
+                self.client,
+                params,
+                loss_scaler=self.loss_scaler,
+                gradient_clipping=self.gradient_clipping,
+                max_grad_norm=self.max_grad_norm,
+                lr=optim_params["lr"],
+                betas=optim_params["betas"],
+                eps=optim_params["eps"],
+                weight_decay=optim_params["weight_decay"],
+                use_adamw=(optim_type == "AdamW"),
+                use_hybrid_adam=optim_params["use_hybrid_adam"],
+                use_8bit_states=optim_params["use_8bit_states"],
+                state_block_size=optim_params["state_block_size"],
+                use_foreach_adam=optim_params["use_foreach_adam"],
+            )
+        elif optim_type == "Lamb":
+            return FP16Lamb(
+                self.client,
+                params,
+                loss_scaler=self.loss_scaler,
+                gradient_clipping=self.gradient_clipping,
+                max_grad_norm=self.max_grad_norm,
+                lr=optim_params["lr"],
+                betas=optim_params["betas"],
+                eps=optim_params["eps"],
+                weight_decay=optim_params["weight_decay"],
+                max_trust_ratio=optim_params["max_trust_ratio"],
+                use_hybrid_adam=optim_params["use_hybrid_adam"],
+            )
+        else:
+            return FP16Adafactor(
+                self.client,
+                params,
+                loss_scaler=self.loss_scaler,
+                gradient_clipping=self.gradient_clipping,
+                max_grad_norm=self.max_grad_norm,
+                lr=optim_params["lr"],
+                eps=optim_params["eps"],
+                clip_threshold=optim_params["clip_threshold"],
+                decay_rate=optim_params["decay_rate"],
+                beta1=optim_params["beta1"],
+                weight_decay=optim_params["weight_decay"],
+                scale_parameter=optim_params["scale_parameter"],
+            )
+
     def _move_torch_parts_to_gpu(self, model):
-        # TODO(zilinzhu) Currently we move all buffers to GPU as the buffer size is
-        # relatively small. Maybe find a better way to deal with them.
-        for buffer in model.buffers():
-            buffer.data = buffer.data.to(self.client.device)
-
-        def move_param_to_gpu(module):
-            if module.__class__.__name__ == "Embedding":
-                return
-            for param in module.parameters(recurse=False):
-                if param.ps_attr.param_type == ParamType.TORCH_BASED:
-                    param.data = param.data.to(self.client.device)
-            for submodule in module.children():
-                move_param_to_gpu(submodule)
-
-        move_param_to_gpu(model)
+        move_torch_parts_to_device(model, self.client.device)
 
     def _reset_before_forward(self):
         # TODO(jiaruifang) so difficult to understand.
@@ -155,9 +256,8 @@ class PatrickStarEngine(torch.nn.Module):
         self.client.mem_tracer.metronome.reset()
         for param_fp16 in self.client.chunk_based_param_fp16:
             param_fp16.ps_attr.fwd_used_cnt = 0
-        for _, chunk in self.client.chunk_list.generate_chunk():
-            chunk.unused = 0
 
+        self.client.activation_store.reset()
         self.client.reset_visited_chunk()
 
     def _set_state_after_forward(self):
@@ -165,14 +265,23 @@ class PatrickStarEngine(torch.nn.Module):
         After forward calculation, we need to reset the state of
         tensors from HOLD_AFTER_FWD to HOLD. Otherwise, chunks may be
         released accidentally when using gradient checkpointing.
+
+        Only the chunks whose tensor states changed since the last forward
+        are visited, the others keep their states and unused counts.
         """
-        for chunk_id, chunk in self.client.chunk_list.generate_chunk():
+        chunk_list = self.client.chunk_list
+        for chunk_id in chunk_list.dirty_chunk_ids:
+            chunk = chunk_list[chunk_id]
+            chunk_state = chunk.get_state()
             if (
-                chunk.get_state() == ChunkState.HOLD
-                or chunk.get_state() == ChunkState.HOLD_AFTER_FWD
+                chunk_state == ChunkState.HOLD
+                or chunk_state == ChunkState.HOLD_AFTER_FWD
             ):
                 chunk.set_unused()
                 self.client.set_all_tensors_state_in_chunk(chunk_id, TensorState.HOLD)
+            else:
+                chunk.unused = 0
+        chunk_list.clear_dirty_chunk_ids()
 
     def forward(self, *inputs, **kwargs):
         r"""Execute forward propagation
@@ -184,7 +293,7 @@ class PatrickStarEngine(torch.nn.Module):
         # Considering the grad overflow situation.
         if self.iteration_cnt_ == 0:
             self.client.set_warmup(True)
-        if self.iteration_cnt_ == self.warmup_times:
+        if self.iteration_cnt_ == self.warmup_times and self.client.is_warmup():
             self.client.set_warmup(False)
             self.client.mem_tracer.close_tracer()
 
@@ -214,15 +323,32 @@ class PatrickStarEngine(torch.nn.Module):
         for param_fp16 in self.client.chunk_based_param_fp16:
             param_fp16.ps_attr.bwd_used_cnt = 0
 
-        self.optimizer.zero_grad()
+        is_boundary = self.is_gradient_accumulation_boundary()
+        self.client.accumulate_grads = not is_boundary
+        # The torch based params accumulate their grads in `param.grad`,
+        # only clear them at the first micro-batch.
+        if self.micro_step_cnt_ % self.gradient_accumulation_steps == 0:
+            self.optimizer.zero_grad()
+        if self.gradient_accumulation_steps > 1:
+            loss = loss / self.gradient_accumulation_steps
         if self.loss_scaler:
             self.loss_scaler.backward(loss)
         else:
             loss.backward()
+        if not is_boundary:
+            self.optimizer.release_computing_params()
         self.client.mem_tracer.update_margin_mem()
-        self.iteration_cnt_ += 1
+        self.micro_step_cnt_ += 1
+        if is_boundary:
+            self.iteration_cnt_ += 1
         global_timer.my_timer.finish_profile("BWD")
 
+    def is_gradient_accumulation_boundary(self):
+        r"""Whether the next backward is the last micro-batch of the
+        gradient accumulation, after which the optimizer updates the params.
+        """
+        return (self.micro_step_cnt_ + 1) % self.gradient_accumulation_steps == 0
+
     def state_dict(self, destination=None, prefix="", keep_vars=False):
         return state_dict(
             self.module,
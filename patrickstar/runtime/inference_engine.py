@@ -0,0 +1,126 @@
+# BSD 3-Clause License
+#
+# Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the psutil authors nor the names of its contributors
+#    may be used to endorse or promote products derived from this software without
+#    specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import torch
+
+from patrickstar.core import ChunkState, TensorState, TrainingStage
+from patrickstar.utils import log_dist, global_timer
+
+from .checkpoint import state_dict, load_state_dict
+from .engine import move_torch_parts_to_device
+
+
+class PatrickStarInferenceEngine(torch.nn.Module):
+    r"""PatrickStar engine for forward-only inference.
+
+    Only the param fp16 chunks are managed and only the forward hooks are
+    registered, so no fp32 params or optimizer states are allocated.
+    The chunks are fetched layer by layer, the next chunk in the forward
+    order is prefetched and the used chunks are left in a state that
+    can be evicted.
+    """
+
+    def __init__(self, model, client, config=None):
+        super(PatrickStarInferenceEngine, self).__init__()
+        self.module = model
+        self.module.eval()
+
+        self.client = client
+
+        move_torch_parts_to_device(model, self.client.device)
+
+        self.client.init(self.module, None, inference=True)
+        self.iteration_cnt_ = 0
+        self.warmup_times = 1
+        log_dist("PatrickStarInferenceEngine initialized.")
+
+    def _reset_before_forward(self):
+        self.client.mem_tracer.reset_memory_stats()
+        self.client.mem_tracer.metronome.reset()
+        for param_fp16 in self.client.chunk_based_param_fp16:
+            param_fp16.ps_attr.fwd_used_cnt = 0
+
+        self.client.reset_visited_chunk()
+
+    def _set_state_after_forward(self):
+        r"""Reset the tensors of the visited chunks to HOLD for the next forward."""
+        chunk_list = self.client.chunk_list
+        for chunk_id in chunk_list.dirty_chunk_ids:
+            chunk_state = chunk_list[chunk_id].get_state()
+            if (
+                chunk_state == ChunkState.HOLD
+                or chunk_state == ChunkState.HOLD_AFTER_FWD
+            ):
+                self.client.set_all_tensors_state_in_chunk(chunk_id, TensorState.HOLD)
+        chunk_list.clear_dirty_chunk_ids()
+
+    def _begin_forward(self):
+        if self.iteration_cnt_ == 0:
+            self.client.set_warmup(True)
+        if self.iteration_cnt_ == self.warmup_times:
+            self.client.set_warmup(False)
+            self.client.mem_tracer.close_tracer()
+
+        global_timer.my_timer.start_profile("FWD")
+        self.client.set_training_phase(TrainingStage.FWD)
+        self._reset_before_forward()
+
+    def _end_forward(self):
+        self._set_state_after_forward()
+        self.client.reset_visited_chunk()
+        if self.client.is_warmup():
+            self.client.mem_tracer.update_margin_mem()
+        self.iteration_cnt_ += 1
+        global_timer.my_timer.finish_profile("FWD")
+
+    @torch.no_grad()
+    def forward(self, *inputs, **kwargs):
+        r"""Execute forward propagation without autograd.
+
+        The first `warmup_times` calls are used to trace the memory usage
+        and the visiting order of the chunks.
+        """
+        self._begin_forward()
+        output = self.module(*inputs, **kwargs)
+        self._end_forward()
+        return output
+
+    def state_dict(self, destination=None, prefix="", keep_vars=False):
+        return state_dict(
+            self.module,
+            self.client,
+            destination=destination,
+            prefix=prefix,
+            keep_vars=keep_vars,
+        )
+
+    def load_state_dict(self, state_dict, strict=False):
+        return load_state_dict(
+            self.module, self.client, state_dict=state_dict, strict=strict
+        )
@@ -27,7 +27,17 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from .distributed import get_world_size, get_rank, get_local_world_size
+from .distributed import (
+    get_world_size,
+    get_rank,
+    get_local_world_size,
+    get_replication_factor,
+    get_shard_rank,
+    get_shard_world_size,
+    set_replication_factor,
+    sparse_allreduce,
+)
+from .cpu_affinity import bind_cpu_affinity, format_cpulist, plan_cpu_affinity
 from .helper import getsizeof, get_space_of
 from .logging import log_dist, logger, print_rank
 from .memory import get_memory_info
@@ -0,0 +1,203 @@
+# BSD 3-Clause License
+#
+# Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the psutil authors nor the names of its contributors
+#    may be used to endorse or promote products derived from this software without
+#    specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import ctypes
+import glob
+import os
+
+import torch
+
+from .distributed import get_local_world_size
+
+
+def _read_sysfs(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def parse_cpulist(cpulist):
+    r"""Parse the cpulist format of sysfs, e.g. "0-3,8-11"."""
+    cpus = []
+    for part in cpulist.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def format_cpulist(cpus):
+    r"""The inverse of `parse_cpulist`."""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(
+        str(start) if start == end else f"{start}-{end}" for start, end in ranges
+    )
+
+
+def get_numa_nodes():
+    r"""NUMA node id -> the CPUs of the node the process may run on."""
+    allowed = os.sched_getaffinity(0)
+    nodes = {}
+    for path in glob.glob("/sys/devices/system/node/node[0-9]*"):
+        cpulist = _read_sysfs(os.path.join(path, "cpulist"))
+        if cpulist is None:
+            continue
+        cpus = [cpu for cpu in parse_cpulist(cpulist) if cpu in allowed]
+        if cpus:
+            nodes[int(os.path.basename(path)[len("node") :])] = cpus
+    if not nodes:
+        # No NUMA info, e.g. not Linux or a single node machine.
+        nodes[0] = sorted(allowed)
+    return nodes
+
+
+def get_gpu_numa_node(device_id):
+    r"""The NUMA node of the GPU read from its PCI address, None if unknown."""
+    props = torch.cuda.get_device_properties(device_id)
+    if not hasattr(props, "pci_bus_id"):
+        return None
+    bus_id = (
+        f"{props.pci_domain_id:04x}:{props.pci_bus_id:02x}:{props.pci_device_id:02x}.0"
+    )
+    node = _read_sysfs(f"/sys/bus/pci/devices/{bus_id}/numa_node")
+    if node is None or int(node) < 0:
+        return None
+    return int(node)
+
+
+def _physical_cores(cpus):
+    r"""Group the CPUs by physical core, the hyperthreads of a core together."""
+    cores = {}
+    for cpu in cpus:
+        siblings = _read_sysfs(
+            f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list"
+        )
+        core_id = min(parse_cpulist(siblings)) if siblings else cpu
+        cores.setdefault(core_id, []).append(cpu)
+    return [cores[core_id] for core_id in sorted(cores)]
+
+
+def plan_cpu_affinity(local_rank, local_world_size=None):
+    r"""Decide the NUMA node and the CPUs of a local rank.
+
+    Every local rank is placed on the NUMA node of its GPU. If that is
+    unknown for some local GPU, the ranks are spread over the nodes in
+    order, which matches the usual numbering of GPUs by socket. The
+    physical cores of a node are split evenly among the ranks on it, so
+    that the CPU Adam and the copies of different ranks do not compete for
+    the same cores.
+
+    Args:
+        local_rank: `int`. The rank in the node, also the GPU index.
+        local_world_size: `int`. Defaults to `get_local_world_size()`.
+    Returns:
+        dict with the "numa_node", whether it is read from the GPU in
+        "gpu_numa_known", the "cpus" to run on and the "num_threads".
+    """
+    if local_world_size is None:
+        local_world_size = get_local_world_size()
+    nodes = get_numa_nodes()
+    node_ids = sorted(nodes)
+
+    gpu_nodes = None
+    if torch.cuda.is_available() and torch.cuda.device_count() >= local_world_size:
+        gpu_nodes = [get_gpu_numa_node(rank) for rank in range(local_world_size)]
+    gpu_numa_known = gpu_nodes is not None and all(node in nodes for node in gpu_nodes)
+    if not gpu_numa_known:
+        gpu_nodes = [
+            node_ids[rank * len(node_ids) // local_world_size]
+            for rank in range(local_world_size)
+        ]
+    numa_node = gpu_nodes[local_rank]
+
+    ranks_on_node = [
+        rank for rank in range(local_world_size) if gpu_nodes[rank] == numa_node
+    ]
+    index = ranks_on_node.index(local_rank)
+    num_ranks = len(ranks_on_node)
+    cores = _physical_cores(nodes[numa_node])
+    if len(cores) >= num_ranks:
+        rank_cores = cores[
+            index * len(cores) // num_ranks : (index + 1) * len(cores) // num_ranks
+        ]
+    else:
+        # More ranks than cores, the ranks have to share.
+        rank_cores = [cores[index % len(cores)]]
+    return {
+        "numa_node": numa_node,
+        "gpu_numa_known": gpu_numa_known,
+        "cpus": sorted(cpu for core in rank_cores for cpu in core),
+        # One thread per physical core, the AVX units are per core.
+        "num_threads": len(rank_cores),
+    }
+
+
+def _set_preferred_numa_node(numa_node):
+    r"""Prefer allocating the memory on `numa_node` with libnuma.
+
+    Returns False if libnuma is not available, then the memory is placed
+    on the node of the CPU touching it first, which is the bound node.
+    """
+    try:
+        libnuma = ctypes.CDLL("libnuma.so.1")
+    except OSError:
+        return False
+    if libnuma.numa_available() < 0:
+        return False
+    libnuma.numa_set_preferred(numa_node)
+    return True
+
+
+def bind_cpu_affinity(layout):
+    r"""Bind the process to the CPUs and the NUMA node of `layout`.
+
+    Should be called before the chunks are allocated and the C++ CPU Adam
+    is loaded, so that the pinned and pageable CPU chunks land on the node
+    and the OpenMP threads of Adam are sized to the bound cores.
+
+    Args:
+        layout: dict returned by `plan_cpu_affinity`. "numa_memory" is set
+            to whether the memory policy is set with libnuma.
+    """
+    os.sched_setaffinity(0, layout["cpus"])
+    os.environ["OMP_NUM_THREADS"] = str(layout["num_threads"])
+    torch.set_num_threads(layout["num_threads"])
+    layout["numa_memory"] = _set_preferred_numa_node(layout["numa_node"])
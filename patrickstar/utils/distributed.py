@@ -44,6 +44,40 @@ def get_world_size():
     return 1
 
 
+# The number of replicas of the param chunks in hybrid sharding.
+# The chunks are sharded over `get_world_size() // _replication_factor`
+# processes and replicated across the shard groups.
+_replication_factor = 1
+
+
+def set_replication_factor(replication_factor):
+    global _replication_factor
+    world_size = get_world_size()
+    if replication_factor < 1 or world_size % replication_factor != 0:
+        raise ValueError(
+            f"replication_factor {replication_factor} should be a positive "
+            f"divisor of world size {world_size}"
+        )
+    _replication_factor = replication_factor
+
+
+def get_replication_factor():
+    return _replication_factor
+
+
+def get_shard_world_size():
+    r"""The number of processes in a shard group."""
+    return get_world_size() // _replication_factor
+
+
+def get_shard_rank():
+    r"""The rank of the process in its shard group.
+
+    Shard groups are consecutive ranks, so that a shard group could be a node.
+    """
+    return get_rank() % get_shard_world_size()
+
+
 # Use global variable to prevent changing of the environment variable
 # and to make sure the warning is only logged once.
 _local_world_size = None
@@ -65,3 +99,51 @@ def get_local_world_size():
         else:
             _local_world_size = 1
     return _local_world_size
+
+
+def sparse_allreduce(tensor, group=None):
+    r"""Average a sparse COO tensor across processes.
+
+    Instead of reducing the dense tensor, every process allgathers the
+    coalesced indices and values it holds, so the communication volume is
+    proportional to the number of non-zero rows.
+    Args:
+        tensor: :class:`torch.Tensor` with sparse COO layout.
+        group: the process group, e.g. the gloo group for CPU tensors.
+    Returns:
+        The coalesced sparse tensor averaged over all processes.
+    """
+    assert tensor.is_sparse, "sparse_allreduce only accepts sparse COO tensors"
+    world_size = torch.distributed.get_world_size(group=group)
+    tensor = tensor.coalesce()
+    if world_size == 1:
+        return tensor
+    indices = tensor._indices()
+    values = tensor._values()
+
+    # The collectives require tensors of the same shape on every process,
+    # so gather the nnz first and pad to the maximum.
+    nnz = torch.tensor([indices.size(1)], dtype=torch.long)
+    nnz_list = [torch.zeros_like(nnz) for _ in range(world_size)]
+    torch.distributed.all_gather(nnz_list, nnz, group=group)
+    nnz_list = [int(n) for n in nnz_list]
+    max_nnz = max(nnz_list)
+
+    padded_indices = indices.new_zeros((indices.size(0), max_nnz))
+    padded_indices[:, : indices.size(1)] = indices
+    padded_values = values.new_zeros((max_nnz,) + values.shape[1:])
+    padded_values[: values.size(0)] = values
+
+    indices_list = [torch.empty_like(padded_indices) for _ in range(world_size)]
+    values_list = [torch.empty_like(padded_values) for _ in range(world_size)]
+    torch.distributed.all_gather(indices_list, padded_indices, group=group)
+    torch.distributed.all_gather(values_list, padded_values, group=group)
+
+    all_indices = torch.cat(
+        [idx[:, :n] for idx, n in zip(indices_list, nnz_list)], dim=1
+    )
+    all_values = torch.cat([val[:n] for val, n in zip(values_list, nnz_list)])
+    result = torch.sparse_coo_tensor(
+        all_indices, all_values, tensor.shape, dtype=tensor.dtype
+    ).coalesce()
+    return result / world_size
@@ -58,7 +58,8 @@ class GlobalTimer(metaclass=SingletonMeta):
     def finish_profile(self, key):
         if not self.start_flag:
             return
-        torch.cuda.current_stream().synchronize()
+        if torch.cuda.is_available():
+            torch.cuda.current_stream().synchronize()
         if key in self.elapse_stat:
             self.elapse_stat[key] += time.time() - self.start_time[key]
         else:
@@ -43,7 +43,7 @@ def get_real_data_tensor(param):
 def getsizeof(data_type: torch.dtype):
     if data_type == torch.float:
         return 4
-    elif data_type == torch.half:
+    elif data_type == torch.half or data_type == torch.bfloat16:
         return 2
     elif data_type == torch.int8:
         return 1
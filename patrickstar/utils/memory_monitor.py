@@ -42,6 +42,8 @@ def get_sys_memory_used(device):
     where N is the world size.
     """
     if device.type == "cuda":
+        if not torch.cuda.is_available():
+            return 0
         ret = torch.cuda.memory_allocated()
         # get the peak memory to report correct data, so reset the counter for the next call
         if hasattr(torch.cuda, "reset_peak_memory_stats"):  # pytorch 1.4+
@@ -52,7 +52,6 @@ class TestChunkData(unittest.TestCase):
             chunk_id=0,
             chunk_size=20,
             data_type=torch.float,
-            is_dummy=False,
             chunk_type=ChunkType.PARAM_FP32,
         )
 
@@ -74,7 +73,6 @@ class TestChunkData(unittest.TestCase):
             chunk_id=new_chunk_id,
             chunk_size=20,
             data_type=torch.float,
-            is_dummy=False,
             chunk_type=ChunkType.PARAM_FP32,
         )
         chunk_list.access_chunk(new_chunk_id, compute_device)
@@ -91,7 +89,6 @@ class TestChunkData(unittest.TestCase):
             chunk_id=1,
             chunk_size=20,
             data_type=torch.float,
-            is_dummy=False,
             chunk_type=ChunkType.PARAM_FP32,
         )
 
@@ -34,8 +34,19 @@ import torch
 
 from common import distributed_test
 from patrickstar import RuntimeMemTracer
-from patrickstar.core import PatrickStarClient, AccessType, register_param, ChunkType
+from patrickstar.core import (
+    PatrickStarClient,
+    AccessType,
+    register_param,
+    ChunkState,
+    ChunkType,
+    TensorState,
+    TrainingStage,
+)
+from patrickstar.core.access_plan import ModuleAccessPlan
+from patrickstar.core.activation import ActivationStore, checkpoint
 from patrickstar.core.parameter import ParamType
+from patrickstar.utils import get_rank
 
 
 class TestClientAccess(unittest.TestCase):
@@ -108,6 +119,420 @@ class TestClientAccess(unittest.TestCase):
             self.assertEqual(torch.max(real_payload - payload_ref), 0)
             self.client.release_data(param)
 
+    @distributed_test(world_size=[1])
+    def test_msc_max_inflight(self):
+        config = {
+            "mem_tracer": {},
+            "opts": {
+                "with_mem_saving_comm": True,
+                "msc_max_inflight": 4,
+                # Budget for 2 fp16 chunks.
+                "msc_inflight_mem_budget": 2 * self.default_chunk_size * 2,
+            },
+        }
+        client = PatrickStarClient(
+            rank=0, default_chunk_size=self.default_chunk_size, config=config
+        )
+        self.assertEqual(client.msc_max_inflight, 2)
+        self.assertEqual(client.mem_tracer.msc_max_inflight, 2)
+        # Options not in config fall back to default.
+        self.assertFalse(client.opt_config["with_mem_cache"])
+
+    def _run_msc_fwd_bwd(self, msc_max_inflight):
+        r"""Run FWD and BWD with the memory saving comm on CPU.
+
+        Returns:
+            The params seen in FWD, the reduced grads of the local params
+            and the max number of chunks prefetched during FWD and BWD.
+        """
+        rank = get_rank()
+        config = {
+            "compute_device": "cpu",
+            "mem_tracer": {"use_async_mem_monitor": False},
+            "opts": {
+                "with_mem_saving_comm": True,
+                "msc_max_inflight": msc_max_inflight,
+            },
+        }
+        client = PatrickStarClient(rank, self.default_chunk_size, config=config)
+        client.set_warmup(True)
+
+        # One param per chunk, 3 comm groups for 2 processes.
+        param_list = []
+        for i in range(6):
+            param = torch.nn.Parameter(torch.zeros(self.default_chunk_size))
+            register_param(param, ParamType.CHUNK_BASED, torch.half, f"param_{i}")
+            client.append_tensor(
+                [param], torch.half, AccessType.DATA, ChunkType.PARAM_FP16
+            )
+            param_list.append(param)
+        offsets = torch.arange(self.default_chunk_size, dtype=torch.half) / 4
+        for i, param in enumerate(param_list):
+            if client.is_local_param(param, AccessType.DATA):
+                client.access_data(param, client.device).copy_(offsets + i + 1)
+                client.release_data(param)
+
+        max_prefetched = 0
+        fwd_data = []
+        client.set_training_phase(TrainingStage.FWD)
+        for param in param_list:
+            data = client.access_dist(
+                param, AccessType.DATA, client.device, True, TrainingStage.FWD
+            )
+            max_prefetched = max(max_prefetched, len(client.msc_prefetched_chunk))
+            fwd_data.append(data.clone())
+            client.release_dist(
+                param,
+                AccessType.DATA,
+                TensorState.HOLD_AFTER_FWD,
+                training_stage=TrainingStage.FWD,
+                do_allreduce=False,
+                with_mem_saving_comm=True,
+            )
+        client.reset_visited_chunk()
+        for chunk_id in client.chunk_ids_generator(ChunkType.PARAM_FP16):
+            if client.chunk_list[chunk_id].get_state() in [
+                ChunkState.HOLD,
+                ChunkState.HOLD_AFTER_FWD,
+            ]:
+                client.set_all_tensors_state_in_chunk(chunk_id, TensorState.HOLD)
+
+        client.set_training_phase(TrainingStage.BWD)
+        for i, param in reversed(list(enumerate(param_list))):
+            data = client.access_dist(
+                param, AccessType.DATA, client.device, True, TrainingStage.BWD
+            )
+            max_prefetched = max(max_prefetched, len(client.msc_prefetched_chunk))
+            data.copy_(offsets + (rank + 1) * (i + 1))
+            client.release_dist(
+                param,
+                AccessType.DATA,
+                TensorState.HOLD_AFTER_BWD,
+                training_stage=TrainingStage.BWD,
+                do_allreduce=True,
+                with_mem_saving_comm=True,
+            )
+        client.reset_visited_chunk()
+
+        grads = {}
+        for i, param in enumerate(param_list):
+            if client.is_local_param(param, AccessType.DATA):
+                grads[i] = client.access_data(param, client.device).clone()
+                client.release_data(param)
+        return fwd_data, grads, max_prefetched
+
+    @distributed_test(world_size=[2], backend="gloo")
+    def test_msc_pipeline(self):
+        ref_fwd_data, ref_grads, _ = self._run_msc_fwd_bwd(1)
+        fwd_data, grads, max_prefetched = self._run_msc_fwd_bwd(3)
+        # The bcasts and reduces are pipelined.
+        self.assertEqual(max_prefetched, 2)
+        for data, ref_data in zip(fwd_data, ref_fwd_data):
+            self.assertTrue(torch.equal(data, ref_data))
+        self.assertEqual(grads.keys(), ref_grads.keys())
+        for i, grad in grads.items():
+            self.assertTrue(torch.equal(grad, ref_grads[i]))
+
+    @distributed_test(world_size=[1])
+    def test_module_access_plan(self):
+        config = {"compute_device": "cpu", "mem_tracer": {}, "opts": {}}
+        client = PatrickStarClient(
+            rank=0, default_chunk_size=self.default_chunk_size, config=config
+        )
+        module = torch.nn.Linear(4, 5)
+        register_param(module.weight, ParamType.CHUNK_BASED, torch.half, "weight")
+        register_param(module.bias, ParamType.TORCH_BASED, torch.float, "bias")
+        client.append_tensor(
+            [module.weight], torch.half, AccessType.DATA, ChunkType.PARAM_FP16
+        )
+
+        plan = ModuleAccessPlan(module, client)
+        # Torch based params are not in the plan.
+        self.assertEqual(len(plan), 1)
+        param_plan = plan.param_plans[0]
+        self.assertTrue(param_plan.param is module.weight)
+        self.assertEqual(
+            param_plan.chunk_id,
+            client.chunk_tensor_index.get_chunk_id(module.weight, AccessType.DATA),
+        )
+        self.assertEqual(param_plan.chunk_id_list, [param_plan.chunk_id])
+        self.assertEqual(param_plan.numel, module.weight.ps_attr.numel)
+
+        # Access with and without the plan gives the same tensor.
+        ref = client.access_data(module.weight, client.device)
+        ref.fill_(1)
+        ref_ptr = ref.data_ptr()
+        client.release_data(module.weight, TensorState.HOLD)
+        data = client.access_dist(
+            module.weight,
+            AccessType.DATA,
+            client.device,
+            False,
+            training_stage=TrainingStage.FWD,
+            plan=param_plan,
+        )
+        self.assertEqual(data.data_ptr(), ref_ptr)
+        self.assertEqual(data.shape, module.weight.ps_attr.shape)
+        self.assertTrue(torch.all(data == 1))
+        client.release_data(module.weight, TensorState.HOLD, plan=param_plan)
+        self.assertEqual(module.weight.data.numel(), 0)
+
+    @distributed_test(world_size=[1])
+    def test_cached_view_and_empty_tensor(self):
+        config = {"compute_device": "cpu", "mem_tracer": {}, "opts": {}}
+        client = PatrickStarClient(
+            rank=0, default_chunk_size=self.default_chunk_size, config=config
+        )
+        param_list = []
+        for idx in range(2):
+            param = torch.nn.Parameter(torch.rand(2, 5))
+            register_param(param, ParamType.CHUNK_BASED, torch.float, f"param_{idx}")
+            client.append_tensor(
+                [param], torch.float, AccessType.DATA, ChunkType.PARAM_FP32
+            )
+            param_list.append(param)
+
+        param = param_list[0]
+        chunk_id = client.chunk_tensor_index.get_chunk_id(param, AccessType.DATA)
+        first = client.access_data(param, client.device)
+        self.assertEqual(first.shape, torch.Size([2, 5]))
+        client.release_data(param)
+        # The view is reused while the payload is resident.
+        second = client.access_data(param, client.device)
+        self.assertTrue(first is second)
+        client.release_data(param)
+
+        # The released params share the same empty tensor.
+        client.access_data(param_list[1], client.device)
+        client.release_data(param_list[1])
+        self.assertEqual(param_list[0].data.numel(), 0)
+        self.assertEqual(param_list[1].data.numel(), 0)
+        self.assertEqual(len(client._empty_tensor_cache), 1)
+
+        # The views are dropped with the payload.
+        client.chunk_list[chunk_id].release_payload()
+        self.assertEqual(len(client.chunk_list[chunk_id]._tensor_views), 0)
+
+    @distributed_test(world_size=[1])
+    def test_batched_state_transition(self):
+        config = {"compute_device": "cpu", "mem_tracer": {}, "opts": {}}
+        client = PatrickStarClient(
+            rank=0, default_chunk_size=self.default_chunk_size, config=config
+        )
+        param_list = []
+        for idx in range(3):
+            param = torch.nn.Parameter(torch.rand(10))
+            register_param(param, ParamType.CHUNK_BASED, torch.half, f"param_{idx}")
+            client.append_tensor(
+                [param], torch.half, AccessType.DATA, ChunkType.PARAM_FP16
+            )
+            param_list.append(param)
+        chunk_id = client.chunk_tensor_index.get_chunk_id(
+            param_list[0], AccessType.DATA
+        )
+        chunk = client.chunk_list[chunk_id]
+
+        for param in param_list[:2]:
+            client.access_data(param, client.device)
+            client.release_data(param, TensorState.HOLD_AFTER_FWD)
+        self.assertEqual(chunk.get_state(), ChunkState.HOLD_AFTER_FWD)
+        self.assertFalse(chunk.all_tensor_state(TensorState.HOLD))
+        self.assertTrue(chunk_id in client.chunk_list.dirty_chunk_ids)
+
+        client.chunk_list.clear_dirty_chunk_ids()
+        client.set_all_tensors_state_in_chunk(chunk_id, TensorState.HOLD)
+        self.assertEqual(chunk.tensor_state_num(TensorState.HOLD), 3)
+        self.assertEqual(chunk.tensor_state_num(TensorState.HOLD_AFTER_FWD), 0)
+        for param in param_list:
+            self.assertEqual(param.ps_attr.get_state(AccessType.DATA), TensorState.HOLD)
+        self.assertTrue(chunk_id in client.chunk_list.dirty_chunk_ids)
+
+        # Nothing to do if all tensors are already in the state.
+        client.chunk_list.clear_dirty_chunk_ids()
+        client.set_all_tensors_state_in_chunk(chunk_id, TensorState.HOLD)
+        self.assertEqual(len(client.chunk_list.dirty_chunk_ids), 0)
+
+    @distributed_test(world_size=[1])
+    def test_unused_tensors(self):
+        config = {"compute_device": "cpu", "mem_tracer": {}, "opts": {}}
+        client = PatrickStarClient(
+            rank=0, default_chunk_size=self.default_chunk_size, config=config
+        )
+        param_list = []
+        for idx in range(3):
+            param = torch.nn.Parameter(torch.rand(10))
+            register_param(param, ParamType.CHUNK_BASED, torch.half, f"param_{idx}")
+            client.append_tensor(
+                [param], torch.half, AccessType.DATA, ChunkType.PARAM_FP16
+            )
+            param_list.append(param)
+        chunk_id = client.chunk_tensor_index.get_chunk_id(
+            param_list[0], AccessType.DATA
+        )
+        chunk = client.chunk_list[chunk_id]
+        client.set_all_tensors_state_in_chunk(chunk_id, TensorState.HOLD)
+
+        def forward(params):
+            for param in params:
+                client.access_dist(
+                    param, AccessType.DATA, client.device, False, TrainingStage.FWD
+                )
+                client.release_data(param, TensorState.HOLD_AFTER_FWD)
+
+        # The last param is not used in FWD.
+        client.set_training_phase(TrainingStage.FWD)
+        forward(param_list[:2])
+        self.assertFalse(chunk.all_tensor_state(TensorState.HOLD_AFTER_FWD))
+        # The post-forward reset of the engine.
+        chunk.set_unused()
+        client.set_all_tensors_state_in_chunk(chunk_id, TensorState.HOLD)
+        self.assertEqual(chunk.unused, 1)
+
+        # The recompute of a checkpointed module in BWD can release the chunk.
+        client.set_training_phase(TrainingStage.BWD)
+        forward(param_list[:2])
+        self.assertEqual(chunk.unused, 1)
+        self.assertTrue(chunk.all_tensor_state(TensorState.HOLD_AFTER_FWD))
+        for param in param_list[:2]:
+            client.access_data(param, client.device)
+            client.release_data(param, TensorState.HOLD_AFTER_BWD)
+        self.assertTrue(chunk.all_tensor_state(TensorState.HOLD_AFTER_BWD))
+
+        # The count is reset when the chunk enters the next FWD.
+        client.set_training_phase(TrainingStage.FWD)
+        client.set_all_tensors_state_in_chunk(chunk_id, TensorState.HOLD)
+        forward(param_list[:1])
+        self.assertEqual(chunk.unused, 0)
+        self.assertFalse(chunk.all_tensor_state(TensorState.HOLD_AFTER_FWD))
+
+    @distributed_test(world_size=[1])
+    def test_grad_accumulation_buffer(self):
+        config = {"compute_device": "cpu", "mem_tracer": {}, "opts": {}}
+        client = PatrickStarClient(
+            rank=0, default_chunk_size=self.default_chunk_size, config=config
+        )
+        param_list = []
+        for idx in range(2):
+            param = torch.nn.Parameter(torch.rand(2, 5).half())
+            register_param(param, ParamType.CHUNK_BASED, torch.half, f"param_{idx}")
+            param_fp32 = torch.nn.Parameter(torch.rand(2, 5), requires_grad=False)
+            register_param(
+                param_fp32, ParamType.CHUNK_BASED, torch.float, f"param_{idx}_fp32"
+            )
+            client.append_tensor(
+                [param], torch.half, AccessType.DATA, ChunkType.PARAM_FP16
+            )
+            client.append_tensor(
+                [param_fp32], torch.float, AccessType.DATA, ChunkType.PARAM_FP32
+            )
+            client.param_fp16_to_param_fp32_map[param] = param_fp32
+            param_list.append(param)
+        for param in param_list:
+            param_fp32 = client.param_fp16_to_param_fp32_map[param]
+            client.access_data(param_fp32, client.device).fill_(2)
+            client.release_data(param_fp32)
+        chunk_id = client.chunk_tensor_index.get_chunk_id(
+            param_list[0], AccessType.DATA
+        )
+        chunk = client.chunk_list[chunk_id]
+
+        def backward(value):
+            # The hooks write the grads to the param fp16 chunk, the grads
+            # are ready when all the tensors of the chunk are released.
+            for param in param_list:
+                client.access_data(param, client.device).fill_(value)
+            for param in param_list:
+                client.release_data(param, TensorState.HOLD_AFTER_BWD)
+
+        # No buffer, the grads are kept as is.
+        backward(0.5)
+        self.assertTrue(torch.all(chunk.payload[:20] == 0.5))
+        self.assertEqual(len(client._grad_acc_buffers), 0)
+
+        cpu_used = client.mem_tracer.used_chunk_mem("cpu")
+        client.accumulate_grads = True
+        for _ in range(2):
+            backward(0.5)
+            # The param data is restored for the next forward.
+            self.assertTrue(torch.all(chunk.payload[:20] == 2))
+        # One fp16 buffer for the chunk, counted by the tracer.
+        self.assertEqual(len(client._grad_acc_buffers), 1)
+        self.assertEqual(client._grad_acc_buffers[chunk_id].dtype, torch.half)
+        self.assertEqual(
+            client.mem_tracer.used_chunk_mem("cpu") - cpu_used, chunk.capacity * 2
+        )
+
+        # The last micro-batch adds the accumulated grads to its own.
+        client.accumulate_grads = False
+        backward(0.5)
+        self.assertEqual(chunk.payload.dtype, torch.half)
+        self.assertTrue(torch.all(chunk.payload[:20] == 1.5))
+        # The buffer is reused by the next accumulation.
+        client.accumulate_grads = True
+        backward(0.25)
+        client.accumulate_grads = False
+        backward(0.5)
+        self.assertTrue(torch.all(chunk.payload[:20] == 0.75))
+
+    @distributed_test(world_size=[1])
+    def test_activation_store(self):
+        config = {"compute_device": "cpu", "mem_tracer": {}, "opts": {}}
+        client = PatrickStarClient(
+            rank=0, default_chunk_size=self.default_chunk_size, config=config
+        )
+        store = client.activation_store
+        chunk_list = client.chunk_list
+
+        # The activations are packed into chunks of the default chunk size.
+        handles = [store.save(torch.rand(2, 10)) for _ in range(2)]
+        self.assertEqual(handles[0][0], handles[1][0])
+        self.assertEqual(len(store._chunk_pools[torch.float]), 1)
+        handles.append(store.save(torch.rand(30)))
+        self.assertEqual(len(store._chunk_pools[torch.float]), 2)
+        self.assertEqual(
+            len(chunk_list.chunk_type_to_id_list_map[ChunkType.ACTIVATION]), 2
+        )
+        chunk = chunk_list[handles[0][0]]
+        self.assertEqual(chunk.get_state(), ChunkState.HOLD)
+        # The payload is accounted as chunk memory.
+        self.assertEqual(
+            client.mem_tracer.used_chunk_mem("cpu"),
+            chunk_list.get_chunk_memory_used(client.device),
+        )
+
+        tensor = store.load(handles[1])
+        self.assertEqual(tensor.shape, torch.Size([2, 10]))
+        self.assertEqual(chunk.get_state(), ChunkState.COMPUTE)
+        store.release(handles[1])
+        self.assertEqual(chunk.get_state(), ChunkState.HOLD)
+        store.load(handles[0])
+        store.release(handles[0])
+        self.assertEqual(chunk.get_state(), ChunkState.RELEASED)
+
+        # The activations left by the last iteration are dropped.
+        store.reset()
+        self.assertEqual(chunk_list[handles[2][0]].get_state(), ChunkState.RELEASED)
+
+        # Checkpointing with the inputs stored in the activation chunks.
+        ActivationStore.current = store
+        try:
+            weight = torch.rand(10, 10, requires_grad=True)
+
+            def function(x):
+                return torch.tanh(x @ weight)
+
+            data = torch.rand(3, 10, requires_grad=True)
+            checkpoint(function, data).sum().backward()
+            ckp_grads = (data.grad.clone(), weight.grad.clone())
+            data.grad = None
+            weight.grad = None
+            function(data).sum().backward()
+            self.assertTrue(torch.allclose(ckp_grads[0], data.grad))
+            self.assertTrue(torch.allclose(ckp_grads[1], weight.grad))
+            self.assertEqual(len(store._live), 0)
+        finally:
+            ActivationStore.current = None
+
 
 if __name__ == "__main__":
 
@@ -27,28 +27,36 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import torch
-import pytest
-import copy
-from tiling import TiledLinear
-
-
-@pytest.mark.parametrize("in_splits,out_splits", [(1, 1), (2, 2)])
-@pytest.mark.parametrize("in_f,out_f", [(32, 32), (23, 29), (29, 23)])
-def test_tiled_forward(in_splits, out_splits, in_f, out_f):
-    base = torch.nn.Linear(in_f, out_f)
-    test = TiledLinear(
-        in_f,
-        out_f,
-        bias=True,
-        init_linear=copy.deepcopy(base),
-        out_splits=out_splits,
-        in_splits=in_splits,
-    )
-
-    inp = torch.rand(in_f)
-
-    base_out = base(copy.deepcopy(inp))
-    test_out = test(copy.deepcopy(inp))
-
-    assert torch.allclose(base_out, test_out, rtol=1e-4)
+import os
+import unittest
+
+from patrickstar.utils import format_cpulist, plan_cpu_affinity
+from patrickstar.utils.cpu_affinity import parse_cpulist
+
+
+class TestCPUAffinity(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def test_cpulist(self):
+        self.assertEqual(parse_cpulist("0-3,8,10-11\n"), [0, 1, 2, 3, 8, 10, 11])
+        self.assertEqual(parse_cpulist(""), [])
+        self.assertEqual(format_cpulist([11, 0, 1, 2, 3, 8, 10]), "0-3,8,10-11")
+
+    def test_plan_cpu_affinity(self):
+        available = os.sched_getaffinity(0)
+        local_world_size = 2
+        layouts = [
+            plan_cpu_affinity(rank, local_world_size)
+            for rank in range(local_world_size)
+        ]
+        for layout in layouts:
+            self.assertTrue(set(layout["cpus"]) <= available)
+            self.assertGreaterEqual(layout["num_threads"], 1)
+        if len(available) >= 2 * local_world_size:
+            # The ranks get disjoint CPUs when there are enough cores.
+            self.assertFalse(set(layouts[0]["cpus"]) & set(layouts[1]["cpus"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
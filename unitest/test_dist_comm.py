@@ -0,0 +1,259 @@
+# BSD 3-Clause License
+#
+# Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the psutil authors nor the names of its contributors
+#    may be used to endorse or promote products derived from this software without
+#    specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+
+import torch
+
+from common import distributed_test
+from patrickstar.core import (
+    PatrickStarClient,
+    AccessType,
+    ChunkState,
+    ChunkType,
+    TensorState,
+    TrainingStage,
+    register_param,
+)
+from patrickstar.core.parameter import ParamType
+from patrickstar.utils import get_rank, get_world_size
+
+
+def _forward(client, param_list, with_mem_saving_comm, test_case=None):
+    r"""Get the params from the owners, as the FWD hooks."""
+    client.set_training_phase(TrainingStage.FWD)
+    for i, param in enumerate(param_list):
+        data = client.access_dist(
+            param,
+            AccessType.DATA,
+            client.device,
+            with_mem_saving_comm,
+            training_stage=TrainingStage.FWD,
+        )
+        if test_case is not None:
+            test_case.assertEqual(data.device.type, "cpu")
+            test_case.assertTrue(torch.all(data == i + 1))
+        client.release_dist(
+            param,
+            AccessType.DATA,
+            TensorState.HOLD_AFTER_FWD,
+            training_stage=TrainingStage.FWD,
+            do_allreduce=False,
+            with_mem_saving_comm=with_mem_saving_comm,
+        )
+    client.reset_visited_chunk()
+
+    # The same as `PatrickStarEngine._set_state_after_forward`.
+    for chunk_id in client.chunk_ids_generator(ChunkType.PARAM_FP16):
+        if client.chunk_list[chunk_id].get_state() in [
+            ChunkState.HOLD,
+            ChunkState.HOLD_AFTER_FWD,
+        ]:
+            client.set_all_tensors_state_in_chunk(chunk_id, TensorState.HOLD)
+
+
+def _backward(client, param_list, with_mem_saving_comm):
+    r"""Write the grads of every process into the chunks, as the BWD hooks."""
+    rank = get_rank()
+    client.set_training_phase(TrainingStage.BWD)
+    for param in reversed(param_list):
+        data = client.access_dist(
+            param,
+            AccessType.DATA,
+            client.device,
+            with_mem_saving_comm,
+            training_stage=TrainingStage.BWD,
+        )
+        data.fill_(rank + 1)
+        client.release_dist(
+            param,
+            AccessType.DATA,
+            TensorState.HOLD_AFTER_BWD,
+            training_stage=TrainingStage.BWD,
+            do_allreduce=True,
+            with_mem_saving_comm=with_mem_saving_comm,
+        )
+    client.reset_visited_chunk()
+
+
+def _build_client(
+    param_num, with_mem_saving_comm, msc_max_inflight=1, replication_factor=1
+):
+    r"""A client with the compute device on CPU and one param of a chunk size
+    per param fp16 chunk. The owners initialize the i-th param to i + 1.
+    """
+    rank = get_rank()
+    default_chunk_size = 40
+    config = {
+        "compute_device": "cpu",
+        "mem_tracer": {"use_async_mem_monitor": False},
+        "opts": {
+            "with_mem_saving_comm": with_mem_saving_comm,
+            "msc_max_inflight": msc_max_inflight,
+            "replication_factor": replication_factor,
+        },
+    }
+    client = PatrickStarClient(rank, default_chunk_size, config=config)
+    client.set_warmup(True)
+
+    param_list = []
+    for i in range(param_num):
+        param = torch.nn.Parameter(torch.zeros(default_chunk_size))
+        register_param(param, ParamType.CHUNK_BASED, torch.half, f"param_{i}")
+        client.append_tensor([param], torch.half, AccessType.DATA, ChunkType.PARAM_FP16)
+        param_fp32 = torch.nn.Parameter(torch.zeros(default_chunk_size))
+        register_param(
+            param_fp32, ParamType.CHUNK_BASED, torch.float, f"param_{i}_fp32"
+        )
+        client.append_tensor(
+            [param_fp32], torch.float, AccessType.DATA, ChunkType.PARAM_FP32
+        )
+        param_list.append((param, param_fp32))
+
+    # The owner initializes its local params.
+    for i, params in enumerate(param_list):
+        for param in params:
+            if client.is_local_param(param, AccessType.DATA):
+                client.access_data(param, client.device).fill_(i + 1)
+                client.release_data(param)
+    return client, [param for param, _ in param_list]
+
+
+def _check_local_data(test_case, client, param_list, expected_fn):
+    for i, param in enumerate(param_list):
+        if client.is_local_param(param, AccessType.DATA):
+            data = client.access_data(param, client.device)
+            test_case.assertTrue(torch.all(data == expected_fn(i)))
+            client.release_data(param)
+
+
+def _run_comm_paths(
+    test_case, with_mem_saving_comm, msc_max_inflight=1, replication_factor=1
+):
+    r"""Run the FWD allgather (bcast) and BWD reduce scatter (reduce) paths
+    of the client with the compute device on CPU.
+    """
+    # 3 chunks for 2 processes (per shard group), the last comm group is uneven.
+    client, param_list = _build_client(
+        3, with_mem_saving_comm, msc_max_inflight, replication_factor
+    )
+    # FWD: every process gets the params from the owners.
+    _forward(client, param_list, with_mem_saving_comm, test_case)
+    # BWD: the grads are averaged on the owners.
+    _backward(client, param_list, with_mem_saving_comm)
+
+    world_size = get_world_size()
+    expected = sum(range(1, world_size + 1)) / world_size
+    _check_local_data(test_case, client, param_list, lambda i: expected)
+
+
+_REDUCE_OPS = ["reduce", "reduce_scatter", "all_reduce"]
+
+
+def _run_grad_accumulation(test_case, with_mem_saving_comm, msc_max_inflight=1):
+    r"""Count the reduce collectives issued in each micro-batch of a gradient
+    accumulation of 3 micro-batches.
+    """
+    # 2 even comm groups for 2 processes.
+    param_num = 4
+    client, param_list = _build_client(
+        param_num, with_mem_saving_comm, msc_max_inflight
+    )
+
+    counts = {}
+    origin_ops = {name: getattr(torch.distributed, name) for name in _REDUCE_OPS}
+
+    def make_counted(name):
+        def counted(*args, **kwargs):
+            counts[name] = counts.get(name, 0) + 1
+            return origin_ops[name](*args, **kwargs)
+
+        return counted
+
+    for name in _REDUCE_OPS:
+        setattr(torch.distributed, name, make_counted(name))
+    try:
+        for micro_step in range(3):
+            is_boundary = micro_step == 2
+            client.accumulate_grads = not is_boundary
+            counts.clear()
+            _forward(client, param_list, with_mem_saving_comm, test_case)
+            _backward(client, param_list, with_mem_saving_comm)
+            if is_boundary:
+                # One reduce per chunk with gloo.
+                test_case.assertEqual(sum(counts.values()), param_num)
+            else:
+                test_case.assertEqual(counts, {})
+                # The params are restored for the next forward.
+                _check_local_data(test_case, client, param_list, lambda i: i + 1)
+    finally:
+        for name, op in origin_ops.items():
+            setattr(torch.distributed, name, op)
+
+    world_size = get_world_size()
+    expected = 3 * sum(range(1, world_size + 1)) / world_size
+    _check_local_data(test_case, client, param_list, lambda i: expected)
+
+
+class TestDistComm(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    @distributed_test(world_size=[2], backend="gloo")
+    def test_allgather_reduce_scatter(self):
+        _run_comm_paths(self, with_mem_saving_comm=False)
+
+    @distributed_test(world_size=[2], backend="gloo")
+    def test_mem_saving_comm(self):
+        _run_comm_paths(self, with_mem_saving_comm=True)
+
+    @distributed_test(world_size=[2], backend="gloo")
+    def test_pipelined_mem_saving_comm(self):
+        _run_comm_paths(self, with_mem_saving_comm=True, msc_max_inflight=2)
+
+    @distributed_test(world_size=[2], backend="gloo")
+    def test_grad_accumulation(self):
+        _run_grad_accumulation(self, with_mem_saving_comm=False)
+
+    @distributed_test(world_size=[2], backend="gloo")
+    def test_grad_accumulation_mem_saving_comm(self):
+        _run_grad_accumulation(self, with_mem_saving_comm=True, msc_max_inflight=2)
+
+    @distributed_test(world_size=[4], backend="gloo")
+    def test_hybrid_shard(self):
+        _run_comm_paths(self, with_mem_saving_comm=False, replication_factor=2)
+
+    @distributed_test(world_size=[4], backend="gloo")
+    def test_hybrid_shard_mem_saving_comm(self):
+        _run_comm_paths(self, with_mem_saving_comm=True, replication_factor=2)
+
+
+if __name__ == "__main__":
+
+    unittest.main()
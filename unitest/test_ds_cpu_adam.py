@@ -175,7 +175,11 @@ class TestAccess(unittest.TestCase):
                             for beta1 in [0.9]:
                                 for beta2 in [0.999]:
                                     for weight_decay in [0.001]:
-                                        for grad_dtype in [torch.float, torch.half]:
+                                        for grad_dtype in [
+                                            torch.float,
+                                            torch.half,
+                                            torch.bfloat16,
+                                        ]:
                                             for loss_scale in [-1, 2 ** 5]:
                                                 self.check_res(
                                                     step,
@@ -191,6 +195,95 @@ class TestAccess(unittest.TestCase):
                                                     cpu_adam_op,
                                                 )
 
+    @distributed_test(world_size=[1], backend="gloo", use_fake_dist=False)
+    def test_ds_adam_update_copy(self):
+        from patrickstar.ops.op_builder.cpu_adam import CPUAdamBuilder
+
+        cpu_adam_op = CPUAdamBuilder().load()
+        cpu_adam_op.create_adam(1, 0.01, 0.9, 0.999, 1e-8, 0.001, True, True)
+        numel = 1023 * 37
+        p_data = torch.rand(numel)
+        p_grad = torch.rand(numel, dtype=torch.half)
+        exp_avg = torch.rand(numel)
+        exp_avg_sq = torch.rand(numel)
+        p_data_copy = p_data.clone()
+        exp_avg_copy = exp_avg.clone()
+        exp_avg_sq_copy = exp_avg_sq.clone()
+        # The params start at any offset of the fp16 staging buffer.
+        half_buff = torch.zeros(numel + 3, dtype=torch.half)
+        half_data = half_buff.narrow(0, 3, numel)
+        args = [1, 0.01, 0.9, 0.999, 1e-8, 0.001, True]
+        cpu_adam_op.adam_update_copy(
+            1, *args, p_data, p_grad, exp_avg, exp_avg_sq, -1, half_data
+        )
+        cpu_adam_op.create_adam(2, 0.01, 0.9, 0.999, 1e-8, 0.001, True, True)
+        cpu_adam_op.adam_update(
+            2, *args, p_data_copy, p_grad, exp_avg_copy, exp_avg_sq_copy, -1
+        )
+
+        # The same update as `adam_update`, plus the fp16 copy.
+        self.assertTrue(torch.equal(p_data, p_data_copy))
+        self.assertTrue(torch.equal(half_data, p_data.half()))
+        self.assertEqual(half_buff[:3].abs().sum().item(), 0)
+        cpu_adam_op.destroy_adam(1)
+        cpu_adam_op.destroy_adam(2)
+
+    def test_foreach_adam(self):
+        from patrickstar.ops.fp16_cpu_adam import foreach_adam_update
+
+        torch.manual_seed(0)
+        lr, beta1, beta2, eps, weight_decay = 0.01, 0.9, 0.999, 1e-8, 0.001
+        shapes = [(1023,), (64, 32), (7,)]
+        for use_adamw in [False, True]:
+            for grad_scale in [None, 2 ** 5]:
+                for step in [1, 10]:
+                    datas = [torch.rand(shape) for shape in shapes]
+                    grads = [torch.rand(shape, dtype=torch.half) for shape in shapes]
+                    exp_avgs = [torch.rand(shape) for shape in shapes]
+                    exp_avg_sqs = [torch.rand(shape) for shape in shapes]
+                    refs = [
+                        [t.clone() for t in ts] for ts in [datas, exp_avgs, exp_avg_sqs]
+                    ]
+                    grads_copy = [grad.clone() for grad in grads]
+
+                    foreach_adam_update(
+                        datas,
+                        grads,
+                        exp_avgs,
+                        exp_avg_sqs,
+                        lr,
+                        beta1,
+                        beta2,
+                        eps,
+                        weight_decay,
+                        1 - beta1 ** step,
+                        1 - beta2 ** step,
+                        use_adamw=use_adamw,
+                        grad_scale=grad_scale,
+                    )
+                    for i, grad in enumerate(grads_copy):
+                        torch_adam_update(
+                            step,
+                            lr,
+                            beta1,
+                            beta2,
+                            eps,
+                            weight_decay,
+                            True,
+                            refs[0][i],
+                            grad.float(),
+                            refs[1][i],
+                            refs[2][i],
+                            grad_scale if grad_scale is not None else -1,
+                            use_adamw,
+                        )
+                    # The grads are not modified.
+                    for grad, grad_copy in zip(grads, grads_copy):
+                        self.assertTrue(torch.equal(grad, grad_copy))
+                    for ts, ref_ts in zip([datas, exp_avgs, exp_avg_sqs], refs):
+                        for t, ref in zip(ts, ref_ts):
+                            self.assertLess(torch.max(torch.abs(t - ref)), 1e-6)
+
 
 if __name__ == "__main__":
 
@@ -35,6 +35,7 @@ from transformers import BertConfig
 
 from common import distributed_test
 from patrickstar.ops import Embedding as PSEmbedding
+from patrickstar.utils import sparse_allreduce
 
 
 class TestClientAccess(unittest.TestCase):
@@ -67,6 +68,50 @@ class TestClientAccess(unittest.TestCase):
 
         self.assertLess(torch.max(torch_res.cpu() - res.cpu()), 1e-2)
 
+    @distributed_test(world_size=[1])
+    def test_sparse_embedding_grad(self):
+        test_device = torch.device("cuda:0")
+        vocab_size = 1000
+        input_ids = torch.tensor([[1, 5, 5, 42]], dtype=torch.long, device=test_device)
+
+        torch.manual_seed(0)
+        torch_embedding = TorchEmbedding(vocab_size, 64)
+        torch.manual_seed(0)
+        PSEmbedding.use_cpu = True
+        PSEmbedding.sparse_grad = True
+        ps_embedding = PSEmbedding(vocab_size, 64)
+        PSEmbedding.use_cpu = False
+        PSEmbedding.sparse_grad = False
+
+        ps_embedding(input_ids).float().sum().backward()
+        torch_embedding.to(test_device)(input_ids).sum().backward()
+
+        grad = ps_embedding.weight.grad
+        self.assertTrue(grad.is_sparse)
+        self.assertEqual(grad.coalesce()._nnz(), 3)
+        self.assertLess(
+            torch.max(torch.abs(grad.to_dense() - torch_embedding.weight.grad.cpu())),
+            1e-2,
+        )
+
+    @distributed_test(world_size=[2], backend="gloo")
+    def test_sparse_allreduce(self):
+        rank = torch.distributed.get_rank()
+        # Rank 0 touches rows [0, 2], rank 1 touches rows [2, 3, 4].
+        rows = [[0, 2], [2, 3, 4]][rank]
+        dense = torch.zeros(6, 4)
+        dense[rows] = float(rank + 1)
+
+        res = sparse_allreduce(dense.to_sparse(1))
+
+        expected = torch.zeros(6, 4)
+        expected[[0, 2]] += 1.0
+        expected[[2, 3, 4]] += 2.0
+        expected /= 2
+        self.assertTrue(res.is_sparse)
+        self.assertEqual(res._nnz(), 4)
+        self.assertLess(torch.max(torch.abs(res.to_dense() - expected)), 1e-6)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,86 @@
+# BSD 3-Clause License
+#
+# Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the psutil authors nor the names of its contributors
+#    may be used to endorse or promote products derived from this software without
+#    specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+
+import torch
+
+from common import distributed_test
+from patrickstar.core import (
+    PatrickStarClient,
+    PSPreProcessCtx,
+    frozen_scope,
+    AccessType,
+    ChunkType,
+)
+
+
+class TestFrozenScopeContext(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    @distributed_test(world_size=[1])
+    def test_frozen_scope(self):
+        def model_provider():
+            with frozen_scope():
+                backbone = torch.nn.Linear(5, 10)
+            head = torch.nn.Linear(10, 2)
+            return torch.nn.Sequential(backbone, head)
+
+        default_chunk_size = 1 * 1024 * 1024
+        client = PatrickStarClient(0, default_chunk_size)
+
+        with PSPreProcessCtx(client, dtype=torch.float):
+            ps_model = model_provider()
+
+        backbone, head = ps_model[0], ps_model[1]
+        for param in backbone.parameters():
+            self.assertFalse(param.requires_grad)
+            self.assertTrue(param.ps_attr.is_frozen())
+            # No fp32 copy for the frozen params.
+            self.assertNotIn(param, client.param_fp16_to_param_fp32_map)
+            chunk_id = client.chunk_tensor_index.get_chunk_id(param, AccessType.DATA)
+            comm_info = client.chunk_tensor_index.chunk_id_to_comm_info_map[chunk_id]
+            self.assertEqual(comm_info.chunk_type, ChunkType.PARAM_FP16_FROZEN)
+        for param in head.parameters():
+            self.assertTrue(param.requires_grad)
+            self.assertFalse(param.ps_attr.is_frozen())
+            self.assertIn(param, client.param_fp16_to_param_fp32_map)
+
+        self.assertEqual(
+            client.chunk_tensor_index.chunk_num(ChunkType.PARAM_FP16_FROZEN), 1
+        )
+        self.assertEqual(
+            client.chunk_tensor_index.chunk_num(ChunkType.PARAM_FP16),
+            client.chunk_tensor_index.chunk_num(ChunkType.PARAM_FP32),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+# BSD 3-Clause License
+#
+# Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the psutil authors nor the names of its contributors
+#    may be used to endorse or promote products derived from this software without
+#    specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+
+import torch
+
+from common import distributed_test
+from patrickstar.core import AccessType, ChunkType
+from patrickstar.runtime import BatchInferenceRunner, initialize_inference_engine
+
+
+class TestInferenceEngine(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    @distributed_test(world_size=[1], backend="gloo")
+    def test_forward_only(self):
+        hidden_dim = 16
+
+        def model_func():
+            return torch.nn.Sequential(
+                torch.nn.Linear(hidden_dim, hidden_dim),
+                torch.nn.Linear(hidden_dim, hidden_dim),
+                torch.nn.Linear(hidden_dim, hidden_dim),
+            )
+
+        config = {
+            # Each Linear fills exactly one chunk.
+            "default_chunk_size": hidden_dim * hidden_dim + hidden_dim,
+            "use_cpu_embedding": False,
+            "client": {
+                "compute_device": "cpu",
+                "mem_tracer": {"use_async_mem_monitor": False},
+                "opts": {},
+            },
+        }
+
+        torch.manual_seed(0)
+        engine = initialize_inference_engine(model_func, 0, config=config)
+        torch.manual_seed(0)
+        torch_model = model_func().half().float()
+
+        client = engine.client
+        # Only the param fp16 chunks are built.
+        self.assertEqual(client.chunk_tensor_index.chunk_num(ChunkType.PARAM_FP16), 3)
+        self.assertEqual(client.chunk_tensor_index.chunk_num(ChunkType.PARAM_FP32), 0)
+        self.assertEqual(len(client.param_fp16_to_param_fp32_map), 0)
+
+        # The first forward is the warmup, the second one prefetches chunks.
+        for _ in range(2):
+            data = torch.randn(4, hidden_dim)
+            output = engine(data)
+            self.assertFalse(output.requires_grad)
+            ref = torch_model(data.half().float())
+            self.assertLess(torch.max(torch.abs(output.float() - ref)).item(), 1e-2)
+        self.assertEqual(len(client._fwd_chunk_order), 3)
+
+    @unittest.skipIf(not torch.cuda.is_available(), "The prefetch needs GPU.")
+    @distributed_test(world_size=[1], backend="gloo")
+    def test_prefetch_next_chunk(self):
+        hidden_dim = 16
+
+        def model_func():
+            return torch.nn.Sequential(
+                torch.nn.Linear(hidden_dim, hidden_dim),
+                torch.nn.Linear(hidden_dim, hidden_dim),
+                torch.nn.Linear(hidden_dim, hidden_dim),
+            )
+
+        config = {
+            "default_chunk_size": hidden_dim * hidden_dim + hidden_dim,
+            "use_cpu_embedding": False,
+            "client": {
+                "mem_tracer": {"use_async_mem_monitor": False},
+                "opts": {},
+            },
+        }
+
+        torch.manual_seed(0)
+        engine = initialize_inference_engine(model_func, 0, config=config)
+        torch.manual_seed(0)
+        torch_model = model_func().half().cuda()
+        client = engine.client
+
+        # Warmup records the visiting order of the chunks.
+        data = torch.randn(4, hidden_dim).half().cuda()
+        engine(data)
+        chunk_order = list(client._fwd_chunk_order)
+        self.assertEqual(len(chunk_order), 3)
+
+        cpu_device = torch.device("cpu:0")
+        for chunk_id in chunk_order:
+            client.chunk_list.chunk_move(chunk_id, cpu_device)
+        next_chunk_devices = []
+
+        def _record_next_chunk_device(module, *args):
+            pos = client.get_fwd_chunk_pos(
+                client.chunk_tensor_index.get_chunk_id(module.weight, AccessType.DATA)
+            )
+            if pos + 1 < len(chunk_order):
+                chunk = client.chunk_list[chunk_order[pos + 1]]
+                next_chunk_devices.append(chunk.get_device().type)
+
+        # Registered after the hooks of the engine, so it runs after the
+        # chunks of the module are released.
+        for layer in engine.module:
+            layer.register_forward_hook(_record_next_chunk_device)
+        output = engine(data)
+        # The chunk of the next layer is on GPU after the forward of the
+        # previous layer.
+        self.assertEqual(next_chunk_devices, ["cuda", "cuda"])
+        ref = torch_model(data)
+        self.assertLess(torch.max(torch.abs(output - ref)).item(), 1e-2)
+
+    @distributed_test(world_size=[1], backend="gloo")
+    def test_batch_inference_runner(self):
+        hidden_dim = 16
+
+        def model_func():
+            return torch.nn.Sequential(
+                torch.nn.Linear(hidden_dim, hidden_dim),
+                torch.nn.Linear(hidden_dim, hidden_dim),
+                torch.nn.Linear(hidden_dim, hidden_dim),
+            )
+
+        config = {
+            "default_chunk_size": hidden_dim * hidden_dim + hidden_dim,
+            "use_cpu_embedding": False,
+            "client": {
+                "compute_device": "cpu",
+                "mem_tracer": {"use_async_mem_monitor": False},
+                "opts": {},
+            },
+        }
+
+        torch.manual_seed(0)
+        engine = initialize_inference_engine(model_func, 0, config=config)
+        torch.manual_seed(0)
+        torch_model = model_func().half().float()
+
+        runner = BatchInferenceRunner(engine, num_micro_batches=3)
+        self.assertEqual(
+            [len(module_plans) for module_plans in runner.layer_plans], [1, 1, 1]
+        )
+
+        # 7 batches make 2 full waves and a partial one.
+        batches = [torch.randn(4, hidden_dim) for _ in range(7)]
+        outputs = list(runner.run(iter(batches)))
+        self.assertEqual(len(outputs), len(batches))
+        self.assertEqual(engine.iteration_cnt_, 3)
+        self.assertFalse(engine.client.hooks_paused)
+        for data, output in zip(batches, outputs):
+            ref = torch_model(data.half().float())
+            self.assertLess(torch.max(torch.abs(output.float() - ref)).item(), 1e-2)
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,190 @@
+# BSD 3-Clause License
+#
+# Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the psutil authors nor the names of its contributors
+#    may be used to endorse or promote products derived from this software without
+#    specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import unittest
+
+import torch
+from transformers.optimization import Adafactor
+
+from common import distributed_test
+from patrickstar.core import PatrickStarClient, PSPreProcessCtx
+from patrickstar.ops import FP16Adafactor, FP16Lamb
+
+
+def torch_lamb_update(
+    step,
+    lr,
+    beta1,
+    beta2,
+    eps,
+    weight_decay,
+    max_trust_ratio,
+    param,
+    grad,
+    exp_avg,
+    exp_avg_sq,
+):
+    exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+    exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+    exp_avg_hat = exp_avg / (1 - beta1 ** step)
+    exp_avg_sq_hat = exp_avg_sq / (1 - beta2 ** step)
+    update = exp_avg_hat / (exp_avg_sq_hat.sqrt() + eps)
+    if weight_decay != 0:
+        update = update + weight_decay * param
+
+    weight_norm = param.norm().item()
+    update_norm = update.norm().item()
+    if weight_norm > 0 and update_norm > 0:
+        trust_ratio = min(weight_norm / update_norm, max_trust_ratio)
+    else:
+        trust_ratio = 1.0
+    param.add_(update, alpha=-lr * trust_ratio)
+
+
+class TestLambAdafactor(unittest.TestCase):
+    def setUp(self):
+        self.hidden_dim = 8
+        self.num_steps = 3
+        self.loss_scale = 4.0
+
+    def model_func(self):
+        return torch.nn.Sequential(
+            torch.nn.Linear(self.hidden_dim, self.hidden_dim),
+            torch.nn.LayerNorm(self.hidden_dim),
+            torch.nn.Linear(self.hidden_dim, 2),
+        )
+
+    def build_ps_model(self):
+        client = PatrickStarClient(0, 1024)
+        torch.manual_seed(0)
+        with PSPreProcessCtx(client, dtype=torch.float):
+            ps_model = self.model_func()
+        return client, ps_model
+
+    def run_updates(self, optimizer, ps_model, ref_model, ref_step_func):
+        r"""Update the fp32 params with `optimizer.update` and the reference
+        for a few steps with the same fp16 grads.
+
+        Returns:
+            The pairs of the updated params.
+        """
+        group = optimizer.param_groups[0]
+        params = list(ps_model.parameters())
+        ref_params = list(ref_model.parameters())
+        datas = [ref_param.detach().clone() for ref_param in ref_params]
+        states_list = []
+        for p in params:
+            states = {}
+            for key in optimizer.state_param_keys:
+                if key in optimizer.state[p]:
+                    shape = optimizer.state[p][key].ps_attr.shape
+                    states[key] = torch.zeros(shape)
+            states_list.append(states)
+
+        # The grads are read from the fp16 chunks with the loss scale.
+        optimizer.combined_scale = self.loss_scale
+        for step in range(1, self.num_steps + 1):
+            grads = [torch.randn_like(data).half() for data in datas]
+            for data, grad, states in zip(datas, grads, states_list):
+                optimizer.update(data, grad * self.loss_scale, states, step, group)
+            ref_step_func(step, [grad.float() for grad in grads])
+        return zip(datas, ref_params)
+
+    @distributed_test(world_size=[1])
+    def test_lamb(self):
+        lr = 1e-2
+        betas = (0.9, 0.99)
+        eps = 1e-6
+        weight_decay = 0.01
+        max_trust_ratio = 10.0
+        client, ps_model = self.build_ps_model()
+        optimizer = FP16Lamb(
+            client,
+            ps_model.parameters(),
+            lr=lr,
+            betas=betas,
+            eps=eps,
+            weight_decay=weight_decay,
+            max_trust_ratio=max_trust_ratio,
+        )
+        torch.manual_seed(0)
+        ref_model = self.model_func()
+        ref_states = [
+            (torch.zeros_like(p), torch.zeros_like(p)) for p in ref_model.parameters()
+        ]
+
+        @torch.no_grad()
+        def ref_step_func(step, grads):
+            for p, grad, (exp_avg, exp_avg_sq) in zip(
+                ref_model.parameters(), grads, ref_states
+            ):
+                torch_lamb_update(
+                    step,
+                    lr,
+                    betas[0],
+                    betas[1],
+                    eps,
+                    weight_decay,
+                    max_trust_ratio,
+                    p,
+                    grad,
+                    exp_avg,
+                    exp_avg_sq,
+                )
+
+        for data, ref_param in self.run_updates(
+            optimizer, ps_model, ref_model, ref_step_func
+        ):
+            self.assertTrue(torch.allclose(data, ref_param, rtol=1e-5, atol=1e-6))
+
+    @distributed_test(world_size=[1])
+    def test_adafactor(self):
+        for beta1, weight_decay in [(None, 0.0), (0.9, 0.01)]:
+            client, ps_model = self.build_ps_model()
+            optimizer = FP16Adafactor(
+                client, ps_model.parameters(), beta1=beta1, weight_decay=weight_decay
+            )
+            torch.manual_seed(0)
+            ref_model = self.model_func()
+            ref_optimizer = Adafactor(
+                ref_model.parameters(), beta1=beta1, weight_decay=weight_decay
+            )
+
+            def ref_step_func(step, grads):
+                for p, grad in zip(ref_model.parameters(), grads):
+                    p.grad = grad
+                ref_optimizer.step()
+
+            for data, ref_param in self.run_updates(
+                optimizer, ps_model, ref_model, ref_step_func
+            ):
+                self.assertTrue(torch.allclose(data, ref_param, rtol=1e-5, atol=1e-6))
+
+
+if __name__ == "__main__":
+    unittest.main()
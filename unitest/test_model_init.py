@@ -33,7 +33,7 @@ import torch
 from transformers import BertModel, BertConfig
 
 from common import distributed_test
-from patrickstar.core import PatrickStarClient, ParamType
+from patrickstar.core import PatrickStarClient, ParamType, ChunkType
 from patrickstar.core.preprocess import PSPreProcessCtx
 
 
@@ -79,6 +79,64 @@ class TestModelInitContext(unittest.TestCase):
                     )
                 client.release_data(ps_param)
 
+    @distributed_test(world_size=[2], backend="gloo", use_fake_dist=True)
+    def test_no_dummy_chunk(self):
+        def model_provider():
+            return torch.nn.Sequential(
+                torch.nn.Linear(16, 16),
+                torch.nn.Linear(16, 16),
+                torch.nn.Linear(16, 16),
+            )
+
+        # Each Linear fills exactly one chunk.
+        default_chunk_size = 16 * 16 + 16
+        client = PatrickStarClient(0, default_chunk_size)
+
+        with PSPreProcessCtx(client, dtype=torch.float):
+            model_provider()
+
+        chunk_ids = list(client.chunk_ids_generator(ChunkType.PARAM_FP16))
+        # The chunks are not padded to an integer multiple of world size.
+        self.assertEqual(len(chunk_ids), 3)
+        last_group = client.chunk_tensor_index.chunk_ids_of_comm_group(chunk_ids[-1])
+        self.assertEqual(last_group, [chunk_ids[-1]])
+        self.assertEqual(
+            client.param_fp16_chunks_max_mem_usage(), 3 * default_chunk_size * 2
+        )
+
+    @distributed_test(world_size=[1], backend="gloo", use_fake_dist=True)
+    def test_bf16_model_init(self):
+        def model_provider():
+            return torch.nn.Sequential(
+                torch.nn.Linear(16, 16),
+                torch.nn.Linear(16, 16),
+            )
+
+        compute_device = torch.device("cpu:0")
+        default_chunk_size = 1024
+        client = PatrickStarClient(0, default_chunk_size, half_dtype=torch.bfloat16)
+
+        torch.manual_seed(0)
+        with PSPreProcessCtx(client, dtype=torch.float):
+            ps_model = model_provider()
+
+        torch.manual_seed(0)
+        torch_model = model_provider()
+
+        for chunk_id in client.chunk_ids_generator(ChunkType.PARAM_FP16):
+            self.assertEqual(client.chunk_list[chunk_id].data_type, torch.bfloat16)
+        for ps_param, torch_param in zip(
+            ps_model.parameters(), torch_model.parameters()
+        ):
+            self.assertEqual(ps_param.ps_attr.data_type, torch.bfloat16)
+            ps_data = client.access_data(ps_param, compute_device)
+            self.assertEqual(ps_data.dtype, torch.bfloat16)
+            # bf16 keeps 8 bits of mantissa.
+            self.assertLess(
+                torch.max(torch.abs(torch_param.data - ps_data.float())), 1e-2
+            )
+            client.release_data(ps_param)
+
 
 if __name__ == "__main__":
 
@@ -27,6 +27,7 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import math
 import unittest
 
 import torch
@@ -34,8 +35,9 @@ from transformers import BertModel, BertConfig
 
 from common import distributed_test
 from patrickstar.core import PSPreProcessCtx
-from patrickstar.core import PatrickStarClient
-from patrickstar.ops import FP16Adam
+from patrickstar.core import PatrickStarClient, AccessType, ChunkType
+from patrickstar.fp16 import DynamicLossScaler
+from patrickstar.ops import FP16Adam, FP16Lamb, FP16Adafactor
 
 
 class TestOptimizerInitContext(unittest.TestCase):
@@ -59,6 +61,478 @@ class TestOptimizerInitContext(unittest.TestCase):
 
         FP16Adam(client, ps_model.parameters())
 
+    @distributed_test(world_size=[1])
+    def test_optimizer_param_groups(self):
+        def model_provider():
+            cfg = BertConfig()
+            cfg.vocab_size = 10
+            cfg.num_hidden_layers = 2
+            model = BertModel(cfg)
+            return model
+
+        default_chunk_size = 32 * 1024 * 1024
+        client = PatrickStarClient(0, default_chunk_size)
+
+        torch.manual_seed(0)
+        with PSPreProcessCtx(client, dtype=torch.float):
+            ps_model = model_provider()
+
+        no_decay = ["bias", "LayerNorm.weight"]
+        decay_params = [
+            p
+            for n, p in ps_model.named_parameters()
+            if not any(nd in n for nd in no_decay)
+        ]
+        no_decay_params = [
+            p for n, p in ps_model.named_parameters() if any(nd in n for nd in no_decay)
+        ]
+        optimizer = FP16Adam(
+            client,
+            [
+                {"params": decay_params, "weight_decay": 0.01},
+                {"params": no_decay_params, "weight_decay": 0.0},
+            ],
+            lr=1e-3,
+        )
+        self.assertEqual(len(optimizer.param_groups), 2)
+
+        # The params of both groups are visited in the order of chunks.
+        ordered = optimizer.chunk_ordered_params()
+        self.assertEqual(len(ordered), len(decay_params) + len(no_decay_params))
+        no_decay_ids = {id(p) for p in no_decay_params}
+        positions = []
+        for p, group in ordered:
+            info = client.chunk_tensor_index.get_tensor_info(p.ps_attr.data_id())
+            positions.append((info.chunk_id, info.start_offset))
+            self.assertEqual(group["weight_decay"] == 0.0, id(p) in no_decay_ids)
+        self.assertEqual(positions, sorted(positions))
+
+        # The hyperparams are read from the groups, so a scheduler updating
+        # the lr of the groups takes effect at the next step.
+        torch.optim.lr_scheduler.LambdaLR(optimizer, lambda step: 0.5)
+        for _, group in ordered:
+            self.assertEqual(group["lr"], 5e-4)
+        self.assertNotIn("lr", optimizer.state[decay_params[0]])
+
+    @distributed_test(world_size=[1])
+    def test_lamb_and_adafactor_init(self):
+        def model_provider():
+            cfg = BertConfig()
+            cfg.vocab_size = 10
+            cfg.num_hidden_layers = 2
+            model = BertModel(cfg)
+            return model
+
+        # Small chunks, so that the params span several chunks.
+        default_chunk_size = 4 * 1024 * 1024
+
+        torch.manual_seed(0)
+        client = PatrickStarClient(0, default_chunk_size)
+        with PSPreProcessCtx(client, dtype=torch.float):
+            ps_model = model_provider()
+        FP16Lamb(client, ps_model.parameters(), lr=1e-3, weight_decay=0.01)
+        # LAMB keeps the same state chunks as Adam.
+        index = client.chunk_tensor_index
+        self.assertEqual(
+            index.chunk_num(ChunkType.VARIANCE), index.chunk_num(ChunkType.PARAM_FP16)
+        )
+
+        torch.manual_seed(0)
+        client = PatrickStarClient(0, default_chunk_size)
+        with PSPreProcessCtx(client, dtype=torch.float):
+            ps_model = model_provider()
+        optimizer = FP16Adafactor(client, ps_model.parameters())
+        index = client.chunk_tensor_index
+        # No first moment without beta1, and the factored second moments
+        # are packed densely into far fewer chunks.
+        self.assertEqual(index.chunk_num(ChunkType.MOMENTUM), 0)
+        self.assertLess(
+            index.chunk_num(ChunkType.VARIANCE), index.chunk_num(ChunkType.PARAM_FP16)
+        )
+        for p in ps_model.parameters():
+            state = optimizer.state[p]
+            if len(p.ps_attr.shape) >= 2:
+                self.assertEqual(
+                    state["exp_avg_sq_row"].ps_attr.shape, p.ps_attr.shape[:-1]
+                )
+                self.assertNotIn("exp_avg_sq", state)
+            else:
+                self.assertEqual(state["exp_avg_sq"].ps_attr.shape, p.ps_attr.shape)
+
+    @distributed_test(world_size=[1])
+    def test_8bit_states_init(self):
+        def model_provider():
+            cfg = BertConfig()
+            cfg.vocab_size = 10
+            cfg.num_hidden_layers = 2
+            model = BertModel(cfg)
+            return model
+
+        default_chunk_size = 4 * 1024 * 1024
+        client = PatrickStarClient(0, default_chunk_size)
+
+        torch.manual_seed(0)
+        with PSPreProcessCtx(client, dtype=torch.float):
+            ps_model = model_provider()
+
+        optimizer = FP16Adam(
+            client, ps_model.parameters(), use_8bit_states=True, state_block_size=256
+        )
+        index = client.chunk_tensor_index
+        self.assertEqual(index.chunk_num(ChunkType.MOMENTUM), 0)
+        self.assertEqual(index.chunk_num(ChunkType.VARIANCE), 0)
+        # The int8 states keep the layout of the param fp16 chunks.
+        self.assertEqual(
+            index.chunk_num(ChunkType.MOMENTUM_INT8),
+            index.chunk_num(ChunkType.PARAM_FP16),
+        )
+        self.assertEqual(
+            index.chunk_num(ChunkType.VARIANCE_INT8),
+            index.chunk_num(ChunkType.PARAM_FP16),
+        )
+        for p in ps_model.parameters():
+            state = optimizer.state[p]
+            self.assertEqual(state["exp_avg"].ps_attr.data_type, torch.int8)
+            self.assertEqual(
+                state["exp_avg_absmax"].ps_attr.numel,
+                (p.ps_attr.numel + 255) // 256,
+            )
+
+    @distributed_test(world_size=[1])
+    def test_8bit_states_adam(self):
+        def model_provider():
+            return torch.nn.Sequential(
+                torch.nn.Linear(32, 32),
+                torch.nn.LayerNorm(32),
+                torch.nn.Linear(32, 8),
+            )
+
+        def build_optimizer(use_8bit_states):
+            client = PatrickStarClient(0, 4096)
+            torch.manual_seed(0)
+            with PSPreProcessCtx(client, dtype=torch.float):
+                ps_model = model_provider()
+            optimizer = FP16Adam(
+                client,
+                ps_model.parameters(),
+                lr=1e-3,
+                use_8bit_states=use_8bit_states,
+                state_block_size=64,
+                use_foreach_adam=True,
+            )
+            states_list = []
+            for p in ps_model.parameters():
+                states = {}
+                for key in optimizer.state_param_keys:
+                    if key in optimizer.state[p]:
+                        ps_attr = optimizer.state[p][key].ps_attr
+                        states[key] = torch.zeros(
+                            ps_attr.shape, dtype=ps_attr.data_type
+                        )
+                states_list.append(states)
+            return optimizer, states_list
+
+        torch.manual_seed(0)
+        init_datas = [p.detach().clone() for p in model_provider().parameters()]
+        # The grads of the elements span 4 orders of magnitude, which are
+        # lost in the small values of a block by a linear code.
+        grad_scales = [
+            10 ** torch.empty(data.shape).uniform_(-4, 0) for data in init_datas
+        ]
+        grads_list = [
+            [
+                (torch.randn(data.shape) * scale).half()
+                for data, scale in zip(init_datas, grad_scales)
+            ]
+            for _ in range(10)
+        ]
+
+        deltas = []
+        for use_8bit_states in [False, True]:
+            optimizer, states_list = build_optimizer(use_8bit_states)
+            group = optimizer.param_groups[0]
+            datas = [data.clone() for data in init_datas]
+            for step, grads in enumerate(grads_list, 1):
+                for data, grad, states in zip(datas, grads, states_list):
+                    optimizer.update(data, grad, states, step, group)
+            deltas.append(
+                torch.cat(
+                    [(data - init).view(-1) for data, init in zip(datas, init_datas)]
+                )
+            )
+        ref_delta, delta = deltas
+        self.assertEqual(states_list[0]["exp_avg"].dtype, torch.int8)
+        # The 8 bit states follow the fp32 ones within a few percent.
+        self.assertLess((delta - ref_delta).norm() / ref_delta.norm(), 0.05)
+
+    @distributed_test(world_size=[1])
+    def test_global_grad_norm(self):
+        def model_provider():
+            cfg = BertConfig()
+            cfg.vocab_size = 10
+            cfg.num_hidden_layers = 2
+            model = BertModel(cfg)
+            return model
+
+        default_chunk_size = 4 * 1024 * 1024
+        client = PatrickStarClient(0, default_chunk_size)
+
+        torch.manual_seed(0)
+        with PSPreProcessCtx(client, dtype=torch.float):
+            ps_model = model_provider()
+
+        loss_scale = 4.0
+        max_grad_norm = 1.0
+        optimizer = FP16Adam(
+            client,
+            ps_model.parameters(),
+            loss_scaler=DynamicLossScaler(init_scale=loss_scale),
+            max_grad_norm=max_grad_norm,
+        )
+
+        # Fill the grads, the chunks are all local with a single process.
+        numel = sum(p.ps_attr.numel for p in ps_model.parameters())
+        chunk_ids = list(client.chunk_ids_generator(ChunkType.PARAM_FP16))
+        for chunk_id in chunk_ids:
+            client.chunk_list[chunk_id].payload.fill_(0.5 * loss_scale)
+        optimizer.check_chunk_grads()
+        norm = optimizer.compute_global_grad_norm()
+        self.assertAlmostEqual(norm, (numel * 0.25) ** 0.5, delta=norm * 1e-4)
+
+        optimizer.global_grad_norm = norm
+        self.assertAlmostEqual(
+            optimizer.compute_combined_scale(),
+            loss_scale * (norm + 1e-6) / max_grad_norm,
+            delta=norm * 1e-4,
+        )
+        # No clipping for small grads, only unscale.
+        optimizer.global_grad_norm = max_grad_norm / 2
+        self.assertEqual(optimizer.compute_combined_scale(), loss_scale)
+
+        # An overflowed grad makes the norm non finite.
+        client.chunk_list[chunk_ids[-1]].payload[0] = float("inf")
+        optimizer.check_chunk_grads()
+        self.assertEqual(optimizer.compute_global_grad_norm(), float("inf"))
+
+    @distributed_test(world_size=[1])
+    def test_non_finite_grad_norm(self):
+        def model_provider():
+            cfg = BertConfig()
+            cfg.vocab_size = 10
+            cfg.num_hidden_layers = 2
+            model = BertModel(cfg)
+            return model
+
+        client = PatrickStarClient(0, 4 * 1024 * 1024)
+
+        torch.manual_seed(0)
+        with PSPreProcessCtx(client, dtype=torch.float):
+            ps_model = model_provider()
+
+        # No loss scaler, as in bf16 training.
+        optimizer = FP16Adam(client, ps_model.parameters(), max_grad_norm=1.0)
+        optimizer.prepare_chunk_buffs(0)
+        write_chunk_buff = optimizer.write_chunk_buff
+        fp16_chunk_ids = list(client.chunk_ids_generator(ChunkType.PARAM_FP16))
+        fp32_chunk_ids = list(client.chunk_ids_generator(ChunkType.PARAM_FP32))
+
+        optimizer.global_grad_norm = 0.5
+        self.assertFalse(optimizer.has_overflow_and_reset_param(write_chunk_buff))
+        self.assertIsNone(optimizer.compute_combined_scale())
+
+        for bad_value in [float("inf"), float("nan")]:
+            for chunk_id in fp16_chunk_ids:
+                client.chunk_list[chunk_id].payload.fill_(0.5)
+            client.chunk_list[fp16_chunk_ids[-1]].payload[0] = bad_value
+            optimizer.check_chunk_grads()
+            optimizer.global_grad_norm = optimizer.compute_global_grad_norm()
+            self.assertFalse(math.isfinite(optimizer.global_grad_norm))
+            # The step is skipped and the grads are overwritten by the params.
+            self.assertTrue(optimizer.has_overflow_and_reset_param(write_chunk_buff))
+            for fp16_chunk_id, fp32_chunk_id in zip(fp16_chunk_ids, fp32_chunk_ids):
+                fp16_payload = client.chunk_list[fp16_chunk_id].payload
+                fp32_payload = client.chunk_list[fp32_chunk_id].payload
+                numel = optimizer._used_numel(fp16_chunk_id)
+                self.assertTrue(
+                    torch.equal(
+                        fp16_payload[:numel].cpu(), fp32_payload[:numel].half().cpu()
+                    )
+                )
+
+    @distributed_test(world_size=[1])
+    def test_chunk_buffs_reused(self):
+        def model_provider():
+            cfg = BertConfig()
+            cfg.vocab_size = 10
+            cfg.num_hidden_layers = 2
+            model = BertModel(cfg)
+            return model
+
+        client = PatrickStarClient(0, 4 * 1024 * 1024)
+
+        torch.manual_seed(0)
+        with PSPreProcessCtx(client, dtype=torch.float):
+            ps_model = model_provider()
+
+        optimizer = FP16Adam(client, ps_model.parameters())
+        optimizer.prepare_chunk_buffs(2)
+        read_chunk_buff = optimizer.read_chunk_buff
+        cpu_payload = read_chunk_buff.cpu_payload
+        self.assertEqual(cpu_payload.numel(), client.chunk_list.max_chunk_size())
+        self.assertIsNotNone(read_chunk_buff.gpu_payload)
+        optimizer.read_chunk_buff.reset()
+        optimizer.write_chunk_buff.reset()
+        self.assertIsNone(read_chunk_buff.gpu_payload)
+        self.assertIsNone(optimizer.write_chunk_buff.gpu_fp32_buff)
+
+        # The next step reuses the buffers, the pinned buffer is not
+        # allocated again.
+        optimizer.prepare_chunk_buffs(0)
+        self.assertIs(optimizer.read_chunk_buff, read_chunk_buff)
+        self.assertIs(read_chunk_buff.cpu_payload, cpu_payload)
+        self.assertIsNone(read_chunk_buff.gpu_payload)
+        self.assertIsNotNone(optimizer.write_chunk_buff.gpu_fp32_buff)
+
+    @distributed_test(world_size=[1])
+    def test_hybrid_adam_placement(self):
+        def model_provider():
+            cfg = BertConfig()
+            cfg.vocab_size = 10
+            cfg.num_hidden_layers = 2
+            model = BertModel(cfg)
+            return model
+
+        config = {"mem_tracer": {}, "opts": {"hybrid_adam_placement": "cost_model"}}
+        client = PatrickStarClient(0, 4 * 1024 * 1024, config=config)
+
+        torch.manual_seed(0)
+        with PSPreProcessCtx(client, dtype=torch.float):
+            ps_model = model_provider()
+
+        optimizer = FP16Adam(client, ps_model.parameters())
+        placement = optimizer.placement
+        self.assertIsNotNone(placement)
+        chunk_groups = optimizer.hybrid_adam_chunk_groups()
+        self.assertEqual(
+            [chunk_group[0] for chunk_group in chunk_groups],
+            list(client.chunk_ids_generator(ChunkType.PARAM_FP16)),
+        )
+        for _, _, state_chunk_ids in chunk_groups:
+            self.assertEqual(len(state_chunk_ids), 2)
+
+        def place(chunk_group, device):
+            fp16_chunk_id, fp32_chunk_id, state_chunk_ids = chunk_group
+            for chunk_id in [fp16_chunk_id, fp32_chunk_id] + state_chunk_ids:
+                chunk = client.chunk_list[chunk_id]
+                if chunk.get_device() is None:
+                    chunk.allocate_payload(device)
+                else:
+                    chunk.move(device)
+
+        # With all the chunks on CPU, moving 18 bytes per element over PCIe
+        # is slower than the CPU update.
+        placement.pcie_bandwidth = 12e9
+        placement.cpu_adam_throughput = 1e9
+        for chunk_group in chunk_groups:
+            place(chunk_group, torch.device("cpu:0"))
+        self.assertEqual(placement.plan(chunk_groups, 1), set())
+
+        # The chunk with all its chunks on GPU is updated on GPU.
+        place(chunk_groups[-1], torch.device("cuda:0"))
+        self.assertEqual(placement.plan(chunk_groups, 1), {chunk_groups[-1][0]})
+        self.assertEqual(placement.decisions[-1]["gpu_cost"], 0)
+        self.assertEqual(placement.plan(chunk_groups, 0), set())
+
+    @distributed_test(world_size=[1])
+    def test_half_write_back(self):
+        def model_provider():
+            cfg = BertConfig()
+            cfg.vocab_size = 10
+            cfg.num_hidden_layers = 2
+            model = BertModel(cfg)
+            return model
+
+        config = {"mem_tracer": {}, "opts": {"with_half_write_back": True}}
+        client = PatrickStarClient(0, 4 * 1024 * 1024, config=config)
+
+        torch.manual_seed(0)
+        with PSPreProcessCtx(client, dtype=torch.float):
+            ps_model = model_provider()
+
+        optimizer = FP16Adam(client, ps_model.parameters(), use_foreach_adam=True)
+        optimizer.prepare_chunk_buffs(0)
+        write_chunk_buff = optimizer.write_chunk_buff
+        # No GPU buffer with the fp16 staging buffer.
+        self.assertIsNone(write_chunk_buff.gpu_fp32_buff)
+        self.assertEqual(write_chunk_buff.cpu_half_buff.dtype, torch.half)
+
+        fp16_chunk_ids = list(client.chunk_ids_generator(ChunkType.PARAM_FP16))
+        fp32_chunk_ids = list(client.chunk_ids_generator(ChunkType.PARAM_FP32))
+        for fp16_chunk_id, fp32_chunk_id in zip(fp16_chunk_ids, fp32_chunk_ids):
+            client.chunk_list[fp16_chunk_id].move(torch.device("cuda:0"))
+            client.chunk_list[fp32_chunk_id].move(torch.device("cpu:0"))
+            client.chunk_list[fp32_chunk_id].payload.uniform_()
+
+        for p, _ in optimizer.chunk_ordered_params():
+            fp32_param = client.param_fp16_to_param_fp32_map[p]
+            write_chunk_buff.write_from_cache(p, fp32_param)
+        write_chunk_buff.reset()
+
+        for p, _ in optimizer.chunk_ordered_params():
+            fp32_param = client.param_fp16_to_param_fp32_map[p]
+            fp16_info = client.chunk_tensor_index.get_tensor_info(p.ps_attr.data_id())
+            fp32_info = client.chunk_tensor_index.get_tensor_info(
+                fp32_param.ps_attr.data_id()
+            )
+            fp16_data = client.chunk_list[fp16_info.chunk_id].payload.narrow(
+                0, fp16_info.start_offset, fp16_info.numel
+            )
+            fp32_data = client.chunk_list[fp32_info.chunk_id].payload.narrow(
+                0, fp32_info.start_offset, fp32_info.numel
+            )
+            self.assertTrue(torch.equal(fp16_data.cpu(), fp32_data.half()))
+
+        # The params skipped by the optimizer keep their fp16 values, instead
+        # of the values left in the staging buffer by the previous chunk.
+        old_fp16_payloads = [
+            client.chunk_list[chunk_id].payload.clone() for chunk_id in fp16_chunk_ids
+        ]
+        for fp32_chunk_id in fp32_chunk_ids:
+            client.chunk_list[fp32_chunk_id].payload.uniform_()
+        skipped = set()
+        for p, _ in optimizer.chunk_ordered_params():
+            fp16_chunk_id = client.chunk_tensor_index.get_chunk_id(p, AccessType.DATA)
+            if fp16_chunk_id not in skipped:
+                skipped.add(fp16_chunk_id)
+                continue
+            fp32_param = client.param_fp16_to_param_fp32_map[p]
+            write_chunk_buff.write_from_cache(p, fp32_param)
+        write_chunk_buff.reset()
+
+        skipped = set()
+        for p, _ in optimizer.chunk_ordered_params():
+            fp32_param = client.param_fp16_to_param_fp32_map[p]
+            fp16_info = client.chunk_tensor_index.get_tensor_info(p.ps_attr.data_id())
+            fp32_info = client.chunk_tensor_index.get_tensor_info(
+                fp32_param.ps_attr.data_id()
+            )
+            fp16_data = client.chunk_list[fp16_info.chunk_id].payload.narrow(
+                0, fp16_info.start_offset, fp16_info.numel
+            )
+            if fp16_info.chunk_id not in skipped:
+                skipped.add(fp16_info.chunk_id)
+                old_payload = old_fp16_payloads[
+                    fp16_chunk_ids.index(fp16_info.chunk_id)
+                ]
+                expected = old_payload.narrow(
+                    0, fp16_info.start_offset, fp16_info.numel
+                )
+            else:
+                expected = client.chunk_list[fp32_info.chunk_id].payload.narrow(
+                    0, fp32_info.start_offset, fp32_info.numel
+                )
+            self.assertTrue(torch.equal(fp16_data.cpu(), expected.half().cpu()))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,81 @@
+# BSD 3-Clause License
+#
+# Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the psutil authors nor the names of its contributors
+#    may be used to endorse or promote products derived from this software without
+#    specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+
+import torch
+
+from patrickstar.fp16 import LossScaler, DynamicLossScaler
+
+
+class TestOverflowFlag(unittest.TestCase):
+    def check_flag(self, device):
+        x = torch.randn(1024, device=device).half()
+        flag = DynamicLossScaler.inf_or_nan_flag(x)
+        self.assertEqual(flag.device, x.device)
+        self.assertFalse(flag.item())
+
+        # Large finite fp16 values do not overflow the fp32 accumulation.
+        x.fill_(60000)
+        self.assertFalse(DynamicLossScaler.inf_or_nan_flag(x).item())
+
+        for bad in [float("inf"), -float("inf"), float("nan")]:
+            y = x.clone()
+            y[17] = bad
+            self.assertTrue(DynamicLossScaler.inf_or_nan_flag(y).item())
+            self.assertTrue(DynamicLossScaler._has_inf_or_nan(y))
+
+        # inf and -inf in the same tensor.
+        x[0] = float("inf")
+        x[1] = -float("inf")
+        self.assertTrue(DynamicLossScaler.inf_or_nan_flag(x).item())
+
+    def test_flag_cpu(self):
+        self.check_flag(torch.device("cpu:0"))
+
+    @unittest.skipIf(not torch.cuda.is_available(), "requires cuda")
+    def test_flag_gpu(self):
+        self.check_flag(torch.device("cuda:0"))
+
+    def test_sparse_grad(self):
+        indices = torch.tensor([[0, 3]])
+        values = torch.tensor([[1.0, 2.0], [float("nan"), 0.0]])
+        grad = torch.sparse_coo_tensor(indices, values, (8, 2))
+        self.assertTrue(DynamicLossScaler.inf_or_nan_flag(grad).item())
+        values[1, 0] = 1.0
+        grad = torch.sparse_coo_tensor(indices, values, (8, 2))
+        self.assertFalse(DynamicLossScaler.inf_or_nan_flag(grad).item())
+
+    def test_static_loss_scaler(self):
+        x = torch.tensor([float("inf")])
+        self.assertIsNone(LossScaler.inf_or_nan_flag(x))
+
+
+if __name__ == "__main__":
+    unittest.main()
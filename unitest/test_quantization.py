@@ -0,0 +1,121 @@
+# BSD 3-Clause License
+#
+# Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the psutil authors nor the names of its contributors
+#    may be used to endorse or promote products derived from this software without
+#    specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+
+import torch
+
+from patrickstar.ops.quantization import (
+    LOG_CODES_PER_OCTAVE,
+    num_quant_blocks,
+    dequantize_blockwise,
+    dequantize_blockwise_log,
+    quantize_blockwise_,
+    quantize_blockwise_log_,
+)
+
+
+class TestBlockwiseQuantization(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+
+    def check_round_trip(self, data, block_size):
+        quant = torch.zeros(data.shape, dtype=torch.int8)
+        absmax = torch.zeros(num_quant_blocks(data.numel(), block_size))
+        quantize_blockwise_(data.clone(), quant, absmax, block_size)
+        out = torch.empty(data.shape)
+        dequantize_blockwise(quant, absmax, block_size, out)
+
+        # The error of every element is bounded by half a step of its block.
+        flat = data.view(-1)
+        step = absmax.repeat_interleave(block_size)[: flat.numel()] / 127
+        err = (out.view(-1) - flat).abs()
+        self.assertTrue(torch.all(err <= step / 2 * (1 + 1e-5) + 1e-12))
+        return out
+
+    def check_log_round_trip(self, data, block_size, signed):
+        quant = torch.zeros(data.shape, dtype=torch.int8)
+        absmax = torch.zeros(num_quant_blocks(data.numel(), block_size))
+        quantize_blockwise_log_(data.clone(), quant, absmax, block_size, signed)
+        out = torch.empty(data.shape)
+        dequantize_blockwise_log(quant, absmax, block_size, out, signed)
+
+        # The relative error of the values in the range of the codes is
+        # bounded, the smaller ones are coded as the smallest value.
+        flat = data.view(-1).abs()
+        num_codes = 127 if signed else 255
+        min_ratio = 2 ** (-(num_codes - 1) / LOG_CODES_PER_OCTAVE)
+        min_value = absmax.repeat_interleave(block_size)[: flat.numel()] * min_ratio
+        out_flat = out.view(-1)
+        in_range = flat >= min_value
+        rel_err = (out_flat - data.view(-1)).abs() / flat.clamp(min=1e-30)
+        max_rel_err = 2 ** (0.5 / LOG_CODES_PER_OCTAVE) - 1
+        self.assertTrue(torch.all(rel_err[in_range] <= max_rel_err * (1 + 1e-4)))
+        below = ~in_range & (flat > 0)
+        self.assertTrue(
+            torch.allclose(out_flat[below].abs(), min_value[below], rtol=1e-4)
+        )
+        if signed:
+            self.assertTrue(torch.equal(out_flat.sign(), data.view(-1).sign()))
+        return out
+
+    def test_round_trip(self):
+        for shape in [(1023,), (64, 32), (3, 2048)]:
+            for block_size in [128, 2048]:
+                self.check_round_trip(torch.randn(shape), block_size)
+
+    def test_log_round_trip(self):
+        for shape in [(1023,), (64, 32), (3, 2048)]:
+            for block_size in [128, 2048]:
+                # Values spread over many orders of magnitude.
+                spread = 10 ** torch.empty(shape).uniform_(-8, 0)
+                self.check_log_round_trip(torch.rand(shape) * spread, block_size, False)
+                self.check_log_round_trip(torch.randn(shape) * spread, block_size, True)
+
+    def test_log_small_values(self):
+        # The tiny values keep their relative precision, instead of being
+        # flushed to zero by the linear code.
+        data = torch.tensor([1.0, 1e-6, 1e-8, 0.0])
+        out = self.check_log_round_trip(data, 4, False)
+        self.assertTrue(torch.all(out > 0))
+        out = self.check_log_round_trip(data, 4, True)
+        self.assertTrue(torch.all(out[:2] > 0))
+        self.assertEqual(out[3].item(), 0.0)
+
+    def test_zero_block(self):
+        data = torch.zeros(100)
+        out = self.check_round_trip(data, 32)
+        self.assertTrue(torch.all(out == 0))
+        for signed in [False, True]:
+            out = self.check_log_round_trip(data, 32, signed)
+            self.assertTrue(torch.all(out == 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+# BSD 3-Clause License
+#
+# Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  * Neither the name of the psutil authors nor the names of its contributors
+#    may be used to endorse or promote products derived from this software without
+#    specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import copy
+import unittest
+
+import torch
+
+from common import distributed_test
+from patrickstar.core import (
+    PatrickStarClient,
+    AccessType,
+    register_param,
+    ChunkType,
+    TrainingStage,
+    ModuleAccessPlan,
+)
+from patrickstar.core.hook import (
+    post_sub_module_forward_function,
+    pre_sub_module_forward_function,
+)
+from patrickstar.core.parameter import ParamType
+from patrickstar.ops import TiledEmbedding, TiledLinear
+
+
+class TestTiling(unittest.TestCase):
+    def setUp(self):
+        self.default_chunk_size = 40
+
+    def test_tiled_linear(self):
+        for in_splits, out_splits in [(1, 1), (2, 2)]:
+            for in_f, out_f in [(32, 32), (23, 29), (29, 23)]:
+                base = torch.nn.Linear(in_f, out_f)
+                test = TiledLinear(
+                    in_f,
+                    out_f,
+                    bias=True,
+                    init_linear=copy.deepcopy(base),
+                    out_splits=out_splits,
+                    in_splits=in_splits,
+                )
+                self.assertEqual(len(test.ps_tiles), in_splits * out_splits)
+
+                inp = torch.rand(in_f)
+                base_out = base(copy.deepcopy(inp))
+                test_out = test(copy.deepcopy(inp))
+                self.assertTrue(torch.allclose(base_out, test_out, rtol=1e-4))
+
+    def test_tiled_embedding(self):
+        base = torch.nn.Embedding(23, 8)
+        test = TiledEmbedding(23, 8, num_splits=3, init_embedding=base)
+        self.assertEqual(len(test.ps_tiles), 3)
+
+        input_ids = torch.tensor([[0, 7, 8, 15, 16, 22]])
+        self.assertTrue(torch.allclose(base(input_ids), test(input_ids)))
+
+        test(input_ids).sum().backward()
+        base(input_ids).sum().backward()
+        grad = torch.cat([tile.weight.grad for tile in test.ps_tiles])
+        self.assertTrue(torch.allclose(base.weight.grad, grad))
+
+    @distributed_test(world_size=[1])
+    def test_declare_tile_order(self):
+        config = {"compute_device": "cpu", "mem_tracer": {}, "opts": {}}
+        client = PatrickStarClient(
+            rank=0, default_chunk_size=self.default_chunk_size, config=config
+        )
+        # Every tile has 4 x 8 + 8 = 40 elements, which fills a chunk.
+        linear = TiledLinear(4, 24, out_splits=3)
+        for tile in linear.ps_tiles:
+            for name, param in tile.named_parameters():
+                register_param(param, ParamType.CHUNK_BASED, torch.half, name)
+            client.append_tensor(
+                list(tile.parameters()),
+                torch.half,
+                AccessType.DATA,
+                ChunkType.PARAM_FP16,
+            )
+        chunk_ids = [
+            client.chunk_tensor_index.get_chunk_id(tile.weight, AccessType.DATA)
+            for tile in linear.ps_tiles
+        ]
+        self.assertEqual(len(set(chunk_ids)), 3)
+
+        client.declare_tile_order(linear.ps_tiles)
+        fwd_next = client._declared_next_chunk[TrainingStage.FWD]
+        bwd_next = client._declared_next_chunk[TrainingStage.BWD]
+        self.assertEqual(
+            fwd_next, {chunk_ids[0]: chunk_ids[1], chunk_ids[1]: chunk_ids[2]}
+        )
+        self.assertEqual(
+            bwd_next, {chunk_ids[2]: chunk_ids[1], chunk_ids[1]: chunk_ids[0]}
+        )
+
+    @unittest.skipIf(not torch.cuda.is_available(), "The prefetch needs GPU.")
+    @distributed_test(world_size=[1])
+    def test_tile_prefetch(self):
+        config = {"mem_tracer": {"use_async_mem_monitor": False}, "opts": {}}
+        client = PatrickStarClient(
+            rank=0, default_chunk_size=self.default_chunk_size, config=config
+        )
+        cpu_device = torch.device("cpu:0")
+        linear = TiledLinear(4, 24, out_splits=3)
+        ref_weights = []
+        for tile in linear.ps_tiles:
+            ref_weights.append(
+                [param.data.clone().half() for param in tile.parameters()]
+            )
+            for name, param in tile.named_parameters():
+                register_param(param, ParamType.CHUNK_BASED, torch.half, name)
+            client.append_tensor(
+                list(tile.parameters()),
+                torch.half,
+                AccessType.DATA,
+                ChunkType.PARAM_FP16,
+            )
+        # Every chunk starts in the pinned CPU memory.
+        for tile, weights in zip(linear.ps_tiles, ref_weights):
+            for param, weight in zip(tile.parameters(), weights):
+                client.access_data(param, cpu_device).copy_(weight.view(-1))
+                client.release_data(param)
+        chunk_ids = [
+            client.chunk_tensor_index.get_chunk_id(tile.weight, AccessType.DATA)
+            for tile in linear.ps_tiles
+        ]
+        client.declare_tile_order(linear.ps_tiles)
+
+        client.set_warmup(True)
+        client.set_training_phase(TrainingStage.FWD)
+        inp = torch.rand(2, 4, device=client.device).half()
+        for i, tile in enumerate(linear.ps_tiles):
+            if i > 0:
+                # The chunk of the tile was prefetched in the FWD of the
+                # previous tile.
+                self.assertEqual(
+                    client.chunk_list[chunk_ids[i]].get_device().type, "cuda"
+                )
+            plan = ModuleAccessPlan(tile, client)
+            pre_sub_module_forward_function(tile, client, f"tile_{i}", plan)
+            out = tile(inp)
+            post_sub_module_forward_function(tile, client, f"tile_{i}", plan)
+            ref_out = torch.nn.functional.linear(
+                inp,
+                ref_weights[i][0].to(client.device),
+                ref_weights[i][1].to(client.device),
+            )
+            self.assertTrue(torch.equal(out, ref_out))
+
+
+if __name__ == "__main__":
+    unittest.main()